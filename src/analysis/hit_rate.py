@@ -38,8 +38,8 @@ class HitRate:
         fund_list = list(map(lambda t: t[0], fund_list))
         end_date = date + timedelta(days=self.rebalance_period)
         benchmark_return = self.benchmark.query_range_return(date, end_date)
-        for fund in fund_list:
-            range_return = self.market.query_range_return(fund, date, end_date)
+        range_returns = self.market.query_range_returns(fund_list, date, end_date)
+        for fund, range_return in zip(fund_list, range_returns):
             rows.append(
                 {
                     "date": date,
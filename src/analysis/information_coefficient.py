@@ -32,8 +32,9 @@ class InformationCoefficient:
         rows = []
         fund_list = self.factor.get_fund_list(date)
         end_date = date + timedelta(days=self.rebalance_period)
-        for rank, fund in enumerate(reversed(fund_list)):
-            range_return = self.market.query_range_return(fund, date, end_date)
+        fund_list = list(reversed(fund_list))
+        range_returns = self.market.query_range_returns(fund_list, date, end_date)
+        for rank, (fund, range_return) in enumerate(zip(fund_list, range_returns)):
             rows.append(
                 {
                     "date": date,
@@ -1,8 +1,13 @@
+import warnings
+
+import numpy as np
+
+from src.perf.profiler import profile_phase, profiled
 from src.strategy import OrderType, StopGainAndLoss
 
 
 class BackTest:
-    def __init__(self, portfolio, strategy, market, rebalance):
+    def __init__(self, portfolio, strategy, market, rebalance, event_driven=True):
         self.portfolio = portfolio
         self.date_df = self.portfolio.date_df.clone()
         # start trading from the second day
@@ -11,30 +16,101 @@ class BackTest:
         self.market = market
         self.rebalance = rebalance
         self.prev_rebalance_index = 0
+        # jump over the days without any trade, see fast_forward
+        if event_driven and market.return_cube is None:
+            warnings.warn(
+                "the market has no return cube, the backtest runs day by day, "
+                "build the market with Market(..., return_cube=True) to fast forward"
+            )
+            event_driven = False
+        self.event_driven = event_driven
 
+    @profiled
     def run(self):
-        last_index = self.portfolio.value_book[-1]["index"]
+        last_index = len(self.date_df) - 1
         while self.iter_index <= last_index:
+            if self.event_driven and self.fast_forward():
+                continue
             self.cur_date = self.date_df.item(self.iter_index, 0)
             self.iterate()
             self.iter_index += 1
         self.portfolio.finish()
 
+    @profiled
+    def fast_forward(self):
+        """
+        mark to market all days before the next rebalance or stop in one step
+
+        only when the return cube covers the whole segment,
+        otherwise run day by day
+        """
+        stop_index = self.get_next_rebalance_index()
+        if stop_index <= self.iter_index:
+            return False
+
+        securities = self.portfolio.hold_securities(self.iter_index - 1)
+        dates = self.date_df.to_series().slice(
+            self.iter_index, stop_index - self.iter_index
+        )
+        returns = self.market.query_return_matrix(securities, dates)
+        if returns is None:
+            return False
+        value_path = self.get_value_path(securities, returns)
+        if len(value_path) == 0:
+            return False
+        self.portfolio.mark_to_market_segment(self.iter_index, securities, value_path)
+        self.iter_index += len(value_path)
+        return True
+
+    def get_next_rebalance_index(self):
+        """
+        the next rebalance day from iter_index on, the number of days if none
+        """
+        stop_index = self.rebalance.next_rebalance_index(
+            self.iter_index, self.prev_rebalance_index
+        )
+        if stop_index is None:
+            return len(self.date_df)
+        return stop_index
+
+    def get_value_path(self, securities, returns):
+        """
+        value of the holdings from iter_index on, see Portfolio.get_value_path,
+        cut before the first day the strategy trades,
+        that day runs through the daily path
+        """
+        value_path = self.portfolio.get_value_path(self.iter_index, securities, returns)
+        trigger_index = self.strategy.first_trigger_index(
+            securities, value_path, self.prev_rebalance_index
+        )
+        if trigger_index is not None:
+            value_path = value_path[:trigger_index]
+        return value_path
+
+    @profiled
     def iterate(self):
         # update daily return first
         # security needs to have value in yesterday
-        for security in self.portfolio.hold_securities(self.iter_index - 1):
-            daily_return = self.market.query_return(security, self.cur_date)
-            self.portfolio.update_security_value(
-                security, self.iter_index, daily_return
-            )
-        self.portfolio.update_portfolio(self.iter_index)
+        securities = self.portfolio.hold_securities(self.iter_index - 1)
+        with profile_phase("Market.query_returns"):
+            daily_returns = self.market.query_returns(securities, self.cur_date)
+        with profile_phase("Portfolio.mark_to_market"):
+            self.portfolio.mark_to_market(self.iter_index, securities, daily_returns)
+        self.trade()
 
+    def trade(self):
         # apply strategy
-        for security in self.portfolio.hold_securities(self.iter_index):
-            order = self.strategy.get_order(
-                security, self.iter_index, self.prev_rebalance_index
-            )
+        with profile_phase("Strategy.get_orders"):
+            self.apply_strategy()
+
+        # apply rebalance
+        if self.rebalance.check_and_run(self.iter_index, self.prev_rebalance_index):
+            self.prev_rebalance_index = self.iter_index
+
+    def apply_strategy(self):
+        for order in self.strategy.get_orders(
+            self.iter_index, self.prev_rebalance_index
+        ):
             if order.type == OrderType.BUY:
                 self.portfolio.add_security_weight(
                     order.security, order.weight, self.iter_index
@@ -47,9 +123,109 @@ class BackTest:
                 if isinstance(self.strategy, StopGainAndLoss):
                     self.prev_rebalance_index = self.iter_index
                     self.rebalance.run(self.iter_index)
+                    # the range of every holding restarts, no more stop today
+                    break
             else:
                 pass
 
-        # apply rebalance
-        if self.rebalance.check_and_run(self.iter_index, self.prev_rebalance_index):
-            self.prev_rebalance_index = self.iter_index
+
+class MultiLegBackTest:
+    """
+    advance the backtests of several legs, e.g. long, short and mid, in one day loop
+
+    all legs should share the market and the trading dates,
+    the daily return of the day is queried once for all legs
+    """
+
+    def __init__(self, backtests):
+        self.backtests = backtests
+        self.market = backtests[0].market
+        self.date_df = backtests[0].date_df
+        self.iter_index = 1
+        # jump over the days without any trade in all legs, see fast_forward
+        self.event_driven = all(backtest.event_driven for backtest in backtests)
+
+    @profiled
+    def run(self):
+        last_index = len(self.date_df) - 1
+        while self.iter_index <= last_index:
+            if self.event_driven and self.fast_forward():
+                continue
+            self.cur_date = self.date_df.item(self.iter_index, 0)
+            self.iterate()
+            self.iter_index += 1
+        for backtest in self.backtests:
+            backtest.portfolio.finish()
+
+    @profiled
+    def fast_forward(self):
+        """
+        mark to market every leg up to the earliest rebalance or stop of any leg,
+        see BackTest.fast_forward
+
+        the returns of the segment are queried once for all legs
+        """
+        for backtest in self.backtests:
+            backtest.iter_index = self.iter_index
+        stop_index = min(
+            backtest.get_next_rebalance_index() for backtest in self.backtests
+        )
+        if stop_index <= self.iter_index:
+            return False
+
+        leg_securities = [
+            backtest.portfolio.hold_securities(self.iter_index - 1)
+            for backtest in self.backtests
+        ]
+        securities = list(dict.fromkeys(s for leg in leg_securities for s in leg))
+        dates = self.date_df.to_series().slice(
+            self.iter_index, stop_index - self.iter_index
+        )
+        returns = self.market.query_return_matrix(securities, dates)
+        if returns is None:
+            return False
+        security_column = {
+            security: column for column, security in enumerate(securities)
+        }
+
+        value_paths = [
+            backtest.get_value_path(
+                securities, returns[:, [security_column[s] for s in securities]]
+            )
+            for backtest, securities in zip(self.backtests, leg_securities)
+        ]
+        segment_length = min(len(value_path) for value_path in value_paths)
+        if segment_length == 0:
+            return False
+        for backtest, securities, value_path in zip(
+            self.backtests, leg_securities, value_paths
+        ):
+            backtest.portfolio.mark_to_market_segment(
+                self.iter_index, securities, value_path[:segment_length]
+            )
+        self.iter_index += segment_length
+        return True
+
+    @profiled
+    def iterate(self):
+        leg_securities = [
+            backtest.portfolio.hold_securities(self.iter_index - 1)
+            for backtest in self.backtests
+        ]
+        securities = list(dict.fromkeys(s for leg in leg_securities for s in leg))
+        with profile_phase("Market.query_returns"):
+            daily_returns = self.market.query_returns(securities, self.cur_date)
+        security_return = dict(zip(securities, daily_returns))
+
+        for backtest, securities in zip(self.backtests, leg_securities):
+            backtest.iter_index = self.iter_index
+            backtest.cur_date = self.cur_date
+            with profile_phase("Portfolio.mark_to_market"):
+                backtest.portfolio.mark_to_market(
+                    self.iter_index,
+                    securities,
+                    np.array(
+                        [security_return[s] for s in securities], dtype=np.float64
+                    ),
+                )
+            backtest.trade()
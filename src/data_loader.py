@@ -1,41 +1,153 @@
-from datetime import datetime, timedelta
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
 
 import polars as pl
 import yfinance
 
+from src.parquet_dataset import (
+    append_monthly_table,
+    get_max_date,
+    write_monthly_table,
+    write_sorted_parquet,
+)
+from src.sector.max_price import write_security_max_price
+
+# wide workbooks converted to parquet, see get_wide_table
+WIDE_CACHE_DIR = "data/cache"
+# number of securities melted at a time, bounds the memory of melt_wide_table
+MELT_CHUNK_ROWS = 100
+
+
+def get_wide_table(file_name, read_options=None):
+    """
+    path of the workbook converted to parquet, sorted by SEDOL7 if any
+
+    the workbook is parsed once, later calls reuse the cache until the workbook
+    is replaced
+    """
+    source = Path("data") / file_name
+    cache = Path(WIDE_CACHE_DIR) / f"{source.stem}.parquet"
+    if cache.exists() and cache.stat().st_mtime_ns >= source.stat().st_mtime_ns:
+        return cache
+    if read_options is None:
+        data = pl.read_excel(source)
+    else:
+        data = pl.read_excel(source, read_options=read_options)
+    if "SEDOL7" in data.columns:
+        data = data.sort("SEDOL7", maintain_order=True)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, other writers never see a partial cache
+    tmp_cache = cache.parent / f".{cache.name}.{os.getpid()}.tmp"
+    data.write_parquet(tmp_cache)
+    os.replace(tmp_cache, cache)
+    return cache
+
+
+def get_header_date(header):
+    """
+    date of a column header like 20231130 or 20231130.0, None if not a date
+    """
+    try:
+        return datetime.strptime(header.split(".")[0], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def melt_wide_table(
+    file_name,
+    table,
+    id_columns,
+    variable_name,
+    value_name,
+    transform,
+    read_options=None,
+    start_date=None,
+):
+    """
+    lazy long table of a wide workbook, one row per security and column header
+
+    id_columns maps the id columns of the workbook to the new names,
+    transform is applied to the long table of every chunk.
+    the cache is melted MELT_CHUNK_ROWS securities at a time into part files,
+    the chunks follow the order of SEDOL7, thus sorting each chunk by sedol7
+    sorts the whole table.
+    with start_date, only the columns of the dates after it are melted,
+    None if there is no such column
+    """
+    cache = get_wide_table(file_name, read_options)
+    columns = list(pl.read_parquet_schema(cache))
+    if start_date is not None:
+        columns = [
+            column
+            for column in columns
+            if column in id_columns
+            or (get_header_date(column) or start_date) > start_date
+        ]
+        if len(columns) == len(id_columns):
+            return None
+    part_dir = Path(WIDE_CACHE_DIR) / "long" / table
+    part_dir.mkdir(parents=True, exist_ok=True)
+    for file in part_dir.glob("*.parquet"):
+        file.unlink()
+    num_rows = pl.scan_parquet(cache).select(pl.len()).collect().item()
+    part_paths = []
+    for offset in range(0, max(num_rows, 1), MELT_CHUNK_ROWS):
+        data = (
+            pl.scan_parquet(cache)
+            .select(columns)
+            .slice(offset, MELT_CHUNK_ROWS)
+            .collect()
+        )
+        data = data.rename(id_columns)
+        data = data.melt(
+            id_vars=list(id_columns.values()),
+            variable_name=variable_name,
+            value_name=value_name,
+        )
+        part_path = part_dir / f"part-{offset // MELT_CHUNK_ROWS:05d}.parquet"
+        transform(data).write_parquet(part_path)
+        part_paths.append(part_path)
+    return pl.concat([pl.scan_parquet(path) for path in part_paths], how="vertical")
+
 
 def write_sector_weight():
     filename = "Weight_MSCI USA_20001229_20231130.xlsx"
     table = "us_sector_weight"
-    data = pl.read_excel("data/" + filename)
-    data = data.rename({"": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"], variable_name="date", value_name="weight"
-    )
-    data = data.with_columns(
-        pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
-        pl.col("weight").cast(pl.Float32),
+    data = melt_wide_table(
+        filename,
+        table,
+        {"SEDOL7": "sedol7", "": "company"},
+        "date",
+        "weight",
+        lambda data: data.with_columns(
+            pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
+            pl.col("weight").cast(pl.Float32),
+        ).sort("sedol7", "date"),
     )
-    data = data.sort("sedol7", "date")
-    data.write_parquet(f"parquet/base/{table}.parquet")
+    data.sink_parquet(f"parquet/base/{table}.parquet")
 
 
 def write_sector_info():
     filename = "GICS_MSCI USA_20001229_20231130.xlsx"
     table = "us_sector_info"
-    data = pl.read_excel("data/" + filename)
-    data = data.rename({"": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"], variable_name="date", value_name="sector"
-    )
-    data = data.with_columns(
-        pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
+    data = melt_wide_table(
+        filename,
+        table,
+        {"SEDOL7": "sedol7", "": "company"},
+        "date",
+        "sector",
+        lambda data: data.with_columns(
+            pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
+        ).sort("sedol7", "date"),
     )
-    data = data.sort("sedol7", "date")
-    data.write_parquet(f"parquet/base/{table}.parquet")
+    data.sink_parquet(f"parquet/base/{table}.parquet")
 
 
-def write_sales_growth_data():
+def write_sales_growth_data(incremental=False):
     file_names = [
         "Sales Gth FY1_MSCI USA_20001231-20231130.xlsx",
         "Sales Gth NTM_MSCI USA_20001231-20231130.xlsx",
@@ -47,16 +159,26 @@ def write_sales_growth_data():
         "us_sales_growth_ttm",
     ]
     for file_name, table in zip(file_names, tables):
-        data = pl.read_excel(f"data/{file_name}")
-        data = data.rename({"": "company", "SEDOL7": "sedol7"})
-        data = data.melt(
-            id_vars=["sedol7", "company"], variable_name="date", value_name="growth"
+        root = f"parquet/sales_growth/{table}"
+        start_date = get_max_date(root) if incremental else None
+        data = melt_wide_table(
+            file_name,
+            table,
+            {"SEDOL7": "sedol7", "": "company"},
+            "date",
+            "growth",
+            lambda data: data.with_columns(
+                pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
+                pl.col("growth").cast(pl.Float32, strict=False),
+            ),
+            start_date=start_date,
         )
-        data = data.with_columns(
-            pl.col("date").str.split(".").list.get(0).str.to_date("%Y%m%d"),
-            pl.col("growth").cast(pl.Float32, strict=False),
-        )
-        data.write_parquet(f"parquet/sales_growth/{table}.parquet")
+        if data is None:
+            continue
+        if start_date is None:
+            write_monthly_table(data.collect(), root)
+        else:
+            append_monthly_table(data.collect(), root)
 
 
 def write_market_open_date():
@@ -99,8 +221,9 @@ def write_us_fund_return_data():
         )
         data.append(part)
     data = pl.concat(data, how="vertical")
-    data = data.sort(["lipper_id", "end_date"])
-    data.write_parquet(f"parquet/fund_return/{table}.parquet")
+    write_sorted_parquet(
+        data, f"parquet/fund_return/{table}.parquet", "lipper_id", "end_date"
+    )
 
 
 def write_sedol_ticker_mapping():
@@ -121,28 +244,30 @@ def write_eps_data():
     ]
     tables = ["us_security_eps_quarterly", "us_security_eps_annually"]
     for file_name, table in zip(file_names, tables):
-        data = pl.read_excel(f"data/{file_name}")
-        data = data.rename({"Name": "company", "SEDOL7": "sedol7"})
-        data = data.melt(
-            id_vars=["sedol7", "company"], variable_name="date", value_name="eps"
-        )
-        data = data.with_columns(
-            pl.col("date").str.to_date("%Y%m%d"), pl.col("eps").cast(pl.Float32)
+        data = melt_wide_table(
+            file_name,
+            table,
+            {"SEDOL7": "sedol7", "Name": "company"},
+            "date",
+            "eps",
+            lambda data: data.with_columns(
+                pl.col("date").str.to_date("%Y%m%d"), pl.col("eps").cast(pl.Float32)
+            ),
         )
-        data.write_parquet(f"parquet/cape/{table}.parquet")
+        data.sink_parquet(f"parquet/cape/{table}.parquet")
 
 
 def write_cape_us_price_data():
     file_name = "Price_MSCI USA_20001231-20231130.xlsx"
     table = "us_security_price_daily"
 
-    data = pl.read_excel(f"data/{file_name}")
-    data = data.rename({"": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"], variable_name="date", value_name="price"
-    )
-    data = (
-        data.with_columns(
+    data = melt_wide_table(
+        file_name,
+        table,
+        {"SEDOL7": "sedol7", "": "company"},
+        "date",
+        "price",
+        lambda data: data.with_columns(
             pl.col("date").str.to_date("%Y%m%d"),
             pl.col("price").cast(pl.Float32, strict=False),
         )
@@ -152,54 +277,86 @@ def write_cape_us_price_data():
                 "sedol7",
                 "date",
             ]
-        )
+        ),
     )
-    data.write_parquet(f"parquet/cape/{table}.parquet")
+    # read by the sectors and by the second ingestion stage
+    data.sink_parquet(f"parquet/base/{table}.parquet")
+
+
+def is_sorted_by_id_date(data, id_column, date_column):
+    """
+    a linear check, cheaper than sorting a table which is sorted already
+    """
+    prev_id = pl.col(id_column).shift(1)
+    return data.select(
+        (
+            (pl.col(id_column) > prev_id)
+            | (
+                (pl.col(id_column) == prev_id)
+                & (pl.col(date_column) > pl.col(date_column).shift(1))
+            )
+        )
+        .fill_null(True)
+        .all()
+    ).item()
 
 
-def write_cape_us_sedol_return_data():
-    file_name = "Price_MSCI USA_20001231-20231130.xlsx"
-    table = "us_security_sedol_return_daily"
+def get_sedol_return(price, open_date, cumulative=True):
+    """
+    schema: "sedol7", "date", "return", with cumulative also "cum_return"
+
+    price: "sedol7", "date", "price"
+    open_date: "date", the market open days
 
-    data = pl.read_excel(f"data/{file_name}")
-    data = data.rename({"": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"], variable_name="date", value_name="price"
+    return of a market open day against the previous open day with a price,
+    a missing price is skipped, thus the return after it covers the gap.
+    cum_return is the running sum of return per sedol, the range return of
+    Market is the difference of two rows
+    """
+    data = price.filter(pl.col("price").is_not_null()).join(
+        open_date, on="date", how="semi"
     )
+    if not is_sorted_by_id_date(data, "sedol7", "date"):
+        data = data.sort(["sedol7", "date"])
+    # sorted by sedol and date, the previous row is the previous open day of the
+    # same sedol unless the sedol changes, no need to group
     data = (
         data.with_columns(
-            pl.col("date").str.to_date("%Y%m%d"),
-            pl.col("price").cast(pl.Float32, strict=False),
-        )
-        .select("sedol7", "date", "price")
-        .sort(
-            [
-                "sedol7",
-                "date",
-            ]
-        )
-    )
-    prev_data = data.select(
-        (pl.col("date") + timedelta(days=1)).alias("next_day"),
-        pl.col("sedol7"),
-        pl.col("price").alias("prev_price"),
-    )
-    data = (
-        data.join(
-            prev_data,
-            how="inner",
-            left_on=["sedol7", "date"],
-            right_on=["sedol7", "next_day"],
-        )
-        .with_columns(
-            ((pl.col("price") - pl.col("prev_price")) / pl.col("prev_price")).alias(
-                "return"
+            pl.when(pl.col("sedol7") == pl.col("sedol7").shift(1))
+            .then(
+                pl.col("price").cast(pl.Float64)
+                / pl.col("price").cast(pl.Float64).shift(1)
+                - 1
             )
+            .cast(pl.Float32)
+            .alias("return")
         )
         .filter(pl.col("return").is_not_null())
         .select("sedol7", "date", "return")
     )
-    data.write_parquet(f"parquet/fund_return/{table}.parquet")
+    if cumulative:
+        data = data.with_columns(
+            pl.col("return")
+            .cast(pl.Float64)
+            .cum_sum()
+            .over("sedol7")
+            .alias("cum_return")
+        )
+    return data
+
+
+def write_cape_us_sedol_return_data(cumulative=True):
+    """
+    derived from the price table of write_cape_us_price_data, run it first
+    """
+    table = "us_security_sedol_return_daily"
+
+    data = get_sedol_return(
+        pl.read_parquet("parquet/base/us_security_price_daily.parquet"),
+        pl.read_parquet("parquet/base/us_market_open_date.parquet"),
+        cumulative,
+    )
+    write_sorted_parquet(data, f"parquet/fund_return/{table}.parquet", "sedol7", "date")
 
 
 def write_cpi_data():
@@ -248,40 +405,50 @@ def write_cpi_data():
 
 def write_income_report_date():
     table = "us_security_income_report_announcement_date"
-    data = pl.read_excel("data/Income Report Dates.xlsx")
-    data = data.rename({"Name": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"],
-        variable_name="report_date",
-        value_name="announcement_date",
-    )
-    data = data.with_columns(
-        pl.col("report_date").str.to_date("%Y%m%d"),
-        pl.col("announcement_date").str.to_date("%Y%m%d"),
+    data = melt_wide_table(
+        "Income Report Dates.xlsx",
+        table,
+        {"SEDOL7": "sedol7", "Name": "company"},
+        "report_date",
+        "announcement_date",
+        lambda data: data.with_columns(
+            pl.col("report_date").str.to_date("%Y%m%d"),
+            pl.col("announcement_date").str.to_date("%Y%m%d"),
+        ),
     )
-    data.write_parquet(f"parquet/cape/{table}.parquet")
+    data.sink_parquet(f"parquet/cape/{table}.parquet")
 
 
-def write_roe_data():
+def write_roe_data(incremental=False):
     file_names = [
         "ROE NTM_MSCI USA_20001231-20231130.xlsx",
         "ROE FY1_MSCI USA_20001231-20231130.xlsx",
     ]
     tables = ["us_security_roe_ntm_monthly", "us_security_roe_fy1_monthly"]
     for file_name, table in zip(file_names, tables):
-        data = pl.read_excel(f"data/{file_name}")
-        data = data.rename({"": "company", "SEDOL7": "sedol7"})
-        data = data.melt(
-            id_vars=["sedol7", "company"], variable_name="date", value_name="roe"
+        root = f"parquet/roe/{table}"
+        start_date = get_max_date(root) if incremental else None
+        data = melt_wide_table(
+            file_name,
+            table,
+            {"SEDOL7": "sedol7", "": "company"},
+            "date",
+            "roe",
+            lambda data: data.with_columns(
+                pl.col("date").str.to_date("%Y%m%d"),
+                pl.col("roe").cast(pl.Float32, strict=False),
+            ),
+            start_date=start_date,
         )
-        data = data.with_columns(
-            pl.col("date").str.to_date("%Y%m%d"),
-            pl.col("roe").cast(pl.Float32, strict=False),
-        )
-        data.write_parquet(f"parquet/roe/{table}.parquet")
+        if data is None:
+            continue
+        if start_date is None:
+            write_monthly_table(data.collect(), root)
+        else:
+            append_monthly_table(data.collect(), root)
 
 
-def write_dividend_yield_data():
+def write_dividend_yield_data(incremental=False):
     file_names = [
         "NTM Dividend Yield_MSCI USA_20001231-20231130.xlsx",
         "12M Dividend Yield_MSCI USA_20001231-20231130.xlsx",
@@ -291,38 +458,122 @@ def write_dividend_yield_data():
         "us_security_dividend_yield_fy1_monthly",
     ]
     for file_name, table in zip(file_names, tables):
-        data = pl.read_excel(f"data/{file_name}")
-        data = data.rename({"": "company", "SEDOL7": "sedol7"})
-        data = data.melt(
-            id_vars=["sedol7", "company"],
-            variable_name="date",
-            value_name="dividend_yield",
+        root = f"parquet/dividend_yield/{table}"
+        start_date = get_max_date(root) if incremental else None
+        data = melt_wide_table(
+            file_name,
+            table,
+            {"SEDOL7": "sedol7", "": "company"},
+            "date",
+            "dividend_yield",
+            lambda data: data.with_columns(
+                pl.col("date").str.to_date("%Y%m%d"),
+                pl.col("dividend_yield").cast(pl.Float32, strict=False),
+            ),
+            start_date=start_date,
         )
-        data = data.with_columns(
-            pl.col("date").str.to_date("%Y%m%d"),
-            pl.col("dividend_yield").cast(pl.Float32, strict=False),
-        )
-        data.write_parquet(f"parquet/dividend_yield/{table}.parquet")
+        if data is None:
+            continue
+        if start_date is None:
+            write_monthly_table(data.collect(), root)
+        else:
+            append_monthly_table(data.collect(), root)
 
 
 def write_volume_data():
     file_name = "Volume.xlsx"
     table = "us_security_volume_daily"
-    data = pl.read_excel(
-        f"data/{file_name}", read_options={"infer_schema_length": 5000}
-    )
-    data = data.rename({"Name": "company", "SEDOL7": "sedol7"})
-    data = data.melt(
-        id_vars=["sedol7", "company"],
-        variable_name="date",
-        value_name="volume",
+    data = melt_wide_table(
+        file_name,
+        table,
+        {"SEDOL7": "sedol7", "Name": "company"},
+        "date",
+        "volume",
+        lambda data: data.with_columns(
+            pl.col("date").str.to_date("%Y%m%d", strict=False),
+            pl.col("volume").cast(pl.Float32, strict=False),
+        ).filter(pl.col("date").is_not_null()),
+        read_options={"infer_schema_length": 5000},
     )
-    data = data.with_columns(
-        pl.col("date").str.to_date("%Y%m%d", strict=False),
-        pl.col("volume").cast(pl.Float32, strict=False),
-    ).filter(pl.col("date").is_not_null())
-    data.write_parquet(f"parquet/volume/{table}.parquet")
+    data.sink_parquet(f"parquet/volume/{table}.parquet")
+
+
+def write_security_max_price_data():
+    """
+    52 week high panel of the price table read by FiftyTwoWeekHighSector
+    """
+    write_security_max_price("parquet/base/us_security_price_daily.parquet")
+
+
+# writers of a stage are independent of each other,
+# a stage only reads the tables written by the previous stages
+INGESTION_STAGES = [
+    [
+        write_cape_us_price_data,
+        write_volume_data,
+        write_sector_weight,
+        write_sector_info,
+        write_sales_growth_data,
+        write_roe_data,
+        write_dividend_yield_data,
+        write_eps_data,
+        write_income_report_date,
+        write_us_fund_return_data,
+        write_sedol_ticker_mapping,
+        write_cpi_data,
+        write_market_open_date,
+    ],
+    [write_cape_us_sedol_return_data, write_security_max_price_data],
+]
+
+
+# writers taking incremental=True, they only append the dates not ingested yet
+INCREMENTAL_WRITERS = [
+    write_sales_growth_data,
+    write_roe_data,
+    write_dividend_yield_data,
+]
+
+
+def run_ingestion(writers=None, max_workers=None, incremental=False):
+    """
+    run the writers over a process pool, stage by stage, see INGESTION_STAGES
+
+    the largest workbooks go first, a worker holds one workbook at a time.
+    with incremental, the writers of INCREMENTAL_WRITERS only append new dates,
+    the others still rebuild their tables
+    """
+    if max_workers is None:
+        max_workers = min(4, os.cpu_count())
+    # polars deadlocks in forked workers, spawn a fresh interpreter instead
+    with ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for stage in INGESTION_STAGES:
+            futures = [
+                (
+                    executor.submit(writer, incremental=True)
+                    if incremental and writer in INCREMENTAL_WRITERS
+                    else executor.submit(writer)
+                )
+                for writer in stage
+                if writers is None or writer.__name__ in writers
+            ]
+            for future in futures:
+                future.result()
 
 
 if __name__ == "__main__":
-    write_volume_data()
+    writer_names = [writer.__name__ for stage in INGESTION_STAGES for writer in stage]
+    parser = argparse.ArgumentParser(
+        description="convert the workbooks under data/ into the parquet tables"
+    )
+    parser.add_argument("--writer", nargs="+", default=None, choices=writer_names)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="append only the new dates of the monthly factor tables",
+    )
+    args = parser.parse_args()
+    run_ingestion(args.writer, args.workers, args.incremental)
@@ -0,0 +1,58 @@
+import polars as pl
+
+
+class EventLog:
+    """
+    trading events of a backtest: initial buy, rebalance and stop gain/loss
+
+    events are appended to in-memory columns, one row per security,
+    finish() exports them as a dataframe.
+    printing every event to the console is opt-in, e.g. for an interactive run
+    """
+
+    schema = {
+        "date": pl.Date,
+        "event": pl.String,
+        "security": pl.String,
+        "sector": pl.String,
+        "weight_change": pl.Float64,
+    }
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.columns = {column: [] for column in self.schema}
+        self.event_df = None
+
+    def record(self, date, event, position_change):
+        """
+        position_change is a list of (security, weight change)
+        """
+        for security, weight_change in position_change:
+            self.columns["date"].append(date)
+            self.columns["event"].append(event)
+            self.columns["security"].append(str(security))
+            self.columns["sector"].append(security.sector)
+            self.columns["weight_change"].append(weight_change)
+
+        if self.verbose:
+            print(self.format(date, event, position_change))
+
+    def format(self, date, event, position_change):
+        if event in ("stop gain", "stop loss"):
+            return f"{date}: {event} {position_change[0][0]}"
+        positions = [(s.display(), round(w, 3)) for s, w in position_change]
+        if event == "initial":
+            return f"initially buy on {date}: {positions}"
+        return f"{event} on {date}: {positions}"
+
+    def finish(self):
+        """
+        schema: "date", "event", "security", "sector", "weight_change"
+        """
+        self.event_df = pl.DataFrame(self.columns, schema=self.schema)
+        return self.event_df
+
+    def write_parquet(self, path):
+        if self.event_df is None:
+            self.finish()
+        self.event_df.write_parquet(path)
@@ -1,36 +1,75 @@
 from abc import ABC, abstractmethod
 
+from src.perf.profiler import profiled
+from src.security_symbol import SecuritySymbol
+
 
 class BaseFactor(ABC):
+    # symbol types of the security universe the factor supports
+    security_types = (SecuritySymbol,)
+
     def __init__(self, security_universe, factor_type):
         self.security_universe = security_universe
         self.factor_type = factor_type
         # hyperparameter, always return 3 funds in the sector rotation
         self.num = 3
+        # key is the date, shared by all legs of the factor, see get_leg
+        self.fund_list_cache = {}
 
-    def set_portfolio_at_start(self, portfolio):
-        position = self.get_position(portfolio.start_date)
-        print(
-            f"initially buy on {portfolio.start_date}: {list(map(lambda t: (t[0].display(), round(t[1],3)), position))}"
-        )
+    def set_portfolio_at_start(self, portfolio, factor_type=None):
+        position = self.get_position(portfolio.start_date, factor_type)
+        portfolio.event_log.record(portfolio.start_date, "initial", position)
         for security, weight in position:
             portfolio.add_security_weight(security, weight, 0)
 
-    def get_position(self, date):
-        security_list = self.get_fund_list(date)
-        if self.factor_type == "long":
+    @profiled
+    def get_position(self, date, factor_type=None):
+        """
+        factor_type defaults to the one of the factor,
+        the fund list of the date is computed once for all factor types
+        """
+        if factor_type is None:
+            factor_type = self.factor_type
+        security_list = self.get_cached_fund_list(date)
+        if factor_type == "long":
             target_security = security_list[: self.num]
-        elif self.factor_type == "short":
+        elif factor_type == "short":
             target_security = list(reversed(security_list))[: self.num]
-        elif self.factor_type == "mid":
+        elif factor_type == "mid":
             target_security = list(reversed(security_list))[
                 self.num + 1 : self.num + 1 + self.num
             ]
         else:
-            raise ValueError(f"no implementation for {self.factor_type}")
+            raise ValueError(f"no implementation for {factor_type}")
         weight = 1 / len(target_security)
         return [(s, weight) for s in target_security]
 
+    def get_cached_fund_list(self, date):
+        if date not in self.fund_list_cache:
+            self.fund_list_cache[date] = self.get_fund_list(date)
+        return self.fund_list_cache[date]
+
+    def get_leg(self, factor_type):
+        return FactorLeg(self, factor_type)
+
     @abstractmethod
     def get_fund_list(self, date):
         raise NotImplementedError()
+
+
+class FactorLeg:
+    """
+    a factor type of a factor, e.g. the short leg
+
+    all legs of a factor share its fund list, thus the ranking is computed once
+    """
+
+    def __init__(self, factor, factor_type):
+        self.factor = factor
+        self.factor_type = factor_type
+
+    def set_portfolio_at_start(self, portfolio):
+        self.factor.set_portfolio_at_start(portfolio, self.factor_type)
+
+    def get_position(self, date):
+        return self.factor.get_position(date, self.factor_type)
@@ -1,8 +1,12 @@
 from src.factor.base_factor import BaseFactor
 from src.sector.fifty_two_week_high_etf import FiftyTwoWeekHighEtfSector
+from src.security_symbol import SecurityTicker
 
 
 class FiftyTwoWeekHighEtfFactor(BaseFactor):
+    # the signal is the price of the ticker itself
+    security_types = (SecurityTicker,)
+
     def __init__(self, security_universe, factor_type):
         super().__init__(security_universe, factor_type)
 
@@ -18,6 +18,13 @@ class FactorAggregator(BaseFactor):
     def get_fund_list(self, date):
         raise NotImplementedError()
 
+    def prepare_sector_signal(self, observe_dates):
+        """
+        batch the sector signals of all internal sectors for many observe dates
+        """
+        for sector in self.sectors:
+            sector.prepare_sector_signal(observe_dates)
+
     def get_sector_scores(self, observe_date, normal_signal, reversed_signal):
         sector_score_list = []
         for sector in self.sectors:
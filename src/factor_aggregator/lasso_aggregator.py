@@ -126,6 +126,7 @@ class LassoModel:
 
     def fill_in_melt_X(self):
         # fill in factor and z-score
+        self.lasso_aggregator.prepare_sector_signal(self.end_date_list)
         sector_score_list = []
         for observe_date in self.end_date_list:
             sector_score_df = self.lasso_aggregator.get_sector_scores(
@@ -168,16 +169,16 @@ class LassoModel:
             .dt.month_end()
             .alias("forward_end_date"),
         )
+        forward_1mo_return = self.market.query_range_returns(
+            [
+                sector_ticker_mapping[sector]
+                for sector in self.range_return_df.get_column("sector")
+            ],
+            self.range_return_df.get_column("forward_start_date").to_numpy(),
+            self.range_return_df.get_column("forward_end_date").to_numpy(),
+        )
         self.range_return_df = self.range_return_df.with_columns(
-            pl.struct(["sector", "forward_start_date", "forward_end_date"])
-            .map_elements(
-                lambda x: self.market.query_range_return(
-                    sector_ticker_mapping[x["sector"]],
-                    x["forward_start_date"],
-                    x["forward_end_date"],
-                )
-            )
-            .alias("forward_1mo_return")
+            pl.Series("forward_1mo_return", forward_1mo_return)
         )
         self.melt_X = self.melt_X.select(pl.all().exclude("forward_1mo_return")).join(
             self.range_return_df.select("end_date", "sector", "forward_1mo_return"),
@@ -1,42 +1,55 @@
-import time
-from pathlib import Path
-
 import numpy as np
-import pandas as pd
 import polars as pl
-import yfinance
 
+from src.price_store import scan_ticker_price, split_by_ticker
 from src.security_symbol import SecurityLipper, SecuritySedol, SecurityTicker
 
 
 class Market:
-    def __init__(self, securities, start_date, end_date):
+    def __init__(self, securities, start_date, end_date, return_cube=False):
         self.start_date = start_date
         self.end_date = end_date
         self.securities = securities
         self.data = dict()
+        self.security_column = {
+            security: column for column, security in enumerate(securities)
+        }
         if isinstance(securities[0], SecurityTicker):
-            return self.load_ticker_return_data()
-        if isinstance(securities[0], SecurityLipper):
-            return self.load_lipper_return_data()
-        if isinstance(securities[0], SecuritySedol):
-            return self.load_sedol_return_data()
-        raise ValueError("secirity type not supported")
+            self.load_ticker_return_data()
+        elif isinstance(securities[0], SecurityLipper):
+            self.load_lipper_return_data()
+        elif isinstance(securities[0], SecuritySedol):
+            self.load_sedol_return_data()
+        else:
+            raise ValueError("secirity type not supported")
+
+        # opt-in dense return matrix, see build_return_cube
+        self.return_cube = None
+        self.date_row = dict()
+        if return_cube:
+            self.build_return_cube()
+
+        # prefix arrays for range return, built on the first range query
+        self.range_key = None
+        self.range_prefix = None
+        self.range_prefix_before = None
 
     def load_ticker_return_data(self):
-        for security in self.securities:
-            path = Path(f"parquet/ticker/{str(security)}.parquet")
-            if not path.exists():
-                data = self.retrive_data_from_yfinance(security)
-                data = pl.from_pandas(data)
-                data.write_parquet(path)
-                time.sleep(1)
-            self.data[security] = (
-                pl.scan_parquet(path)
-                .filter(pl.col("date") >= self.start_date)
-                .filter(pl.col("date") <= self.end_date)
-                .collect()
+        """
+        the whole universe is read from the price store in one scan
+        """
+        tickers = [str(security) for security in self.securities]
+        price_data = split_by_ticker(
+            scan_ticker_price(tickers, self.start_date, self.end_date).collect()
+        )
+        missing_tickers = [ticker for ticker in tickers if ticker not in price_data]
+        if len(missing_tickers) > 0:
+            raise ValueError(
+                f"{missing_tickers} not in the price store, "
+                f"run python -m src.price_store append --ticker {' '.join(missing_tickers)}"
             )
+        for security in self.securities:
+            self.data[security] = price_data[str(security)]
             earliest_date = self.data[security].get_column("date").item(0)
             if earliest_date < self.start_date:
                 print(
@@ -44,36 +57,220 @@ class Market:
                 )
 
     def load_lipper_return_data(self):
-        # TODO: maybe filter on lipper_id
+        lipper_ids = [int(security.lipper_id) for security in self.securities]
         self.data = (
             pl.scan_parquet("parquet/fund_return/us_fund_daily_return_lipperid.parquet")
+            .select(["lipper_id", "end_date", "return"])
+            .filter(pl.col("lipper_id").is_in(lipper_ids))
             .filter(pl.col("end_date") >= self.start_date)
             .filter(pl.col("end_date") <= self.end_date)
             .collect()
         )
 
     def load_sedol_return_data(self):
-        # TODO: maybe filter on lipper_id
+        sedol_ids = [security.sedol_id for security in self.securities]
+        table = "parquet/fund_return/us_security_sedol_return_daily.parquet"
+        columns = ["sedol7", "date", "return"]
+        # written by data_loader.get_sedol_return with cumulative
+        if "cum_return" in pl.read_parquet_schema(table):
+            columns.append("cum_return")
         self.data = (
-            pl.scan_parquet(
-                "parquet/fund_return/us_security_sedol_return_daily.parquet"
-            )
+            pl.scan_parquet(table)
+            .select(columns)
+            .filter(pl.col("sedol7").is_in(sedol_ids))
             .filter(pl.col("date") >= self.start_date)
             .filter(pl.col("date") <= self.end_date)
             .collect()
         )
 
-    def retrive_data_from_yfinance(self, security):
-        ticker = str(security)
-        data = yfinance.download(ticker, start="2000-01-01", end="2023-12-31")
-        data["return"] = np.divide(
-            data["Adj Close"] - data["Adj Close"].shift(1), data["Adj Close"].shift(1)
+    def build_return_cube(self):
+        """
+        date x security matrix of daily return, built once at load time
+
+        rows are aligned to us_market_open_date, columns to self.securities.
+        missing value follows the same rule as query_*_return, which is 0
+        """
+        date_df = (
+            pl.scan_parquet("parquet/base/us_market_open_date.parquet")
+            .filter(pl.col("date") >= self.start_date)
+            .filter(pl.col("date") <= self.end_date)
+            .sort(pl.col("date"))
+            .collect()
+            .with_row_index("row")
         )
-        data.columns = data.columns.str.lower()
-        data["date"] = pd.to_datetime(data.index).date
-        return data
+        self.date_row = {
+            date: row for row, date in date_df.select("row", "date").iter_rows()
+        }
+        if isinstance(self.securities[0], SecurityTicker):
+            return_df = self.get_ticker_return_df()
+        elif isinstance(self.securities[0], SecurityLipper):
+            return_df = self.get_lipper_return_df()
+        else:
+            return_df = self.get_sedol_return_df()
+        return_df = return_df.join(date_df, on="date", how="inner")
+
+        self.return_cube = np.zeros((len(date_df), len(self.securities)))
+        self.return_cube[
+            return_df.get_column("row").to_numpy(),
+            return_df.get_column("column").to_numpy(),
+        ] = return_df.get_column("return").to_numpy()
+
+    def get_ticker_return_df(self):
+        """
+        schema: "column", "date", "return"
+        """
+        return_df_list = []
+        for security in self.securities:
+            return_df = (
+                self.data[security]
+                .filter(pl.col("return").is_not_null())
+                .filter(pl.col("date").is_unique())
+                .select(
+                    pl.lit(self.security_column[security], dtype=pl.UInt32).alias(
+                        "column"
+                    ),
+                    pl.col("date"),
+                    pl.col("return").cast(pl.Float64),
+                )
+            )
+            return_df_list.append(return_df)
+        return pl.concat(return_df_list)
+
+    def get_lipper_return_df(self):
+        """
+        schema: "column", "date", "return"
+        """
+        return_df = (
+            self.data.filter(pl.col("return").is_not_null())
+            .filter(pl.len().over(["lipper_id", "end_date"]) == 1)
+            .join(self.get_security_column_df(), on="lipper_id", how="inner")
+            .select(
+                pl.col("column"),
+                pl.col("end_date").alias("date"),
+                (pl.col("return").cast(pl.Float64) * 0.01).alias("return"),
+            )
+        )
+        return return_df
+
+    def get_sedol_return_df(self):
+        """
+        schema: "column", "date", "return"
+        """
+        return_df = (
+            self.data.filter(pl.col("return").is_not_null())
+            .filter(pl.len().over(["sedol7", "date"]) == 1)
+            .filter(pl.col("return").abs() < 0.5)
+            .join(self.get_security_column_df(), on="sedol7", how="inner")
+            .select(
+                pl.col("column"),
+                pl.col("date"),
+                pl.col("return").cast(pl.Float64),
+            )
+        )
+        return return_df
+
+    def get_security_column_df(self):
+        """
+        map the id column of lipper or sedol return data to the security column
+        """
+        if isinstance(self.securities[0], SecurityLipper):
+            column_df = pl.DataFrame(
+                {
+                    "lipper_id": [int(s.lipper_id) for s in self.security_column],
+                    "column": list(self.security_column.values()),
+                },
+                schema_overrides={"column": pl.UInt32},
+            ).with_columns(pl.col("lipper_id").cast(self.data.schema["lipper_id"]))
+        else:
+            column_df = pl.DataFrame(
+                {
+                    "sedol7": [s.sedol_id for s in self.security_column],
+                    "column": list(self.security_column.values()),
+                },
+                schema_overrides={"column": pl.UInt32},
+            )
+        return column_df
+
+    def build_range_index(self):
+        """
+        prefix arrays for query_range_returns, sorted by (security column, date)
+
+        ticker: adj close, range return is the ratio of the last and first price
+        lipper: cumulative log return, compounded between two prefix entries
+        sedol: cumulative sum of daily return, same as summing over the range,
+               read from the cum_return column if the table has it
+
+        range_prefix_before is the prefix of the previous row of the security
+        """
+        if isinstance(self.securities[0], SecurityTicker):
+            prefix_df = pl.concat(
+                [
+                    self.data[security]
+                    .filter(pl.col("return").is_not_null())
+                    .select(
+                        pl.lit(column, dtype=pl.UInt32).alias("column"),
+                        pl.col("date"),
+                        pl.col("adj close").cast(pl.Float64).alias("prefix"),
+                        pl.col("adj close").cast(pl.Float64).alias("prefix_before"),
+                    )
+                    for security, column in self.security_column.items()
+                ]
+            ).sort(["column", "date"])
+        elif "cum_return" in self.data.columns:
+            prefix_df = (
+                self.data.filter(pl.col("return").is_not_null())
+                .join(self.get_security_column_df(), on="sedol7", how="inner")
+                .select(
+                    pl.col("column"),
+                    pl.col("date"),
+                    pl.col("cum_return").alias("prefix"),
+                    (pl.col("cum_return") - pl.col("return").cast(pl.Float64)).alias(
+                        "prefix_before"
+                    ),
+                )
+                .sort(["column", "date"])
+            )
+        else:
+            if isinstance(self.securities[0], SecurityLipper):
+                value_df = self.data.join(
+                    self.get_security_column_df(), on="lipper_id", how="inner"
+                ).select(
+                    pl.col("column"),
+                    pl.col("end_date").alias("date"),
+                    (pl.col("return").cast(pl.Float64) * 0.01).log1p().alias("value"),
+                )
+            else:
+                value_df = self.data.join(
+                    self.get_security_column_df(), on="sedol7", how="inner"
+                ).select(
+                    pl.col("column"),
+                    pl.col("date"),
+                    pl.col("return").cast(pl.Float64).alias("value"),
+                )
+            prefix_df = (
+                value_df.filter(pl.col("value").is_not_null())
+                .sort(["column", "date"])
+                .with_columns(pl.col("value").cum_sum().over("column").alias("prefix"))
+                .with_columns(
+                    pl.col("prefix")
+                    .shift(1, fill_value=0.0)
+                    .over("column")
+                    .alias("prefix_before")
+                )
+            )
+
+        self.range_key = (
+            prefix_df.get_column("column").cast(pl.Int64).to_numpy() << 32
+        ) + prefix_df.get_column("date").cast(pl.Int64).to_numpy()
+        self.range_prefix = prefix_df.get_column("prefix").to_numpy()
+        self.range_prefix_before = prefix_df.get_column("prefix_before").to_numpy()
 
     def query_return(self, security, date):
+        if self.return_cube is not None:
+            row = self.date_row.get(date)
+            column = self.security_column.get(security)
+            if row is not None and column is not None:
+                return self.return_cube[row, column].item()
         if isinstance(security, SecurityTicker):
             return self.query_ticker_return(security, date)
         elif isinstance(security, SecurityLipper):
@@ -83,6 +280,76 @@ class Market:
         else:
             raise ValueError(f"unexpected type: {security}")
 
+    def query_returns(self, securities, date):
+        """
+        daily return of many securities, aligned with the input order
+        """
+        if self.return_cube is not None and date in self.date_row:
+            columns = [self.security_column.get(s) for s in securities]
+            if None not in columns:
+                return self.return_cube[self.date_row[date], columns]
+        return np.array(
+            [self.query_return(security, date) for security in securities],
+            dtype=np.float64,
+        )
+
+    def query_return_matrix(self, securities, dates):
+        """
+        daily return of many securities over many dates, date x security
+
+        only answered from the return cube, None if it can't answer all of them
+        """
+        if self.return_cube is None:
+            return None
+        rows = [self.date_row.get(date) for date in dates]
+        columns = [self.security_column.get(s) for s in securities]
+        if None in rows or None in columns:
+            return None
+        return self.return_cube[np.ix_(rows, columns)]
+
+    def query_range_returns(self, securities, start_dates, end_dates):
+        """
+        range return of many windows, answered by two prefix entries each
+
+        start_dates and end_dates are either a single date
+        or aligned with securities, both ends are included
+        """
+        if self.range_key is None:
+            self.build_range_index()
+        columns = np.array(
+            [self.security_column[security] for security in securities],
+            dtype=np.int64,
+        )
+        start_days = np.asarray(start_dates, dtype="datetime64[D]").astype(np.int64)
+        end_days = np.asarray(end_dates, dtype="datetime64[D]").astype(np.int64)
+        columns, start_days, end_days = np.broadcast_arrays(
+            columns, start_days, end_days
+        )
+        if len(self.range_key) == 0:
+            return np.zeros(len(columns))
+
+        first = np.searchsorted(self.range_key, (columns << 32) + start_days, "left")
+        last = np.searchsorted(self.range_key, (columns << 32) + end_days, "right") - 1
+        count = last - first + 1
+        first = np.minimum(first, len(self.range_key) - 1)
+        last = np.maximum(last, 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if isinstance(self.securities[0], SecurityTicker):
+                range_return = (
+                    self.range_prefix[last] / self.range_prefix_before[first] - 1
+                )
+                valid = (count > 1) & (range_return < 1)
+            elif isinstance(self.securities[0], SecurityLipper):
+                range_return = np.expm1(
+                    self.range_prefix[last] - self.range_prefix_before[first]
+                )
+                valid = (count > 0) & (range_return < 1)
+            else:
+                range_return = self.range_prefix[last] - self.range_prefix_before[first]
+                valid = (count > 0) & (np.abs(range_return) < 5)
+        return np.where(valid, range_return, 0.0)
+
     def query_range_return(self, security, start_date, end_date):
         if isinstance(security, SecurityTicker):
             return self.query_ticker_range_return(security, start_date, end_date)
@@ -130,36 +397,13 @@ class Market:
             return 0
 
     def query_ticker_range_return(self, security, start_date, end_date):
-        res = (
-            self.data[security]
-            .filter(pl.col("date") >= start_date)
-            .filter(pl.col("date") <= end_date)
-            .filter(pl.col("return").is_not_null())
-            .sort(pl.col("date"))
-            .get_column("adj close")
-        )
-        range_return = res.item(-1) / res.item(0) - 1
-        if len(res) > 1 and range_return < 1:
-            return range_return
-        else:
-            return 0
+        return self.query_range_returns([security], start_date, end_date).item(0)
 
     def query_sedol_range_return(self, security, start_date, end_date):
-        res = (
-            self.data.filter(pl.col("sedol7") == security.sedol_id)
-            .filter(pl.col("date") >= start_date)
-            .filter(pl.col("date") <= end_date)
-            .filter(pl.col("return").is_not_null())
-            .group_by("sedol7")
-            .agg(pl.col("return").sum().alias("return"))
-        )
-        if len(res) == 1 and abs(res.get_column("return").item(0)) < 5:
-            return res.get_column("return").item(0)
-        else:
-            return 0
+        return self.query_range_returns([security], start_date, end_date).item(0)
 
     def query_lipper_range_return(self, security, start_date, end_date):
-        raise NotImplementedError("no implementation for lipper id")
+        return self.query_range_returns([security], start_date, end_date).item(0)
 
 
 if __name__ == "__main__":
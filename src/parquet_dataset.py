@@ -0,0 +1,327 @@
+import datetime
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import polars as pl
+
+# number of securities covered by one parquet row group
+IDS_PER_ROW_GROUP = 16
+# vintages of a dataset, see record_vintage
+MANIFEST_FILE = "_manifest.json"
+
+
+def write_sorted_parquet(data, path, id_column, date_column):
+    """
+    sort by id and date, each row group covers a few ids
+
+    thus the row group statistics could skip data when filtering on the id
+    """
+    data = data.sort([id_column, date_column])
+    rows_per_id = len(data) // max(data.get_column(id_column).n_unique(), 1)
+    data.write_parquet(
+        path,
+        statistics=True,
+        row_group_size=max(rows_per_id * IDS_PER_ROW_GROUP, 1024),
+    )
+
+
+def get_partition_path(root, year):
+    return Path(root) / f"year={year}" / "part.parquet"
+
+
+def get_partition_files(root, year):
+    """
+    part.parquet followed by the files appended later, in the order of append
+    """
+    return sorted(
+        (Path(root) / f"year={year}").glob("part*.parquet"),
+        key=lambda path: (path.name != "part.parquet", path.name),
+    )
+
+
+def get_partition_years(root):
+    """
+    years of the partitions in the dataset, sorted
+    """
+    root = Path(root)
+    if not root.exists():
+        return []
+    return sorted(
+        {
+            int(path.parent.name.split("=")[1])
+            for path in root.glob("year=*/part*.parquet")
+        }
+    )
+
+
+def read_manifest(root):
+    path = Path(root) / MANIFEST_FILE
+    if not path.exists():
+        return []
+    return json.loads(path.read_text())
+
+
+def get_content_hash(root, files):
+    """
+    hash of the names and bytes of the files, the same data gives the same hash
+    """
+    digest = hashlib.sha1()
+    for file in files:
+        digest.update(Path(file).relative_to(root).as_posix().encode())
+        digest.update(Path(file).read_bytes())
+    return digest.hexdigest()
+
+
+def record_vintage(root, files, data, date_column, full_write=False):
+    """
+    add a vintage to the manifest of the dataset, one per write that changes it,
+    downstream caches key on the vintage id
+
+    the id is the sequence number and the content hash of the files written,
+    rewriting the same files with the same data keeps the latest vintage.
+    full_write marks data as the whole dataset, the earlier vintages are replaced
+    """
+    root = Path(root)
+    manifest = read_manifest(root)
+    content_hash = get_content_hash(root, files)
+    relative_files = [Path(file).relative_to(root).as_posix() for file in files]
+    if (
+        len(manifest) > 0
+        and manifest[-1].get("content_hash") == content_hash
+        and manifest[-1]["files"] == relative_files
+        and manifest[-1].get("full_write", False) == full_write
+    ):
+        return
+    sequence = manifest[-1]["sequence"] + 1 if len(manifest) > 0 else 1
+    manifest.append(
+        {
+            "sequence": sequence,
+            "vintage": f"{sequence:05d}-{content_hash[:16]}",
+            "content_hash": content_hash,
+            "max_date": data.get_column(date_column).max().isoformat(),
+            "rows": len(data),
+            "files": relative_files,
+            "full_write": full_write,
+        }
+    )
+    tmp_path = root / f".{MANIFEST_FILE}.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp_path, root / MANIFEST_FILE)
+
+
+def get_dataset_vintage(root):
+    """
+    id of the latest vintage, None if the dataset has no manifest
+    """
+    manifest = read_manifest(root)
+    if len(manifest) == 0:
+        return None
+    return manifest[-1]["vintage"]
+
+
+def get_max_date(root, date_column="date"):
+    """
+    latest date in the dataset, None if it is empty
+
+    from the manifest, the vintages before the last full write are replaced by it
+    and never count
+    """
+    manifest = read_manifest(root)
+    if len(manifest) > 0 and len(get_partition_years(root)) > 0:
+        last_full_write = max(
+            (
+                index
+                for index, vintage in enumerate(manifest)
+                if vintage.get("full_write", False)
+            ),
+            default=0,
+        )
+        return max(
+            datetime.date.fromisoformat(vintage["max_date"])
+            for vintage in manifest[last_full_write:]
+        )
+    years = get_partition_years(root)
+    if len(years) == 0:
+        return None
+    return (
+        scan_year_partitions(root, date_column, datetime.date(years[-1], 1, 1))
+        .select(pl.col(date_column).max())
+        .collect()
+        .item()
+    )
+
+
+def replace_partition(root, year, write):
+    """
+    replace all files of a partition by part.parquet, written by write(path)
+    """
+    path = get_partition_path(root, year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file first, readers never see a partial partition
+    tmp_path = path.parent / f".part.{os.getpid()}.tmp"
+    write(tmp_path)
+    stale_paths = [file for file in get_partition_files(root, year) if file != path]
+    os.replace(tmp_path, path)
+    for stale_path in stale_paths:
+        stale_path.unlink()
+    return path
+
+
+def remove_stale_partitions(root, years):
+    """
+    remove the partitions of the years not in years, with all their files
+    """
+    for year in get_partition_years(root):
+        if year not in years:
+            for file in get_partition_files(root, year):
+                file.unlink()
+            partition = Path(root) / f"year={year}"
+            if not any(partition.iterdir()):
+                partition.rmdir()
+
+
+def write_year_partitions(data, root, id_column, date_column, merge=False):
+    """
+    write data into a dataset partitioned by the year of date_column,
+    layout: {root}/year={year}/part.parquet, each sorted by id and date
+
+    without merge, data is the whole dataset, the partitions of the years
+    not in data are removed.
+    with merge, only the partitions of the years in data are written, rows of
+    an existing partition are kept unless data has the same id and date
+    """
+    data = data.with_columns(pl.col(date_column).dt.year().alias("__year"))
+    years = data.get_column("__year").unique().sort().to_list()
+    if not merge:
+        remove_stale_partitions(root, years)
+    paths = []
+    for year in years:
+        part = data.filter(pl.col("__year") == year).drop("__year")
+        files = get_partition_files(root, year)
+        if merge and len(files) > 0:
+            columns = list(pl.read_parquet_schema(files[0]))
+            part = pl.concat(
+                [pl.read_parquet(file) for file in files] + [part.select(columns)],
+                how="vertical",
+            ).unique(subset=[id_column, date_column], keep="last")
+        paths.append(
+            replace_partition(
+                root,
+                year,
+                lambda path: write_sorted_parquet(part, path, id_column, date_column),
+            )
+        )
+    record_vintage(root, paths, data, date_column, full_write=not merge)
+
+
+def scan_year_partitions(root, date_column="date", start_date=None, end_date=None):
+    """
+    lazy scan of the partitions overlapping [start_date, end_date], both optional,
+    the other partitions are never opened
+    """
+    years = get_partition_years(root)
+    if start_date is not None:
+        years = [year for year in years if year >= start_date.year]
+    if end_date is not None:
+        years = [year for year in years if year <= end_date.year]
+    if len(years) == 0:
+        raise FileNotFoundError(f"no partition of {root} in the date range")
+    scan = pl.concat(
+        [
+            pl.scan_parquet(file)
+            for year in years
+            for file in get_partition_files(root, year)
+        ],
+        how="vertical",
+    )
+    if start_date is not None:
+        scan = scan.filter(pl.col(date_column) >= start_date)
+    if end_date is not None:
+        scan = scan.filter(pl.col(date_column) <= end_date)
+    return scan
+
+
+def write_monthly_table(data, root, date_column="date"):
+    """
+    write a monthly table as a dataset partitioned by year, see write_year_partitions
+
+    a "month" column, the first day of the month of date_column, is added as the
+    normalized month key, each partition is sorted by month.
+    a partition is a single row group, a row group per month would not share the
+    dictionary of the company names and takes 6x the disk space.
+    data is the whole table, the partitions of the years not in data are removed
+    """
+    data = data.with_columns(
+        pl.col(date_column).dt.truncate("1mo").alias("month"),
+        pl.col(date_column).dt.year().alias("__year"),
+    )
+    years = data.get_column("__year").unique().sort().to_list()
+    remove_stale_partitions(root, years)
+    paths = []
+    for year in years:
+        # stable sort, rows of a month keep the order of the source
+        part = (
+            data.filter(pl.col("__year") == year)
+            .drop("__year")
+            .sort("month", maintain_order=True)
+        )
+        paths.append(
+            replace_partition(
+                root, year, lambda path: part.write_parquet(path, statistics=True)
+            )
+        )
+    record_vintage(root, paths, data, date_column, full_write=True)
+
+
+def append_monthly_table(data, root, date_column="date"):
+    """
+    append-only counterpart of write_monthly_table, the months of data are
+    written as a new file in the partition of each year, next to the existing
+    files which are never rewritten
+
+    the caller makes sure the months are not in the dataset yet, see get_max_date
+    """
+    if len(data) == 0:
+        return
+    manifest = read_manifest(root)
+    sequence = manifest[-1]["sequence"] + 1 if len(manifest) > 0 else 1
+    data = data.with_columns(
+        pl.col(date_column).dt.truncate("1mo").alias("month"),
+        pl.col(date_column).dt.year().alias("__year"),
+    )
+    paths = []
+    for year in data.get_column("__year").unique().sort().to_list():
+        part = (
+            data.filter(pl.col("__year") == year)
+            .drop("__year")
+            .sort("month", maintain_order=True)
+        )
+        path = Path(root) / f"year={year}" / f"part-{sequence:05d}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.parent / f".part.{os.getpid()}.tmp"
+        part.write_parquet(tmp_path, statistics=True)
+        os.replace(tmp_path, path)
+        paths.append(path)
+    record_vintage(root, paths, data, date_column)
+
+
+def scan_monthly_table(root, start_month=None, end_month=None):
+    """
+    lazy scan of the months in [start_month, end_month] of a dataset written by
+    write_monthly_table, both are truncated to the first day of the month
+    """
+    if start_month is not None:
+        start_month = datetime.date(start_month.year, start_month.month, 1)
+    if end_month is not None:
+        end_month = datetime.date(end_month.year, end_month.month, 1)
+    years = get_partition_years(root)
+    if len(years) == 0:
+        raise FileNotFoundError(f"no partition of {root}")
+    if (start_month is not None and start_month.year > years[-1]) or (
+        end_month is not None and end_month.year < years[0]
+    ):
+        # months out of the table are empty, same as filtering a single file
+        return pl.scan_parquet(get_partition_files(root, years[0])[0]).clear()
+    return scan_year_partitions(root, "month", start_month, end_month)
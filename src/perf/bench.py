@@ -0,0 +1,398 @@
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import os
+import statistics
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from src.backtest import BackTest
+from src.event_log import EventLog
+from src.factor.roe import RoeFactor
+from src.fund_universe import INVESCO_SECTOR_ETF_TICKER
+from src.market import Market
+from src.perf.synthetic_data import (
+    get_sedols,
+    get_security_sectors,
+    write_synthetic_data,
+)
+from src.portfolio import Portfolio
+from src.rebalance import Rebalance
+from src.sector.cape import CapeSector
+from src.sector.dividend_yield import DividendYieldSector
+from src.sector.fifty_two_week_high import FiftyTwoWeekHighSector
+from src.sector.fifty_two_week_high_etf import FiftyTwoWeekHighEtfSector
+from src.sector.roe import RoeSector
+from src.sector.sales_growth import SalesGrowthSector
+from src.sector.volume import VolumeSector
+from src.security_symbol import SecuritySedol
+from src.strategy import StopGainAndLoss
+
+# time of a single case grows by more than this ratio against the history
+REGRESSION_TOLERANCE = 0.2
+
+
+def get_universe(num_securities):
+    return [
+        SecuritySedol(sedol, sector)
+        for sedol, sector in zip(
+            get_sedols(num_securities), get_security_sectors(num_securities)
+        )
+    ]
+
+
+class BenchContext:
+    """
+    data shared by the cases of one synthetic data set
+    """
+
+    def __init__(self, num_securities, start_date, end_date):
+        self.num_securities = num_securities
+        self.start_date = start_date
+        self.end_date = end_date
+        self.universe = get_universe(num_securities)
+        self.date_df = Portfolio(100.0, start_date, end_date).date_df
+        self.dates = self.date_df.get_column("date").to_list()
+        # last market open day of the latest months
+        month_end_df = self.date_df.group_by(
+            pl.col("date").dt.strftime("%Y-%m").alias("month")
+        ).agg(pl.col("date").max())
+        self.observe_dates = month_end_df.get_column("date").sort().to_list()[-3:]
+
+
+def bench_market_query_return(context, return_cube=False):
+    market = Market(context.universe, context.start_date, context.end_date, return_cube)
+    rng = np.random.default_rng(0)
+    securities = [
+        context.universe[i] for i in rng.integers(0, context.num_securities, 200)
+    ]
+    dates = [context.dates[i] for i in rng.integers(0, len(context.dates), 200)]
+
+    def run():
+        for security, date in zip(securities, dates):
+            market.query_return(security, date)
+
+    return run
+
+
+def get_held_portfolio(context):
+    """
+    portfolio holding every security in equal weight
+    """
+
+    portfolio = Portfolio(
+        100.0,
+        context.start_date,
+        context.end_date,
+        context.universe,
+        EventLog(verbose=False),
+    )
+    # keep a little cash, the weights never sum up to exactly 1
+    weight = 0.99 / context.num_securities
+    for security in context.universe:
+        portfolio.add_security_weight(security, weight, 0)
+    return portfolio
+
+
+def bench_portfolio_update_portfolio(context):
+    portfolio = get_held_portfolio(context)
+    rng = np.random.default_rng(0)
+    daily_returns = rng.normal(0, 0.01, (len(context.dates), context.num_securities))
+
+    def run():
+        for iter_index in range(1, len(context.dates)):
+            for security, daily_return in zip(
+                context.universe, daily_returns[iter_index]
+            ):
+                portfolio.update_security_value(security, iter_index, daily_return)
+            portfolio.update_portfolio(iter_index)
+
+    return run
+
+
+def bench_portfolio_mark_to_market(context):
+    portfolio = get_held_portfolio(context)
+    rng = np.random.default_rng(0)
+    daily_returns = rng.normal(0, 0.01, (len(context.dates), context.num_securities))
+
+    def run():
+        for iter_index in range(1, len(context.dates)):
+            portfolio.mark_to_market(
+                iter_index, context.universe, daily_returns[iter_index]
+            )
+
+    return run
+
+
+def bench_rebalance_run(context):
+    factor = RoeFactor(context.universe, "long")
+    # rebalance shaves 0.01 off the last weight for rounding, keep weights above it
+    factor.num = max(3, min(30, context.num_securities // 10))
+    portfolio = Portfolio(
+        100.0, context.start_date, context.end_date, event_log=EventLog(verbose=False)
+    )
+    rebalance = Rebalance(1, portfolio, factor, [], "1mo")
+    rebalance_indexes = rebalance.get_schedule()
+    # the ranking is timed by the sector cases, only the trades are timed here
+    for iter_index in rebalance_indexes:
+        factor.get_position(portfolio.date_df.item(iter_index, 0))
+
+    def run():
+        for iter_index in rebalance_indexes:
+            rebalance.run(iter_index)
+
+    return run
+
+
+def bench_sector_signal(context, get_sector):
+    def run():
+        for observe_date in context.observe_dates:
+            sector = get_sector(observe_date)
+            # always compute, never read the signals persisted by the last repeat
+            sector.use_signal_store = False
+            sector.impl_sector_signal(observe_date)
+
+    return run
+
+
+def get_sector_cases():
+    return {
+        "RoeSector": lambda date: RoeSector("ntm"),
+        "DividendYieldSector": lambda date: DividendYieldSector("ntm"),
+        "SalesGrowthSector": lambda date: SalesGrowthSector("ntm"),
+        "CapeSector": lambda date: CapeSector(),
+        "VolumeSector": lambda date: VolumeSector(),
+        "FiftyTwoWeekHighSector": lambda date: FiftyTwoWeekHighSector(),
+        "FiftyTwoWeekHighEtfSector": lambda date: FiftyTwoWeekHighEtfSector(
+            INVESCO_SECTOR_ETF_TICKER, date
+        ),
+    }
+
+
+def bench_backtest_run(context):
+    market = Market(
+        context.universe, context.start_date, context.end_date, return_cube=True
+    )
+
+    def run():
+        factor = RoeFactor(context.universe, "long")
+        portfolio = Portfolio(
+            100.0,
+            context.start_date,
+            context.end_date,
+            event_log=EventLog(verbose=False),
+        )
+        factor.set_portfolio_at_start(portfolio)
+        blacklist = []
+        strategy = StopGainAndLoss(portfolio, blacklist)
+        strategy.set_limit(0.2, 0.1)
+        rebalance = Rebalance(1, portfolio, factor, blacklist, "1mo")
+        BackTest(portfolio, strategy, market, rebalance).run()
+
+    return run
+
+
+def get_cases():
+    """
+    key is the case name, value builds the timed function from a BenchContext
+    """
+    cases = {
+        "Market.query_return": bench_market_query_return,
+        "Market.query_return[return_cube]": lambda context: bench_market_query_return(
+            context, True
+        ),
+        "Portfolio.update_portfolio": bench_portfolio_update_portfolio,
+        "Portfolio.mark_to_market": bench_portfolio_mark_to_market,
+        "Rebalance.run": bench_rebalance_run,
+    }
+    for name, get_sector in get_sector_cases().items():
+        cases[f"{name}.impl_sector_signal"] = (
+            lambda context, get_sector=get_sector: bench_sector_signal(
+                context, get_sector
+            )
+        )
+    cases["BackTest.run"] = bench_backtest_run
+    return cases
+
+
+def run_cases(data_dir, num_securities, start_date, end_date, case_names, repeat):
+    """
+    time the cases on one synthetic data set, one row per case
+
+    runs inside its own process, all tables are read relative to data_dir
+    and the process-wide caches never leak between data sets
+    """
+    os.chdir(data_dir)
+    context = BenchContext(num_securities, start_date, end_date)
+    cases = get_cases()
+    rows = []
+    for name in case_names:
+        run = cases[name](context)
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - start)
+        rows.append(
+            {
+                "case": name,
+                "best_seconds": min(seconds),
+                "median_seconds": statistics.median(seconds),
+            }
+        )
+    return rows
+
+
+def prepare_data(data_dir, num_securities, num_years, seed=0):
+    """
+    synthetic data set of the size, generated once and reused by later runs
+    """
+    path = Path(data_dir) / f"{num_securities}x{num_years}y_{seed}"
+    done_file = path / "done"
+    if done_file.exists():
+        start_date, end_date = done_file.read_text().split(",")
+        return (
+            path.resolve(),
+            datetime.date.fromisoformat(start_date),
+            datetime.date.fromisoformat(end_date),
+        )
+    start_date, end_date = write_synthetic_data(
+        path, num_securities, num_years, seed=seed
+    )
+    done_file.write_text(f"{start_date},{end_date}")
+    return path.resolve(), start_date, end_date
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_suite(sizes, years, case_names=None, repeat=3, data_dir="bench_data", seed=0):
+    """
+    schema: "run_at", "commit", "case", "num_securities", "num_years",
+            "repeat", "best_seconds", "median_seconds"
+
+    every data set runs in a fresh spawned process, one at a time
+    """
+    if case_names is None:
+        case_names = list(get_cases())
+    run_at = datetime.datetime.now().replace(microsecond=0)
+    commit = get_commit()
+    rows = []
+    for num_securities, num_years in itertools.product(sizes, years):
+        path, start_date, end_date = prepare_data(
+            data_dir, num_securities, num_years, seed
+        )
+        with ProcessPoolExecutor(
+            1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            case_rows = executor.submit(
+                run_cases,
+                path,
+                num_securities,
+                start_date,
+                end_date,
+                case_names,
+                repeat,
+            ).result()
+        for row in case_rows:
+            rows.append(
+                {
+                    "run_at": run_at,
+                    "commit": commit,
+                    "case": row["case"],
+                    "num_securities": num_securities,
+                    "num_years": num_years,
+                    "repeat": repeat,
+                    "best_seconds": row["best_seconds"],
+                    "median_seconds": row["median_seconds"],
+                }
+            )
+    return pl.DataFrame(rows)
+
+
+def compare_with_history(result_df, history_df, tolerance=REGRESSION_TOLERANCE):
+    """
+    baseline is the median of the best time of the same case in earlier runs,
+    regression is flagged once the best time exceeds it by the tolerance
+    """
+    key = ["case", "num_securities", "num_years"]
+    if history_df is None:
+        return result_df.with_columns(
+            pl.lit(None, dtype=pl.Float64).alias("baseline_seconds"),
+            pl.lit(None, dtype=pl.Float64).alias("ratio"),
+            pl.lit(False).alias("regression"),
+        )
+    baseline_df = history_df.group_by(key).agg(
+        pl.col("best_seconds").median().alias("baseline_seconds")
+    )
+    return (
+        result_df.join(baseline_df, on=key, how="left")
+        .with_columns(
+            (pl.col("best_seconds") / pl.col("baseline_seconds")).alias("ratio")
+        )
+        .with_columns(
+            (pl.col("ratio") > 1 + tolerance).fill_null(False).alias("regression")
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="time the engine hot paths on synthetic data, offline"
+    )
+    parser.add_argument("--size", nargs="+", type=int, default=[11, 100, 500, 2000])
+    parser.add_argument("--years", nargs="+", type=int, default=[3, 10])
+    parser.add_argument("--case", nargs="+", default=None, choices=get_cases())
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--history", default="bench_history.parquet")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    history_path = Path(args.history)
+    history_df = pl.read_parquet(history_path) if history_path.exists() else None
+    result_df = run_suite(
+        args.size, args.years, args.case, args.repeat, args.data_dir, args.seed
+    )
+    report_df = compare_with_history(result_df, history_df, args.tolerance)
+
+    if history_df is not None:
+        result_df = pl.concat([history_df, result_df], how="vertical")
+    result_df.write_parquet(history_path)
+
+    with pl.Config(tbl_rows=-1, tbl_width_chars=200, fmt_str_lengths=60):
+        print(
+            report_df.select(
+                "case",
+                "num_securities",
+                "num_years",
+                "best_seconds",
+                "median_seconds",
+                "baseline_seconds",
+                "ratio",
+                "regression",
+            )
+        )
+    regression_count = report_df.get_column("regression").sum()
+    if regression_count > 0:
+        print(f"{regression_count} case(s) regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import polars as pl
+
+# the active profiler of the process, None when profiling is disabled
+_profiler = None
+_disabled_phase = contextlib.nullcontext()
+
+
+class Phase:
+    __slots__ = ("profiler", "name", "start", "polars_start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack.append(self)
+        self.polars_start = self.profiler.polars_seconds
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self, time.perf_counter())
+        return False
+
+
+class Profiler:
+    """
+    call count, wall time and polars time of the phases of a run
+
+    wall time of a phase includes its nested phases, self time does not.
+    polars time is the time spent in LazyFrame.collect and read_parquet
+    while the phase is open
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.stack = []
+        # key is the phase name, value is [calls, wall, self, polars] seconds
+        self.stats = {}
+        self.polars_seconds = 0.0
+        # complete events of the chrome trace, see write_trace
+        self.events = []
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def record(self, phase, end):
+        self.stack.pop()
+        wall = end - phase.start
+        polars = self.polars_seconds - phase.polars_start
+        stat = self.stats.setdefault(phase.name, [0, 0.0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += wall
+        stat[2] += wall
+        stat[3] += polars
+        if len(self.stack) > 0:
+            parent = self.stats.setdefault(self.stack[-1].name, [0, 0.0, 0.0, 0.0])
+            parent[2] -= wall
+        self.events.append(
+            {
+                "name": phase.name,
+                "ph": "X",
+                "ts": (phase.start - self.origin) * 1e6,
+                "dur": wall * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {"polars_ms": polars * 1e3},
+            }
+        )
+
+    def wrap_polars(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.polars_seconds += time.perf_counter() - start
+
+        return wrapper
+
+    def report(self):
+        """
+        schema: "phase", "calls", "wall_seconds", "self_seconds", "polars_seconds"
+
+        sorted by wall time
+        """
+        return pl.DataFrame(
+            [
+                {
+                    "phase": name,
+                    "calls": calls,
+                    "wall_seconds": wall,
+                    "self_seconds": self_wall,
+                    "polars_seconds": polars,
+                }
+                for name, (calls, wall, self_wall, polars) in self.stats.items()
+            ],
+            schema={
+                "phase": pl.String,
+                "calls": pl.Int64,
+                "wall_seconds": pl.Float64,
+                "self_seconds": pl.Float64,
+                "polars_seconds": pl.Float64,
+            },
+        ).sort("wall_seconds", descending=True)
+
+    def write_trace(self, path):
+        """
+        chrome trace event format, opens in chrome://tracing, perfetto and speedscope
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def enable_profiler():
+    """
+    start profiling the phases of the process, returns the new profiler
+    """
+    global _profiler
+    disable_profiler()
+    _profiler = Profiler()
+    _profiler.collect = pl.LazyFrame.collect
+    _profiler.read_parquet = pl.read_parquet
+    pl.LazyFrame.collect = _profiler.wrap_polars(pl.LazyFrame.collect)
+    pl.read_parquet = _profiler.wrap_polars(pl.read_parquet)
+    return _profiler
+
+
+def disable_profiler():
+    """
+    stop profiling, returns the profiler stopped if any
+    """
+    global _profiler
+    profiler = _profiler
+    if profiler is not None:
+        pl.LazyFrame.collect = profiler.collect
+        pl.read_parquet = profiler.read_parquet
+        _profiler = None
+    return profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def profile_phase(name):
+    """
+    context manager timing a phase, a shared no-op when profiling is disabled
+    """
+    if _profiler is None:
+        return _disabled_phase
+    return _profiler.phase(name)
+
+
+def profiled(func):
+    """
+    profile a method as the phase "{class name}.{method name}"
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if _profiler is None:
+            return func(self, *args, **kwargs)
+        with _profiler.phase(f"{type(self).__name__}.{func.__name__}"):
+            return func(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,287 @@
+import datetime
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from src.data_loader import get_sedol_return
+from src.fund_universe import invesco_sp500_ticker_sector_etf
+from src.parquet_dataset import write_monthly_table, write_year_partitions
+from src.price_store import (
+    TICKER_MAX_PRICE_DATASET,
+    TICKER_PRICE_DATASET,
+    write_ticker_max_price,
+)
+from src.sector.max_price import SECURITY_MAX_PRICE_TABLE, write_security_max_price
+
+SECTORS = list(invesco_sp500_ticker_sector_etf)
+
+# monthly history before the backtest starts,
+# cape needs 10 years of z-score history on top of 11 years of eps
+WARM_UP_YEARS = 22
+# daily history before the backtest starts, volume looks back 2 years
+DAILY_WARM_UP_YEARS = 2
+
+
+def get_sedols(num_securities):
+    return [f"{i:07d}" for i in range(num_securities)]
+
+
+def get_security_sectors(num_securities):
+    return [SECTORS[i % len(SECTORS)] for i in range(num_securities)]
+
+
+def get_open_dates(start_date, end_date):
+    """
+    monday to friday, no holiday
+    """
+    days = np.arange(
+        np.datetime64(start_date), np.datetime64(end_date) + 1, dtype="datetime64[D]"
+    )
+    return days[np.is_busday(days)]
+
+
+def get_month_ends(open_dates):
+    """
+    calendar month end and last market open day of every month
+    """
+    months = np.unique(open_dates.astype("datetime64[M]"))
+    calendar_month_ends = (months + 1).astype("datetime64[D]") - 1
+    last = np.searchsorted(open_dates, calendar_month_ends, side="right") - 1
+    return calendar_month_ends, open_dates[last]
+
+
+def to_panel(sedols, dates, **columns):
+    """
+    long table of a security x date panel, columns are security x date arrays
+    """
+    num_securities, num_dates = len(sedols), len(dates)
+    data = {
+        "sedol7": np.repeat(np.asarray(sedols), num_dates),
+        "date": np.tile(dates, num_securities),
+    }
+    for name, value in columns.items():
+        data[name] = np.asarray(value).reshape(-1)
+    return pl.DataFrame(data).with_columns(pl.col("date").cast(pl.Date))
+
+
+def with_company(df):
+    return df.with_columns(
+        pl.concat_str(pl.lit("Company "), pl.col("sedol7")).alias("company")
+    )
+
+
+def with_null(df, column, rng, rate):
+    null = pl.Series(rng.random(len(df)) < rate)
+    return df.with_columns(
+        pl.when(null).then(None).otherwise(pl.col(column)).alias(column)
+    )
+
+
+def random_walk(rng, shape, drift=0.0002, volatility=0.015):
+    returns = rng.normal(drift, volatility, shape)
+    return 50 * np.exp(np.cumsum(np.log1p(returns), axis=1))
+
+
+def write_monthly_factor_table(path, column, sedols, month_ends, rng, loc, scale):
+    # persistent level of each security plus monthly noise
+    level = rng.normal(loc, scale, (len(sedols), 1))
+    value = level + rng.normal(0, scale / 4, (len(sedols), len(month_ends)))
+    df = to_panel(sedols, month_ends, **{column: value.astype(np.float32)})
+    df = with_null(with_company(df), column, rng, 0.02)
+    write_monthly_table(df.select("sedol7", "company", "date", column), path)
+
+
+def write_synthetic_data(root, num_securities, num_years, end_date=None, seed=0):
+    """
+    write the tables read by Market, Portfolio and the sectors under {root}/parquet,
+    with the same schema as data_loader
+
+    the backtest covers the last num_years years up to end_date,
+    securities are sedols evenly spread over the GICS sectors
+    """
+    if end_date is None:
+        end_date = datetime.date(2023, 10, 31)
+    start_date = datetime.date(end_date.year - num_years, end_date.month, 1)
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    for folder in [
+        "base",
+        "cape",
+        "roe",
+        "dividend_yield",
+        "sales_growth",
+        "volume",
+        "fund_return",
+    ]:
+        (root / "parquet" / folder).mkdir(parents=True, exist_ok=True)
+
+    sedols = get_sedols(num_securities)
+    open_dates = get_open_dates(
+        datetime.date(start_date.year - WARM_UP_YEARS, 1, 1), end_date
+    )
+    calendar_month_ends, month_ends = get_month_ends(open_dates)
+    daily_dates = open_dates[
+        open_dates
+        >= np.datetime64(datetime.date(start_date.year - DAILY_WARM_UP_YEARS, 1, 1))
+    ]
+
+    pl.DataFrame({"date": open_dates}).with_columns(
+        pl.col("date").cast(pl.Date)
+    ).write_parquet(root / "parquet/base/us_market_open_date.parquet")
+
+    # sector construction, a few securities are not classified in some months
+    sector = np.repeat(
+        np.array(get_security_sectors(num_securities))[:, None], len(month_ends), 1
+    )
+    sector[rng.random(sector.shape) < 0.02] = "--"
+    sector_df = with_company(to_panel(sedols, month_ends, sector=sector))
+    sector_df.select("sedol7", "company", "date", "sector").write_parquet(
+        root / "parquet/base/us_sector_info.parquet"
+    )
+    weight = rng.lognormal(0, 1, (num_securities, 1)) * rng.lognormal(
+        0, 0.1, (num_securities, len(month_ends))
+    )
+    weight = 100 * weight / weight.sum(axis=0)
+    weight_df = with_company(
+        to_panel(sedols, month_ends, weight=weight.astype(np.float32))
+    )
+    weight_df.select("sedol7", "company", "date", "weight").write_parquet(
+        root / "parquet/base/us_sector_weight.parquet"
+    )
+
+    # monthly factor tables
+    for category in ["ntm", "fy1"]:
+        write_monthly_factor_table(
+            root / f"parquet/roe/us_security_roe_{category}_monthly",
+            "roe",
+            sedols,
+            month_ends,
+            rng,
+            15,
+            8,
+        )
+        write_monthly_factor_table(
+            root
+            / f"parquet/dividend_yield/us_security_dividend_yield_{category}_monthly",
+            "dividend_yield",
+            sedols,
+            month_ends,
+            rng,
+            2,
+            1,
+        )
+    for category in ["ntm", "fy1", "ttm"]:
+        write_monthly_factor_table(
+            root / f"parquet/sales_growth/us_sales_growth_{category}",
+            "growth",
+            sedols,
+            month_ends,
+            rng,
+            5,
+            5,
+        )
+
+    # cpi, growing 0.2% a month
+    cpi = 100 * 1.002 ** np.arange(len(month_ends))
+    pl.DataFrame(
+        {
+            "date": month_ends,
+            "us_cpi_all": cpi,
+            "us_cpi_core": cpi,
+            "us_chained_cpi": cpi * 0.6,
+            "cn_cpi": np.full(len(month_ends), 100.0),
+            "cn_cpi_core": np.full(len(month_ends), 100.0),
+        }
+    ).with_columns(
+        pl.col("date").cast(pl.Date), pl.all().exclude("date").cast(pl.Float32)
+    ).write_parquet(
+        root / "parquet/base/us_cpi.parquet"
+    )
+
+    # eps and announcement dates on calendar month ends
+    for table in ["us_security_eps_quarterly", "us_security_eps_annually"]:
+        eps = rng.lognormal(1, 0.5, (num_securities, 1)) + rng.normal(
+            0, 0.2, (num_securities, len(calendar_month_ends))
+        )
+        eps_df = with_company(
+            to_panel(sedols, calendar_month_ends, eps=eps.astype(np.float32))
+        )
+        eps_df = with_null(eps_df, "eps", rng, 0.01)
+        eps_df.select("sedol7", "company", "date", "eps").write_parquet(
+            root / f"parquet/cape/{table}.parquet"
+        )
+    delay = rng.integers(15, 90, (num_securities, len(calendar_month_ends)))
+    announcement_df = (
+        to_panel(sedols, calendar_month_ends, delay=delay)
+        .rename({"date": "report_date"})
+        .with_columns(
+            (pl.col("report_date") + pl.duration(days=pl.col("delay"))).alias(
+                "announcement_date"
+            )
+        )
+    )
+    announcement_df = with_null(
+        with_company(announcement_df), "announcement_date", rng, 0.05
+    )
+    announcement_df.select(
+        "sedol7", "company", "report_date", "announcement_date"
+    ).write_parquet(
+        root / "parquet/cape/us_security_income_report_announcement_date.parquet"
+    )
+
+    # daily price over the whole history, cape looks up the price of old dates
+    price = random_walk(rng, (num_securities, len(open_dates)))
+    to_panel(sedols, open_dates, price=price.astype(np.float32)).write_parquet(
+        root / "parquet/base/us_security_price_daily.parquet"
+    )
+    write_security_max_price(
+        root / "parquet/base/us_security_price_daily.parquet",
+        root / SECURITY_MAX_PRICE_TABLE,
+    )
+
+    # daily return and volume
+    daily_price = price[:, -len(daily_dates) :]
+    price_df = to_panel(sedols, daily_dates, price=daily_price.astype(np.float32))
+    get_sedol_return(
+        price_df,
+        pl.DataFrame({"date": daily_dates}).with_columns(pl.col("date").cast(pl.Date)),
+    ).write_parquet(root / "parquet/fund_return/us_security_sedol_return_daily.parquet")
+    volume = rng.lognormal(13, 0.5, daily_price.shape).astype(np.float32)
+    volume_df = with_company(to_panel(sedols, daily_dates, volume=volume))
+    volume_df.select("sedol7", "company", "date", "volume").write_parquet(
+        root / "parquet/volume/us_security_volume_daily.parquet"
+    )
+
+    # sector etf, same schema as the price store
+    ticker_df_list = []
+    for ticker in invesco_sp500_ticker_sector_etf.values():
+        close = random_walk(rng, (1, len(daily_dates)))[0]
+        daily_return = np.full(len(close), np.nan)
+        daily_return[1:] = close[1:] / close[:-1] - 1
+        ticker_df_list.append(
+            pl.DataFrame(
+                {
+                    "open": close,
+                    "high": close * 1.01,
+                    "low": close * 0.99,
+                    "close": close,
+                    "adj close": close,
+                    "volume": rng.integers(10**5, 10**6, len(close)),
+                    "return": daily_return,
+                    "date": daily_dates,
+                    "ticker": ticker,
+                }
+            ).with_columns(
+                pl.col("date").cast(pl.Date), pl.col("return").fill_nan(None)
+            )
+        )
+    write_year_partitions(
+        pl.concat(ticker_df_list, how="vertical"),
+        root / TICKER_PRICE_DATASET,
+        "ticker",
+        "date",
+    )
+    write_ticker_max_price(root / TICKER_PRICE_DATASET, root / TICKER_MAX_PRICE_DATASET)
+
+    return start_date, end_date
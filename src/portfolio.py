@@ -1,31 +1,38 @@
-from collections import defaultdict
-
 import numpy as np
 import polars as pl
 
+from src.event_log import EventLog
+
 
 class Portfolio:
-    def __init__(self, initial_cash, start_date, end_date):
+    def __init__(
+        self, initial_cash, start_date, end_date, securities=None, event_log=None
+    ):
         self.date_df = self.get_market_open_date(start_date, end_date)
         self.start_date = self.date_df.item(0, 0)
         self.end_date = self.date_df.item(-1, 0)
         self.iter_index = 0
 
-        self.security_book = defaultdict(self.empty_security_book)
+        # books are stored as date x security arrays while the backtest runs,
+        # finish() converts them into the value_book and security_book dataframes
         num = len(self.date_df)
-        self.value_book = (
-            pl.DataFrame(
-                {
-                    "date": self.date_df.to_series(),
-                    "cash": pl.repeat(initial_cash, n=num, eager=True),
-                    "value": pl.repeat(initial_cash, n=num, eager=True),
-                    "turnover": pl.repeat(0, n=num, eager=True),
-                    "sector": pl.repeat("", n=num, eager=True),
-                }
-            )
-            .with_row_index()
-            .to_dicts()
-        )
+        self.security_index = {}
+        self.security_list = []
+        capacity = len(securities) if securities is not None else 16
+        self.weight_book = np.zeros((num, capacity), dtype=np.float64)
+        self.security_value_book = np.zeros((num, capacity), dtype=np.float64)
+        self.cash_book = np.full(num, initial_cash, dtype=np.float64)
+        self.total_value_book = np.full(num, initial_cash, dtype=np.float64)
+        self.turnover_book = np.zeros(num, dtype=np.float64)
+        if securities is not None:
+            for security in securities:
+                self.get_security_column(security)
+
+        self.value_book = None
+        self.security_book = {}
+        # rebalance and strategy record their trades here, see EventLog
+        self.event_log = event_log if event_log is not None else EventLog()
+        self.event_book = None
 
     def get_market_open_date(self, start_date, end_date):
         df = (
@@ -36,71 +43,149 @@ class Portfolio:
         )
         return df
 
-    def empty_security_book(self):
-        return (
-            pl.DataFrame(
-                {
-                    "date": self.date_df.to_series(),
-                    "weight": 0.0,
-                    "value": 0.0,
-                }
-            )
-            .with_row_index()
-            .to_dicts()
-        )
+    def get_security_column(self, security):
+        """
+        column of the security in the weight and value book,
+        a new column is allocated the first time a security shows up
+        """
+        column = self.security_index.get(security)
+        if column is None:
+            column = len(self.security_list)
+            if column == self.weight_book.shape[1]:
+                self.grow_security_book()
+            self.security_index[security] = column
+            self.security_list.append(security)
+        return column
+
+    def grow_security_book(self):
+        num, capacity = self.weight_book.shape
+        extra = np.zeros((num, max(capacity, 1)), dtype=np.float64)
+        self.weight_book = np.hstack([self.weight_book, extra])
+        self.security_value_book = np.hstack([self.security_value_book, extra])
+
+    def get_securities(self):
+        return list(self.security_list)
 
     def hold_securities(self, iter_index):
-        res = []
-        for security in list(self.security_book.keys()):
-            value = self.get_security_value(security, iter_index)
-            if value > 0:
-                res.append(security)
-        return res
+        num = len(self.security_list)
+        columns = np.flatnonzero(self.security_value_book[iter_index, :num] > 0)
+        return [self.security_list[column] for column in columns]
 
     def update_security_value(self, security, iter_index, daily_return):
         """
         1. update security value based on daily_return,
         security weight should be updated based on the value book
         """
-        self.security_book[security][iter_index]["value"] = self.get_security_value(
-            security, iter_index - 1
-        ) * (1 + daily_return)
+        column = self.get_security_column(security)
+        self.security_value_book[iter_index, column] = self.security_value_book[
+            iter_index - 1, column
+        ] * (1 + daily_return)
 
     def update_portfolio(self, iter_index):
         """
         2. update value book and security weight based on new security value
         """
-        self.value_book[iter_index]["cash"] = self.get_remain_cash(iter_index - 1)
+        self.cash_book[iter_index] = self.get_remain_cash(iter_index - 1)
         total_value = self.get_remain_cash(iter_index)
         for security in self.hold_securities(iter_index):
             total_value += self.get_security_value(security, iter_index)
-        self.value_book[iter_index]["value"] = total_value
+        self.total_value_book[iter_index] = total_value
 
         for security in self.hold_securities(iter_index):
-            self.security_book[security][iter_index]["weight"] = np.divide(
+            column = self.get_security_column(security)
+            self.weight_book[iter_index, column] = np.divide(
                 self.get_security_value(security, iter_index),
                 self.get_total_value(iter_index),
             )
 
+    def mark_to_market(self, iter_index, securities, daily_returns):
+        """
+        1 + 2. batched version of update_security_value and update_portfolio
+
+        securities should be held yesterday, daily_returns is aligned with them
+        """
+        num = len(self.security_list)
+        columns = [self.get_security_column(security) for security in securities]
+        daily_returns = np.asarray(daily_returns, dtype=np.float64)
+        self.security_value_book[iter_index, columns] = self.security_value_book[
+            iter_index - 1, columns
+        ] * (1 + daily_returns)
+
+        value = self.security_value_book[iter_index, :num]
+        hold = value > 0
+        self.cash_book[iter_index] = self.cash_book[iter_index - 1]
+        total_value = self.cash_book[iter_index] + value[hold].sum()
+        self.total_value_book[iter_index] = total_value
+        self.weight_book[iter_index, :num][hold] = value[hold] / total_value
+
+    def get_value_path(self, start_index, securities, returns):
+        """
+        value of the securities on the days from start_index on, day x security,
+        given no trade in between
+
+        securities should be held on start_index - 1,
+        returns is a day x security matrix aligned with them.
+        it is the cumulative product in the same order as the daily update
+        """
+        columns = [self.get_security_column(security) for security in securities]
+        path = np.empty((len(returns) + 1, len(columns)))
+        path[0] = self.security_value_book[start_index - 1, columns]
+        path[1:] = 1 + np.asarray(returns, dtype=np.float64)
+        np.multiply.accumulate(path, axis=0, out=path)
+        return path[1:]
+
+    def mark_to_market_segment(self, start_index, securities, value_path):
+        """
+        mark_to_market of every day covered by value_path at once,
+        for days without any trade in between, see get_value_path
+
+        the result is identical to calling mark_to_market day by day
+        """
+        num = len(self.security_list)
+        stop_index = start_index + len(value_path)
+        columns = [self.get_security_column(security) for security in securities]
+        self.security_value_book[start_index:stop_index, columns] = value_path
+
+        value = self.security_value_book[start_index:stop_index, :num]
+        hold = value > 0
+        cash = self.cash_book[start_index - 1]
+        self.cash_book[start_index:stop_index] = cash
+        if not (hold == hold[0]).all():
+            # some security is wiped out in the segment, sum day by day
+            for row, iter_index in enumerate(range(start_index, stop_index)):
+                total_value = cash + value[row][hold[row]].sum()
+                self.total_value_book[iter_index] = total_value
+                self.weight_book[iter_index, :num][hold[row]] = (
+                    value[row][hold[row]] / total_value
+                )
+            return
+
+        hold_columns = np.flatnonzero(hold[0])
+        hold_value = value[:, hold_columns]
+        total_value = cash + hold_value.sum(axis=1)
+        self.total_value_book[start_index:stop_index] = total_value
+        self.weight_book[start_index:stop_index, hold_columns] = (
+            hold_value / total_value[:, None]
+        )
+
     def reduce_security_weight(self, security, reduce_weight, iter_index):
         """
         3. happens at the close price of the day, after daily return updated
         sold before buy
         won't change total value
         """
-        self.security_book[security][iter_index]["weight"] = (
+        column = self.get_security_column(security)
+        self.weight_book[iter_index, column] = (
             self.get_security_weight(security, iter_index) - reduce_weight
         )
         if self.get_security_weight(security, iter_index) < 0:
             raise ValueError("not enough value to reduce")
 
         reduce_value = reduce_weight * self.get_total_value(iter_index)
-        self.security_book[security][iter_index]["value"] = (
+        self.security_value_book[iter_index, column] = (
             self.get_security_value(security, iter_index) - reduce_value
         )
-        self.value_book[iter_index]["cash"] = (
-            self.get_remain_cash(iter_index) + reduce_value
-        )
+        self.cash_book[iter_index] = self.get_remain_cash(iter_index) + reduce_value
 
     def add_security_weight(self, security, add_weight, iter_index):
         """
@@ -108,42 +193,73 @@ class Portfolio:
         sold before buy
         won't change total value
         """
+        column = self.get_security_column(security)
         add_value = self.get_total_value(iter_index) * add_weight
-        self.value_book[iter_index]["cash"] = (
-            self.get_remain_cash(iter_index) - add_value
-        )
+        self.cash_book[iter_index] = self.get_remain_cash(iter_index) - add_value
         if self.get_remain_cash(iter_index) < 0:
             raise ValueError("not enough cash to add")
 
-        self.security_book[security][iter_index]["weight"] = (
+        self.weight_book[iter_index, column] = (
             self.get_security_weight(security, iter_index) + add_weight
         )
-        self.security_book[security][iter_index]["value"] = (
+        self.security_value_book[iter_index, column] = (
             self.get_security_value(security, iter_index) + add_value
         )
 
+    def set_turnover(self, iter_index, turnover):
+        self.turnover_book[iter_index] = turnover
+
     def finish(self):
-        self.value_book = pl.DataFrame(self.value_book)
-        for security, book in self.security_book.items():
-            self.security_book[security] = pl.DataFrame(book)
+        num = len(self.date_df)
+        index = np.arange(num, dtype=np.int64)
+        dates = self.date_df.to_series()
+        self.value_book = pl.DataFrame(
+            {
+                "index": index,
+                "date": dates,
+                "cash": self.cash_book,
+                "value": self.total_value_book,
+                "turnover": self.turnover_book,
+                "sector": pl.repeat("", n=num, eager=True),
+            }
+        )
+        self.security_book = {
+            security: pl.DataFrame(
+                {
+                    "index": index,
+                    "date": dates,
+                    "weight": self.weight_book[:, column],
+                    "value": self.security_value_book[:, column],
+                }
+            )
+            for security, column in self.security_index.items()
+        }
+        self.event_book = self.event_log.finish()
+
+    def get_security_values(self, securities, iter_index):
+        columns = [self.get_security_column(security) for security in securities]
+        return self.security_value_book[iter_index, columns]
 
     def get_security_weight(self, security, iter_index):
-        return self.security_book[security][iter_index]["weight"]
+        # the book may grow while allocating the column, look it up first
+        column = self.get_security_column(security)
+        return self.weight_book[iter_index, column].item()
 
     def get_security_value(self, security, iter_index):
-        return self.security_book[security][iter_index]["value"]
+        column = self.get_security_column(security)
+        return self.security_value_book[iter_index, column].item()
 
     def get_remain_cash(self, iter_index):
-        return self.value_book[iter_index]["cash"]
+        return self.cash_book[iter_index].item()
 
     def get_total_value(self, iter_index):
-        return self.value_book[iter_index]["value"]
+        return self.total_value_book[iter_index].item()
 
     def print_snapshot(self, iter_index):
         total_value = self.get_total_value(iter_index)
         res = []
         for security in self.hold_securities(iter_index):
             value = self.get_security_value(security, iter_index)
-            res.append(": ".join((security, value)))
+            res.append(": ".join((security.display(), str(value))))
         print(f"total value: {total_value}")
         print(". ".join(res))
@@ -0,0 +1,197 @@
+import argparse
+import datetime
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import yfinance
+
+from src.parquet_dataset import scan_year_partitions, write_year_partitions
+from src.sector.max_price import clear_panel_dates, get_max_price
+
+# daily price of all tickers, partitioned by year, sorted by (ticker, date)
+TICKER_PRICE_DATASET = "parquet/ticker_price"
+# 52 week high of adj close, same layout as the price store
+TICKER_MAX_PRICE_DATASET = "parquet/ticker_max_price"
+
+# same columns as the one-parquet-per-ticker files plus the ticker
+PRICE_SCHEMA = {
+    "open": pl.Float64,
+    "high": pl.Float64,
+    "low": pl.Float64,
+    "close": pl.Float64,
+    "adj close": pl.Float64,
+    "volume": pl.Int64,
+    "return": pl.Float64,
+    "date": pl.Date,
+    "ticker": pl.String,
+}
+
+
+def scan_ticker_price(tickers, start_date=None, end_date=None):
+    """
+    schema: see PRICE_SCHEMA
+
+    only the partitions of the date range are opened
+    """
+    return scan_year_partitions(
+        TICKER_PRICE_DATASET, "date", start_date, end_date
+    ).filter(pl.col("ticker").is_in(list(tickers)))
+
+
+def scan_ticker_max_price(tickers, start_date=None, end_date=None):
+    """
+    schema: "ticker", "date", "price", "max_price", see max_price.get_max_price
+    """
+    return scan_year_partitions(
+        TICKER_MAX_PRICE_DATASET, "date", start_date, end_date
+    ).filter(pl.col("ticker").is_in(list(tickers)))
+
+
+def write_ticker_max_price(
+    price_root=TICKER_PRICE_DATASET, max_price_root=TICKER_MAX_PRICE_DATASET
+):
+    """
+    rebuild the 52 week high of every ticker from the whole price store
+    """
+    price_df = (
+        scan_year_partitions(price_root)
+        .select("ticker", "date", pl.col("adj close").alias("price"))
+        .collect()
+    )
+    write_year_partitions(
+        get_max_price(price_df, "ticker"), max_price_root, "ticker", "date"
+    )
+    clear_panel_dates()
+
+
+def split_by_ticker(price_df):
+    """
+    key is the ticker, value is the price sorted by date without the ticker column
+    """
+    price_df = price_df.sort(["ticker", "date"])
+    count_df = price_df.group_by("ticker", maintain_order=True).agg(
+        pl.len().alias("count")
+    )
+    result = {}
+    offset = 0
+    for ticker, count in count_df.iter_rows():
+        result[ticker] = price_df.slice(offset, count).drop("ticker")
+        offset += count
+    return result
+
+
+def get_latest_dates():
+    """
+    key is the ticker, value is the latest date in the price store
+    """
+    if not Path(TICKER_PRICE_DATASET).exists():
+        return {}
+    return dict(
+        scan_year_partitions(TICKER_PRICE_DATASET)
+        .group_by("ticker")
+        .agg(pl.col("date").max())
+        .collect()
+        .iter_rows()
+    )
+
+
+def ingest_ticker_files(ticker_dir):
+    """
+    build the price store from a directory of one parquet per ticker,
+    named {ticker}.parquet with the columns of PRICE_SCHEMA but the ticker,
+    no network
+    """
+    price_df_list = []
+    for path in sorted(Path(ticker_dir).glob("*.parquet")):
+        price_df_list.append(
+            pl.read_parquet(path)
+            .with_columns(pl.lit(path.stem).alias("ticker"))
+            .select([pl.col(c).cast(t) for c, t in PRICE_SCHEMA.items()])
+        )
+    write_year_partitions(
+        pl.concat(price_df_list, how="vertical"), TICKER_PRICE_DATASET, "ticker", "date"
+    )
+    write_ticker_max_price()
+
+
+def download_ticker_price(ticker, start_date, end_date):
+    """
+    schema: see PRICE_SCHEMA
+
+    daily price from yfinance, the return of the first day is null
+    """
+    data = yfinance.download(ticker, start=start_date, end=end_date)
+    data["return"] = np.divide(
+        data["Adj Close"] - data["Adj Close"].shift(1), data["Adj Close"].shift(1)
+    )
+    data.columns = data.columns.str.lower()
+    data["date"] = pd.to_datetime(data.index).date
+    return (
+        pl.from_pandas(data)
+        .with_columns(pl.lit(ticker).alias("ticker"))
+        .select([pl.col(c).cast(t) for c, t in PRICE_SCHEMA.items()])
+    )
+
+
+def append_ticker_price(tickers, end_date=None):
+    """
+    download the dates after the latest one in the price store,
+    only the partitions of the new dates are rewritten.
+    tickers not in the store are downloaded from 2000-01-01
+    """
+    if end_date is None:
+        end_date = datetime.date.today()
+    latest_dates = get_latest_dates()
+    price_df_list = []
+    for ticker in tickers:
+        latest_date = latest_dates.get(ticker)
+        # download from the latest date on, thus the return of the first new day
+        # is computed against the stored price
+        start_date = latest_date or datetime.date(2000, 1, 1)
+        price_df = download_ticker_price(ticker, start_date, end_date)
+        if latest_date is not None:
+            price_df = price_df.filter(pl.col("date") > latest_date)
+        if len(price_df) > 0:
+            price_df_list.append(price_df)
+        time.sleep(1)
+    if len(price_df_list) > 0:
+        write_year_partitions(
+            pl.concat(price_df_list, how="vertical"),
+            TICKER_PRICE_DATASET,
+            "ticker",
+            "date",
+            merge=True,
+        )
+        write_ticker_max_price()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="maintain the local price store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="build the store from a directory of per-ticker parquet files"
+    )
+    ingest_parser.add_argument("--ticker-dir", required=True)
+    append_parser = subparsers.add_parser(
+        "append", help="download the new dates of the tickers from yfinance"
+    )
+    append_parser.add_argument("--ticker", nargs="+", default=None)
+    append_parser.add_argument(
+        "--end-date", type=datetime.date.fromisoformat, default=None
+    )
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ingest_ticker_files(args.ticker_dir)
+    else:
+        tickers = args.ticker
+        if tickers is None:
+            tickers = list(get_latest_dates())
+        append_ticker_price(tickers, args.end_date)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,9 @@
+import numpy as np
+import polars as pl
+
+from src.perf.profiler import profiled
+
+
 class Rebalance:
     def __init__(
         self,
@@ -12,42 +18,87 @@ class Rebalance:
         self.portfolio = portfolio
         self.factor = factor
         self.blacklist = blacklist
-        # could be "1d" or "1mo"
-        # if "1mon", then rebalance happens at the last market open day of the month
+        # could be "1d", "1w", "1mo" or "1q"
+        # except "1d", rebalance happens at the last market open day of the period
         self.interval = interval
         self.disable_rebalance = disable_rebalance
+        self.build_schedule()
 
-    def check_and_run(self, iter_index, prev_rebalance_index):
-        if self.disable_rebalance:
-            return False
-        if iter_index + 1 >= len(self.portfolio.date_df):
-            return False
+    def build_schedule(self):
+        """
+        precompute the rebalance calendar of portfolio.date_df
+
+        period_end: whether the day is the last market open day of its period,
+                    for "1d" every day is a period end
+        period_number: sequential number of the period the day belongs to,
+                       the period diff of two days is the diff of their numbers
 
+        the last day never rebalances, there is no next day to trade on
+        """
+        date = self.portfolio.date_df.to_series()
         if self.interval == "1d":
-            if iter_index % self.period == 0:
-                self.run(iter_index)
-                return True
-            else:
-                return False
+            period_number = pl.int_range(0, len(date), eager=True)
+        elif self.interval == "1w":
+            # weeks start on monday, 1970-01-01 is a thursday
+            period_number = (date.cast(pl.Int32) + 3) // 7
         elif self.interval == "1mo":
-            prev_rebalance_date = self.portfolio.date_df.item(prev_rebalance_index, 0)
-            cur_date = self.portfolio.date_df.item(iter_index, 0)
-            next_date = self.portfolio.date_df.item(iter_index + 1, 0)
-            if self.interval == "1mo" and cur_date.month == next_date.month:
-                return False
-            diff = (
-                cur_date.month - prev_rebalance_date.month
-                if cur_date.year == prev_rebalance_date.year
-                else cur_date.month + 12 - prev_rebalance_date.month
-            )
-            if self.interval == "1mo" and diff == self.period:
-                self.run(iter_index)
-                return True
-            else:
-                return False
+            period_number = date.dt.year().cast(pl.Int32) * 12 + date.dt.month()
+        elif self.interval == "1q":
+            period_number = date.dt.year().cast(pl.Int32) * 4 + date.dt.quarter()
         else:
             raise ValueError(f"no implementation for {self.interval}")
 
+        self.period_number = period_number.cast(pl.Int64).to_numpy()
+        self.period_end = np.zeros(len(date), dtype=bool)
+        self.period_end[:-1] = self.period_number[:-1] != self.period_number[1:]
+
+    def is_rebalance_day(self, iter_index, prev_rebalance_index):
+        if self.disable_rebalance or not self.period_end[iter_index]:
+            return False
+        if self.interval == "1d":
+            return iter_index % self.period == 0
+        diff = self.period_number[iter_index] - self.period_number[prev_rebalance_index]
+        return diff == self.period
+
+    def next_rebalance_index(self, iter_index, prev_rebalance_index):
+        """
+        the first day on or after iter_index that rebalances,
+        given that no stop gain/loss happens in between. None if there is none
+        """
+        if self.disable_rebalance:
+            return None
+        if self.interval == "1d":
+            index = -(-iter_index // self.period) * self.period
+        else:
+            target = self.period_number[prev_rebalance_index] + self.period
+            # period_number is sorted, the target period ends on its last day
+            index = np.searchsorted(self.period_number, target, side="right") - 1
+            if index < iter_index or self.period_number[index] != target:
+                return None
+        if index >= len(self.period_end) or not self.period_end[index]:
+            return None
+        return int(index)
+
+    def get_schedule(self, prev_rebalance_index=0):
+        """
+        all rebalance days after prev_rebalance_index, given no stop gain/loss
+        """
+        schedule = []
+        index = self.next_rebalance_index(
+            prev_rebalance_index + 1, prev_rebalance_index
+        )
+        while index is not None:
+            schedule.append(index)
+            index = self.next_rebalance_index(index + 1, index)
+        return schedule
+
+    def check_and_run(self, iter_index, prev_rebalance_index):
+        if self.is_rebalance_day(iter_index, prev_rebalance_index):
+            self.run(iter_index)
+            return True
+        return False
+
+    @profiled
     def run(self, iter_index):
         cur_date = self.portfolio.date_df.item(iter_index, 0)
         position = self.factor.get_position(cur_date)
@@ -76,7 +127,7 @@ class Rebalance:
         position_change = []
 
         new_securities = [s for s, _ in new_position]
-        for security in self.portfolio.security_book.keys():
+        for security in self.portfolio.get_securities():
             original_weight = self.portfolio.get_security_weight(security, iter_index)
             if security not in new_securities and original_weight > 0:
                 position_change.append((security, -original_weight))
@@ -87,12 +138,10 @@ class Rebalance:
 
         # sold first and then buy
         position_change.sort(key=lambda p: p[1])
-        print(
-            f"rebalance on {cur_date}: {list(map(lambda t: (t[0].display(), round(t[1],3)), position_change))}"
-        )
+        self.portfolio.event_log.record(cur_date, "rebalance", position_change)
 
         turnover = sum((map(lambda t: abs(t[1]), position_change)))
-        self.portfolio.value_book[iter_index]["turnover"] = turnover
+        self.portfolio.set_turnover(iter_index, turnover)
         # sector = ",".join((map(lambda t: t[0].sector, position_change)))
         # self.portfolio.value_book[iter_index]["sector"] = sector
 
@@ -2,8 +2,9 @@ import datetime
 
 from src.analysis.metric import Metric
 from src.analysis.plot import Plot
-from src.backtest import BackTest
+from src.backtest import BackTest, MultiLegBackTest
 from src.benchmark import Benchmark
+from src.event_log import EventLog
 from src.factor.cape import CapeFactor
 from src.factor.dividend_yield import DividendYieldFactor
 from src.factor.fifty_two_week_high import FiftyTwoWeekHighFactor
@@ -16,6 +17,7 @@ from src.factor_aggregator.simple_average_aggregator import SimpleAverageAggrega
 from src.factor_aggregator.weighted_average_aggregator import WeightedAverageAggregator
 from src.fund_universe import INVESCO_SECTOR_ETF_TICKER, ISHARE_SECTOR_ETF_TICKER
 from src.market import Market
+from src.perf.profiler import disable_profiler, enable_profiler
 from src.portfolio import Portfolio
 from src.rebalance import Rebalance
 from src.security_symbol import SecurityTicker
@@ -28,57 +30,43 @@ security_universe = INVESCO_SECTOR_ETF_TICKER
 rebalance_period = 1
 rebalance_interval = "1mo"
 Factor = SimpleAverageAggregator
+# write the phase timing of the backtest to a chrome trace, e.g. "profile.json"
+profile_trace = None
 index_ticker = "^SPXEW" if security_universe == INVESCO_SECTOR_ETF_TICKER else "^SPX"
 benchmark = Benchmark(SecurityTicker(index_ticker, "index"), start_date, end_date)
-market = Market(security_universe, start_date, end_date)
-
-
-### Long factor
-long_factor = Factor(security_universe, "long")
-long_portfolio = Portfolio(100.0, start_date, end_date)
-long_factor.set_portfolio_at_start(long_portfolio)
-
-blacklist = []
-strategy = StopGainAndLoss(long_portfolio, blacklist)
-strategy.set_limit(1, 1)
-rebalance = Rebalance(
-    rebalance_period, long_portfolio, long_factor, blacklist, rebalance_interval
-)
-
-backtest = BackTest(long_portfolio, strategy, market, rebalance)
-backtest.run()
-
-
-### Short factor
-short_factor = Factor(security_universe, "short")
-short_portfolio = Portfolio(100.0, start_date, end_date)
-short_factor.set_portfolio_at_start(short_portfolio)
-
-blacklist = []
-strategy = StopGainAndLoss(short_portfolio, blacklist)
-strategy.set_limit(1, 1)
-rebalance = Rebalance(
-    rebalance_period, short_portfolio, short_factor, blacklist, rebalance_interval
-)
-
-backtest = BackTest(short_portfolio, strategy, market, rebalance)
-backtest.run()
-
-
-### Mid factor
-mid_factor = Factor(security_universe, "mid")
-mid_portfolio = Portfolio(100.0, start_date, end_date)
-mid_factor.set_portfolio_at_start(mid_portfolio)
-
-blacklist = []
-strategy = StopGainAndLoss(mid_portfolio, blacklist)
-strategy.set_limit(1, 1)
-rebalance = Rebalance(
-    rebalance_period, mid_portfolio, mid_factor, blacklist, rebalance_interval
-)
-
-backtest = BackTest(mid_portfolio, strategy, market, rebalance)
+market = Market(security_universe, start_date, end_date, return_cube=True)
+
+
+### Long, short and mid legs share the factor ranking and run in one day loop
+factor = Factor(security_universe, "long")
+portfolios = {}
+backtests = []
+for factor_type in ["long", "short", "mid"]:
+    leg = factor.get_leg(factor_type)
+    # print every trade of the legs to the console
+    portfolio = Portfolio(100.0, start_date, end_date, event_log=EventLog(verbose=True))
+    leg.set_portfolio_at_start(portfolio)
+
+    blacklist = []
+    strategy = StopGainAndLoss(portfolio, blacklist)
+    strategy.set_limit(1, 1)
+    rebalance = Rebalance(
+        rebalance_period, portfolio, leg, blacklist, rebalance_interval
+    )
+    portfolios[factor_type] = portfolio
+    backtests.append(BackTest(portfolio, strategy, market, rebalance))
+
+backtest = MultiLegBackTest(backtests)
+if profile_trace is not None:
+    enable_profiler()
 backtest.run()
+if profile_trace is not None:
+    profiler = disable_profiler()
+    print(profiler.report())
+    profiler.write_trace(profile_trace)
+long_portfolio = portfolios["long"]
+short_portfolio = portfolios["short"]
+mid_portfolio = portfolios["mid"]
 
 ### Metric
 benchmark_performance = benchmark.get_performance()
@@ -3,42 +3,44 @@ from abc import ABC, abstractmethod
 
 import polars as pl
 
+from src.parquet_dataset import scan_monthly_table
+from src.sector.report_announcement import get_announcement_index
+from src.sector.sector_construction import (
+    SECTOR_INFO_TABLE,
+    SECTOR_WEIGHT_TABLE,
+    get_indexed_sector_df,
+    get_sector_construction,
+)
+from src.sector.signal_store import SignalStore, get_code_version
+
 
 class BaseSector(ABC):
+    # "1mo" if the sector signal only depends on the month of the date
+    signal_frequency = "1d"
+    # persist sector signals in the signal store, shared across runs and processes
+    use_signal_store = True
+    # hyper parameter: generate z-score using data in the last n years
+    z_score_year_range = 1
+    # bump to clear the signal store once the signal changes outside the modules
+    # of the sector class, e.g. in report_announcement or sector_construction
+    signal_version = 1
+
     def __init__(self) -> None:
         super().__init__()
+        # category of the source table, e.g. ntm or fy1
+        self.category = "default"
+        # key is the signal key of the date, see get_signal_key
+        self.sector_signal_cache = {}
+        self.signal_store = None
 
     def get_sector_construction(self):
         """
         schema: "sedol7", "date", "sector", "weight"
 
-        weight is adjusted based on the date and sector
+        weight is adjusted based on the date and sector,
+        the table is shared by all sector instances, never modify it in place
         """
-        sector_info = pl.read_parquet("parquet/base/us_sector_info.parquet").select(
-            ["sedol7", "date", "sector"]
-        )
-
-        # originally, the weight is based on the all sectors
-        sector_weight = pl.read_parquet("parquet/base/us_sector_weight.parquet").select(
-            ["sedol7", "date", "weight"]
-        )
-
-        merge = sector_info.join(
-            sector_weight, on=["sedol7", "date"], how="inner"
-        ).select(["sedol7", "date", "sector", "weight"])
-
-        # calculate the total weight for any particualr sector
-        new_weight_base = merge.group_by(["date", "sector"]).agg(
-            pl.col("weight").sum().alias("total_weight")
-        )
-
-        # new weight is based on any particular sector
-        sector_weight_df = (
-            merge.join(new_weight_base, on=["date", "sector"], how="left")
-            .with_columns((pl.col("weight") / pl.col("total_weight")).alias("weight"))
-            .select(["sedol7", "date", "sector", "weight"])
-        )
-        return sector_weight_df
+        return get_sector_construction()
 
     @abstractmethod
     def impl_security_signal(self, date):
@@ -58,6 +60,173 @@ class BaseSector(ABC):
         """
         raise NotImplementedError()
 
+    def impl_date_sector_signal(self, date):
+        """
+        sector signal of a single date, before the z-score
+        """
+        security_signal_df = self.impl_security_signal(date)
+        return self.agg_to_sector_signal(self.sector_df, security_signal_df, True)
+
+    def get_source_tables(self):
+        """
+        tables the sector signal is computed from,
+        the signal store is invalidated once any of them changes
+        """
+        return [SECTOR_INFO_TABLE, SECTOR_WEIGHT_TABLE]
+
+    def get_signal_parameters(self):
+        """
+        what the sector signal depends on besides the source tables,
+        the signal store is invalidated once any of them changes
+
+        the plain attributes of the instance, e.g. category and table paths,
+        the hyper parameters and the version of the code
+        """
+        parameters = {
+            name: value
+            for name, value in vars(self).items()
+            if isinstance(value, (str, int, float, bool, datetime.date))
+        }
+        parameters.update(
+            signal_frequency=self.signal_frequency,
+            z_score_year_range=self.z_score_year_range,
+            signal_version=self.signal_version,
+            code_version=get_code_version(type(self)),
+        )
+        return parameters
+
+    def get_signal_key(self, date):
+        if self.signal_frequency == "1mo":
+            return date.strftime("%Y-%m")
+        return date.isoformat()
+
+    def get_signal_store(self):
+        if self.signal_store is None and self.use_signal_store:
+            self.signal_store = SignalStore(
+                self.__class__.__name__,
+                self.category,
+                self.get_source_tables(),
+                self.get_signal_parameters(),
+            )
+        return self.signal_store
+
+    def get_sector_signal(self, date):
+        """
+        cached version of impl_date_sector_signal
+        """
+        return self.get_sector_signals([date])[self.get_signal_key(date)]
+
+    def get_sector_signals(self, dates):
+        """
+        batched and cached version of impl_date_sector_signal, keyed by signal key
+
+        look up the in-memory cache first, then the signal store on disk,
+        the remaining dates are computed in one impl_date_sector_signal_batch call
+        """
+        key_dates = {}
+        for date in dates:
+            key_dates.setdefault(self.get_signal_key(date), date)
+
+        signal_store = self.get_signal_store()
+        missing_dates = []
+        for key, date in key_dates.items():
+            if key in self.sector_signal_cache:
+                continue
+            sector_signal_df = None
+            if signal_store is not None:
+                sector_signal_df = signal_store.read(key)
+            if sector_signal_df is None:
+                missing_dates.append(date)
+            else:
+                self.sector_signal_cache[key] = sector_signal_df
+
+        if len(missing_dates) > 0:
+            batch = self.impl_date_sector_signal_batch(missing_dates)
+            for date, sector_signal_df in batch.items():
+                key = self.get_signal_key(date)
+                if signal_store is not None:
+                    signal_store.write(key, sector_signal_df)
+                self.sector_signal_cache[key] = sector_signal_df
+
+        return {key: self.sector_signal_cache[key] for key in key_dates}
+
+    def impl_date_sector_signal_batch(self, dates):
+        """
+        sector signal of many dates, keyed by the date
+
+        the default is to call impl_date_sector_signal for every date,
+        subclasses could compute all of them in a single query
+        """
+        return {date: self.impl_date_sector_signal(date) for date in dates}
+
+    def scan_monthly_security_signal(self, table, column, dates):
+        """
+        security signal of many months from a monthly table in a single scan,
+        the date column is rewritten to the first day of the month
+        """
+        months = [datetime.date(date.year, date.month, 1) for date in dates]
+        month_df = pl.DataFrame({"month": months}, schema={"month": pl.Date}).unique()
+        signal_df = (
+            scan_monthly_table(table, min(months), max(months))
+            .filter(pl.col(column).is_not_null())
+            .join(month_df.lazy(), on="month", how="inner")
+            .with_columns(pl.col("month").alias("date"))
+            .drop("month")
+            .rename({column: "signal"})
+            .collect()
+        )
+        return signal_df
+
+    def split_monthly_sector_signal(self, sector_signal_df, dates):
+        """
+        split the sector signal of many months by the dates asked for
+        """
+        return {
+            date: sector_signal_df.filter(
+                pl.col("date") == datetime.date(date.year, date.month, 1)
+            )
+            for date in dates
+        }
+
+    def get_history_dates(self, observe_date):
+        """
+        dates whose sector signal is used for the z-score of observe_date
+        """
+        if observe_date.month == 2 and observe_date.day == 29:
+            observe_date = datetime.date(observe_date.year, 2, 28)
+        return [
+            datetime.date(
+                observe_date.year - delta, observe_date.month, observe_date.day
+            )
+            for delta in range(self.z_score_year_range)
+        ]
+
+    def prepare_sector_signal(self, observe_dates):
+        """
+        compute the sector signal of all history dates of observe_dates in one batch
+        """
+        history_dates = []
+        for observe_date in observe_dates:
+            history_dates.extend(self.get_history_dates(observe_date))
+        return self.get_sector_signals(history_dates)
+
+    def impl_sector_signal_history(self, observe_dates):
+        """
+        z-score of many observe dates at once, with an extra observe_date column
+        """
+        sector_signals = self.prepare_sector_signal(observe_dates)
+        total_df_list = []
+        for observe_date in observe_dates:
+            for date in self.get_history_dates(observe_date):
+                sector_signal_df = sector_signals[self.get_signal_key(date)]
+                total_df_list.append(
+                    sector_signal_df.with_columns(
+                        pl.lit(observe_date).alias("observe_date")
+                    )
+                )
+        total_signal_df = pl.concat(total_df_list)
+        return self.get_sector_z_score_history(total_signal_df)
+
     def get_sector_list(self, observe_date):
         """
         call get_sector_signal, should have fields named z-score and sector
@@ -84,18 +253,16 @@ class BaseSector(ABC):
 
         input parameter signal_df should have a column named signal
         """
-        # should only have one date value
-        assert len(signal_df.select(pl.col("date").unique())) == 1
-
-        signal_df = signal_df.filter(pl.col("signal").is_not_null()).with_columns(
+        signal_df = signal_df.with_columns(
             pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym")
         )
-
-        sector_df = (
-            sector_df.filter(pl.col("weight") > 0)
-            .filter(pl.col("sector") != pl.lit("--"))
-            .with_columns(pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym"))
+        # should only have one date value in a month
+        assert len(signal_df.select("ym", "date").unique()) == len(
+            signal_df.select("ym").unique()
         )
+        signal_df = signal_df.filter(pl.col("signal").is_not_null())
+
+        sector_df = get_indexed_sector_df(sector_df)
 
         sector_signal_df = (
             signal_df.join(sector_df, on=["sedol7", "ym"], how="inner")
@@ -126,17 +293,27 @@ class BaseSector(ABC):
         """
         sort weighted signal in descending order
         """
-        latest_month = (
-            total_signal_df.select(pl.col("date").max()).get_column("date").item(0)
+        merge_df = self.get_sector_z_score_history(
+            total_signal_df.with_columns(pl.lit(0).alias("observe_date"))
+        )
+        return merge_df.drop("observe_date")
+
+    def get_sector_z_score_history(self, total_signal_df):
+        """
+        z-score of the latest signal against its own history, for each observe_date
+
+        total_signal_df should have an observe_date column
+        """
+        latest_signal_df = total_signal_df.filter(
+            pl.col("date") == pl.col("date").max().over("observe_date")
         )
-        latest_signal_df = total_signal_df.filter(pl.col("date") == latest_month)
 
         total_signal_df = (
             total_signal_df
             # .filter(pl.col("date") != latest_month)
             .filter(pl.col("weighted_signal").is_not_null())
             .filter(pl.col("weighted_signal").is_not_nan())
-            .group_by(["sector"])
+            .group_by(["observe_date", "sector"])
             .agg(
                 (pl.col("weighted_signal").std().alias("std")),
                 (pl.col("weighted_signal").mean().alias("mean")),
@@ -148,7 +325,7 @@ class BaseSector(ABC):
         assert len(total_signal_df.filter(pl.col("mean").is_null())) == 0
 
         merge_df = latest_signal_df.join(
-            total_signal_df, on="sector", how="inner"
+            total_signal_df, on=["observe_date", "sector"], how="inner"
         ).with_columns(
             ((pl.col("weighted_signal") - pl.col("mean")) / pl.col("std")).alias(
                 "z-score"
@@ -157,39 +334,10 @@ class BaseSector(ABC):
         return merge_df
 
     def get_report_announcement_date(self, report_date):
-        # we only care about those report date in 3/31, 6/30, 9/30, 12/31
-        # we only consider the diff between announcement_date and report_date in range (0, 3] months is reasonable
-        # for those missing data or gap larger than 3 months, we just fix it to be report_date + 3 months
-        announcement_df = (
-            pl.scan_parquet(self.report_announcement_table)
-            .filter(pl.col("report_date") == report_date)
-            .filter(pl.col("announcement_date").is_not_null())
-            .filter(
-                pl.col("announcement_date") - pl.col("report_date")
-                > datetime.timedelta(days=0)
-            )
-            .filter(
-                pl.col("announcement_date") - pl.col("report_date")
-                <= datetime.timedelta(days=93)
-            )
-            .filter(
-                (
-                    (pl.col("report_date").dt.month() == 3)
-                    & (pl.col("report_date").dt.day() == 31)
-                )
-                | (
-                    (pl.col("report_date").dt.month() == 6)
-                    & (pl.col("report_date").dt.day() == 30)
-                )
-                | (
-                    (pl.col("report_date").dt.month() == 9)
-                    & (pl.col("report_date").dt.day() == 30)
-                )
-                | (
-                    (pl.col("report_date").dt.month() == 12)
-                    & (pl.col("report_date").dt.day() == 31)
-                )
-            )
-            .collect()
-        )
-        return announcement_df
+        """
+        schema: "sedol7", "report_date", "announcement_date"
+
+        announcement date of every security for the report date
+        """
+        announcement_df = get_announcement_index(self.report_announcement_table)
+        return announcement_df.filter(pl.col("report_date") == report_date)
@@ -2,11 +2,19 @@ import datetime
 
 import polars as pl
 
+from src.perf.profiler import profiled
 from src.sector.base_sector import BaseSector
+from src.sector.report_announcement import get_first_announcement_date
+from src.sector.sector_construction import get_indexed_sector_df
+from src.sector.signal_store import SignalStore, get_code_version
+
+# built lazily and shared by all CapeSector instances, see CapeSector.get_eps_panel
+_eps_panel = None
 
 
 class CapeSector(BaseSector):
     def __init__(self):
+        super().__init__()
         self.eps_quarterly_table = "parquet/cape/us_security_eps_quarterly.parquet"
         self.eps_annually_table = "parquet/cape/us_security_eps_annually.parquet"
         self.price_table = "parquet/base/us_security_price_daily.parquet"
@@ -16,6 +24,7 @@ class CapeSector(BaseSector):
         )
         self.sector_df = self.get_sector_construction()
 
+    @profiled
     def impl_sector_signal(self, observe_date):
         """
         1. construct sector securities and weight
@@ -23,28 +32,40 @@ class CapeSector(BaseSector):
         3. aggregate security signal and calculate sector signal
         4. sort the sector sinal using z-score
         """
+        return self.impl_sector_signal_history([observe_date]).drop("observe_date")
+
+    def get_history_dates(self, observe_date):
         # z-score range
         z_score_year_range = (
             10 if observe_date.year > 2010 else observe_date.year - 2001
         )
-        total_df_list = []
         if observe_date.month == 2 and observe_date.day == 29:
             observe_date = datetime.date(observe_date.year, 2, 28)
-        for delta in range(z_score_year_range):
-            history_date = datetime.date(
+        return [
+            datetime.date(
                 observe_date.year - delta, observe_date.month, observe_date.day
             )
-            security_signal_df = self.impl_security_signal(history_date)
-            # we don't like negative PE
-            security_signal_df = security_signal_df.filter(pl.col("signal") > 0)
-            sector_signal_df = self.agg_to_sector_signal_harmonic_average(
-                self.sector_df, security_signal_df
-            )
-            assert len(sector_signal_df) > 0
-            total_df_list.append(sector_signal_df)
-        total_signal_df = pl.concat(total_df_list)
-        z_score_df = self.get_sector_z_score(total_signal_df)
-        return z_score_df
+            for delta in range(z_score_year_range)
+        ]
+
+    def impl_date_sector_signal(self, date):
+        security_signal_df = self.impl_security_signal(date)
+        # we don't like negative PE
+        security_signal_df = security_signal_df.filter(pl.col("signal") > 0)
+        sector_signal_df = self.agg_to_sector_signal_harmonic_average(
+            self.sector_df, security_signal_df
+        )
+        assert len(sector_signal_df) > 0
+        return sector_signal_df
+
+    def get_source_tables(self):
+        return super().get_source_tables() + [
+            self.eps_quarterly_table,
+            self.eps_annually_table,
+            self.price_table,
+            self.cpi_table,
+            self.report_announcement_table,
+        ]
 
     def agg_to_sector_signal_harmonic_average(
         self, sector_df: pl.DataFrame, signal_df: pl.DataFrame
@@ -59,11 +80,7 @@ class CapeSector(BaseSector):
             pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym")
         )
 
-        sector_df = (
-            sector_df.filter(pl.col("weight") > 0)
-            .filter(pl.col("sector") != pl.lit("--"))
-            .with_columns(pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym"))
-        )
+        sector_df = get_indexed_sector_df(sector_df)
 
         sector_signal_df = (
             signal_df.join(sector_df, on=["sedol7", "ym"], how="inner")
@@ -105,60 +122,7 @@ class CapeSector(BaseSector):
         """
         aggregate history eps data and calulate security PE
         """
-
-        eps_df = self.get_eps_construction(date)
-
-        # make sure to have 120 months
-        eleven_years_ago = date.year - 11
-
-        # compound eps with the CPI data
-        cpi_df = (
-            pl.scan_parquet(self.cpi_table)
-            .with_columns(pl.col("date").dt.year().alias("year"))
-            .with_columns(pl.col("date").dt.month().alias("month"))
-            .filter(pl.col("year") >= eleven_years_ago)
-            .filter(pl.col("year") <= date.year)
-            .select(
-                pl.col("year"), pl.col("month"), pl.col("us_cpi_all").alias("cpi_index")
-            )
-            .collect()
-        )
-
-        latest_cpi_index = (
-            cpi_df.select(pl.col("cpi_index").max()).get_column("cpi_index").item(0)
-        )
-
-        cpi_df = cpi_df.with_columns(
-            (pl.lit(latest_cpi_index) / pl.col("cpi_index")).alias("cpi")
-        )
-
-        eps_df = (
-            eps_df.filter(pl.col("year") >= eleven_years_ago)
-            .join(cpi_df, how="inner", on=["year", "month"])
-            .with_columns((pl.col("eps") * pl.col("cpi")).alias("eps"))
-        )
-
-        assert (
-            len(eps_df.filter(pl.col("sedol7") == "2046251").sort(pl.col("year"))) > 0
-        )
-
-        # aggregate eps over the last 120 months
-        eps_df = eps_df.with_columns(
-            (pl.col("year") * 100 + pl.col("month"))
-            .rank("ordinal", descending=True)
-            .over("sedol7")
-            .alias("row_number")
-        ).filter(pl.col("row_number") <= 120)
-
-        eps_df = eps_df.group_by("sedol7").agg(
-            pl.col("eps").sum().alias("agg_eps"),
-            pl.col("row_number").max().alias("max_row_number"),
-        )
-
-        # we only want those securities that has 120 months data
-        eps_df = eps_df.filter(pl.col("max_row_number") == 120).with_columns(
-            (pl.col("agg_eps") / pl.lit(10)).alias("avg_eps")
-        )
+        eps_df = self.get_cape_eps(date)
 
         # adjust date to the latest market open date, thus to have price data
         latest_market_open_date = (
@@ -189,79 +153,220 @@ class CapeSector(BaseSector):
         # assert len(signal_df.filter(pl.col("sedol7") == "2046251")) > 0
         return signal_df
 
-    def get_eps_construction(self, date):
-        eps_quarter_df = self.get_eps_quarter_df(date)
+    def get_cape_eps(self, date):
+        """
+        schema: "sedol7", "agg_eps", "avg_eps"
+
+        CPI adjusted eps over the latest 120 months known at the date,
+        looked up from the eps panel
+        """
+        quarter_cutoff = self.get_quarter_report_cutoff(date)
+        annual_cutoff = self.get_annual_report_cutoff(date)
 
-        # de-duplicate
-        eps_quarter_df = eps_quarter_df.group_by(
-            [
-                pl.col("sedol7"),
-                pl.col("date").dt.year().alias("year"),
-                pl.col("date").dt.month().alias("month"),
-            ]
-        ).agg(pl.col("eps").max().alias("eps"))
-
-        # explode to monthly
-        eps_quarter_df = eps_quarter_df.with_columns(
-            pl.lit(list(range(3))).alias("diff")
+        # make sure to have 120 months
+        eleven_years_ago = date.year - 11
+
+        # compound eps with the CPI data,
+        # the eps in the panel is already divided by the CPI index of its month
+        latest_cpi_index = (
+            pl.scan_parquet(self.cpi_table)
+            .filter(pl.col("date").dt.year() >= eleven_years_ago)
+            .filter(pl.col("date").dt.year() <= date.year)
+            .select(pl.col("us_cpi_all").max())
+            .collect()
+            .item(0, 0)
         )
 
-        eps_quarter_df = (
-            eps_quarter_df.explode("diff")
-            .with_columns(pl.col("diff").cast(pl.Int8))
-            .with_columns((pl.col("month") - pl.col("diff")).alias("month"))
-            .with_columns((pl.col("eps") / 4).alias("eps"))
+        # months known at the date
+        known_eps_df = self.get_eps_panel().filter(
+            pl.when(pl.col("is_quarterly"))
+            .then(pl.col("report_date") <= quarter_cutoff)
+            .otherwise(pl.col("report_date") <= annual_cutoff)
+        )
+
+        # the rolling sum of the latest known month for every security
+        latest_eps_df = (
+            known_eps_df.group_by("sedol7")
+            .agg(pl.all().sort_by("month_index").last())
+            .filter(pl.col("rolling_eps").is_not_null())
+        )
+
+        # we only want those securities that has 120 months data in the last 11 years
+        eps_df = latest_eps_df.filter(
+            pl.col("window_annual_report_date") <= annual_cutoff
+        ).filter(pl.col("window_start_month_index") >= eleven_years_ago * 12)
+
+        # rare case: the window has annual months not known yet,
+        # i.e. a later quarter is reported before the annual report of the year.
+        # skip those months, the same as aggregating the known months directly
+        gap_eps_df = (
+            known_eps_df.join(
+                latest_eps_df.filter(
+                    pl.col("window_annual_report_date") > annual_cutoff
+                ).select("sedol7"),
+                on="sedol7",
+                how="inner",
+            )
+            .filter(pl.col("month_index") >= eleven_years_ago * 12)
+            .group_by("sedol7")
+            .agg(
+                pl.col("eps")
+                .sort_by("month_index")
+                .tail(120)
+                .sum()
+                .alias("rolling_eps"),
+                pl.col("eps").count().alias("month_count"),
+            )
+            .filter(pl.col("month_count") >= 120)
+        )
+
+        eps_df = (
+            pl.concat(
+                [
+                    eps_df.select("sedol7", "rolling_eps"),
+                    gap_eps_df.select("sedol7", "rolling_eps"),
+                ],
+                how="vertical",
+            )
             .select(
-                pl.col("sedol7").alias("a_sedol7"),
-                pl.col("year").alias("a_year"),
-                pl.col("month").alias("a_month"),
-                pl.col("eps").alias("a_eps"),
+                pl.col("sedol7"),
+                (pl.col("rolling_eps") * latest_cpi_index).alias("agg_eps"),
             )
+            .with_columns((pl.col("agg_eps") / pl.lit(10)).alias("avg_eps"))
         )
+        return eps_df
+
+    def get_eps_panel(self):
+        """
+        cached version of build_eps_panel, shared by all CapeSector instances
+
+        materialized once per vintage of the source tables
+        """
+        global _eps_panel
+        if _eps_panel is None:
+            store = SignalStore(
+                self.__class__.__name__,
+                "eps_panel",
+                [self.eps_quarterly_table, self.eps_annually_table, self.cpi_table],
+                {"code_version": get_code_version(type(self))},
+            )
+            _eps_panel = store.read("panel")
+            if _eps_panel is None:
+                _eps_panel = self.build_eps_panel()
+                store.write("panel", _eps_panel)
+        return _eps_panel
+
+    def build_eps_panel(self):
+        """
+        schema: "sedol7", "month_index", "report_date", "is_quarterly", "eps",
+                "rolling_eps", "window_start_month_index", "window_annual_report_date"
 
-        eps_annual_df = self.get_eps_annual_df(date)
+        one row for each month of the eps history of a security,
+        month_index is year * 12 + month - 1.
 
-        # de-duplicate
-        eps_annual_df = eps_annual_df.group_by(
-            pl.col("sedol7").alias("sedol7"),
-            pl.col("date").dt.year().alias("year"),
-        ).agg(pl.col("eps").max().alias("eps"))
+        eps of the month is divided by the CPI index of the month,
+        quarterly eps is preferred over the annual one.
 
-        # explode to monthly
-        eps_annual_df = eps_annual_df.with_columns(
-            pl.lit(list(range(12))).alias("diff")
+        rolling_eps is the sum over the latest 120 months up to the row,
+        window_annual_report_date is the latest annual report the window relies on.
+        """
+        # note that we only use quarterly data whose report date is 3/31, 6/30, 9/30, 12/31
+        eps_quarter_df = (
+            pl.scan_parquet(self.eps_quarterly_table)
+            .filter(pl.col("eps").is_not_null())
+            .filter(
+                ((pl.col("date").dt.month() == 3) & (pl.col("date").dt.day() == 31))
+                | ((pl.col("date").dt.month() == 6) & (pl.col("date").dt.day() == 30))
+                | ((pl.col("date").dt.month() == 9) & (pl.col("date").dt.day() == 30))
+                | ((pl.col("date").dt.month() == 12) & (pl.col("date").dt.day() == 31))
+            )
+            # de-duplicate
+            .group_by(["sedol7", "date"])
+            .agg(pl.col("eps").max().alias("eps"))
+            # explode to monthly
+            .with_columns(pl.lit(list(range(3))).alias("diff"))
+            .explode("diff")
+            .select(
+                pl.col("sedol7"),
+                (
+                    pl.col("date").dt.year().cast(pl.Int32) * 12
+                    + pl.col("date").dt.month().cast(pl.Int32)
+                    - 1
+                    - pl.col("diff")
+                ).alias("month_index"),
+                pl.col("date").alias("report_date"),
+                pl.lit(True).alias("is_quarterly"),
+                (pl.col("eps") / 4).alias("eps"),
+            )
         )
 
+        # note that we only use those annual data whose report date is 12/31
         eps_annual_df = (
-            eps_annual_df.explode("diff")
-            .with_columns(pl.col("diff").cast(pl.Int8))
-            .with_columns(pl.lit(12, dtype=pl.Int8).alias("month"))
-            .with_columns((pl.col("month") - pl.col("diff")).alias("month"))
-            .with_columns((pl.col("eps") / 12).alias("eps"))
+            pl.scan_parquet(self.eps_annually_table)
+            .filter((pl.col("date").dt.month() == 12) & (pl.col("date").dt.day() == 31))
+            .filter(pl.col("eps").is_not_null())
+            # de-duplicate
+            .group_by(["sedol7", "date"])
+            .agg(pl.col("eps").max().alias("eps"))
+            # explode to monthly
+            .with_columns(pl.lit(list(range(12))).alias("diff"))
+            .explode("diff")
             .select(
-                pl.col("sedol7").alias("b_sedol7"),
-                pl.col("year").alias("b_year"),
-                pl.col("month").alias("b_month"),
-                pl.col("eps").alias("b_eps"),
+                pl.col("sedol7"),
+                (
+                    pl.col("date").dt.year().cast(pl.Int32) * 12 + 11 - pl.col("diff")
+                ).alias("month_index"),
+                pl.col("date").alias("report_date"),
+                pl.lit(False).alias("is_quarterly"),
+                (pl.col("eps") / 12).alias("eps"),
             )
         )
 
-        # merge two data source
-        eps_df = eps_quarter_df.join(
-            eps_annual_df,
-            how="outer",
-            left_on=["a_sedol7", "a_year", "a_month"],
-            right_on=["b_sedol7", "b_year", "b_month"],
-        ).select(
-            pl.coalesce(pl.col("a_sedol7"), pl.col("b_sedol7")).alias("sedol7"),
-            pl.coalesce(pl.col("a_year"), pl.col("b_year")).alias("year"),
-            pl.coalesce(pl.col("a_month"), pl.col("b_month")).alias("month"),
-            pl.coalesce(pl.col("a_eps"), pl.col("b_eps")).alias("eps"),
+        cpi_df = pl.scan_parquet(self.cpi_table).select(
+            (
+                pl.col("date").dt.year().cast(pl.Int32) * 12
+                + pl.col("date").dt.month().cast(pl.Int32)
+                - 1
+            ).alias("month_index"),
+            pl.col("us_cpi_all").alias("cpi_index"),
         )
-        return eps_df
 
-    def get_eps_quarter_df(self, observe_date):
+        # merge two data source, quarterly eps is preferred
+        eps_df = (
+            pl.concat([eps_quarter_df, eps_annual_df], how="vertical")
+            .group_by(["sedol7", "month_index"])
+            .agg(pl.all().sort_by("is_quarterly", descending=True).first())
+            .join(cpi_df, how="inner", on="month_index")
+            .with_columns(
+                (pl.col("eps").cast(pl.Float64) / pl.col("cpi_index")).alias("eps")
+            )
+            .drop("cpi_index")
+            .sort(["sedol7", "month_index"])
+        )
+
+        # aggregate eps over the last 120 months
+        eps_df = eps_df.with_columns(
+            pl.col("eps")
+            .rolling_sum(window_size=120)
+            .over("sedol7")
+            .alias("rolling_eps"),
+            pl.col("month_index")
+            .shift(119)
+            .over("sedol7")
+            .alias("window_start_month_index"),
+            pl.when(pl.col("is_quarterly"))
+            .then(pl.lit(datetime.date.min))
+            .otherwise(pl.col("report_date"))
+            .rolling_max(window_size=120)
+            .over("sedol7")
+            .alias("window_annual_report_date"),
+        )
+        return eps_df.collect()
+
+    def get_quarter_report_cutoff(self, observe_date):
         """
+        latest quarterly report date known at the observe date
+
         if date >= 3/31, 6/30, 9/30, 12/31 + 3 months,
         then the corresponding quarter data is all availabel.
 
@@ -298,99 +403,28 @@ class CapeSector(BaseSector):
         else:
             raise ValueError(f"unexpected date {observe_date}")
 
-        # note that we only use quarterly data whose report date is 3/31, 6/30, 9/30, 12/31
-        eps_quarter_df = (
-            pl.scan_parquet(self.eps_quarterly_table)
-            .filter(pl.col("date").dt.year() >= latest_full_report_date.year - 11)
-            .filter(pl.col("eps").is_not_null())
-            .filter(
-                ((pl.col("date").dt.month() == 3) & (pl.col("date").dt.day() == 31))
-                | ((pl.col("date").dt.month() == 6) & (pl.col("date").dt.day() == 30))
-                | ((pl.col("date").dt.month() == 9) & (pl.col("date").dt.day() == 30))
-                | ((pl.col("date").dt.month() == 12) & (pl.col("date").dt.day() == 31))
-            )
-            .select(pl.col("sedol7"), pl.col("date"), pl.col("eps"))
-        )
-
-        eps_quarter_full_df = (
-            eps_quarter_df.filter(pl.col("date") <= latest_full_report_date)
-            .collect()
-            .select(pl.col("sedol7"), pl.col("date"), pl.col("eps"))
-        )
-
-        eps_quarter_part_df = (
-            eps_quarter_df.filter(pl.col("date") == partly_report_date)
-            .with_columns(pl.lit(observe_date).alias("observe_date"))
-            .collect()
-            .sort(pl.col("observe_date"))
-        )
-
-        announcement_df = self.get_report_announcement_date(partly_report_date).sort(
-            pl.col("announcement_date")
-        )
-
-        eps_quarter_part_df = (
-            eps_quarter_part_df.join_asof(
-                announcement_df,
-                left_on="observe_date",
-                right_on="announcement_date",
-                strategy="backward",
-            )
-            .filter(pl.col("announcement_date").is_not_null())
-            .select(pl.col("sedol7"), pl.col("date"), pl.col("eps"))
-        )
+        if self.is_report_announced(partly_report_date, observe_date):
+            return partly_report_date
+        return latest_full_report_date
 
-        eps_quarter_df = pl.concat(
-            [eps_quarter_full_df, eps_quarter_part_df], how="vertical"
-        )
-        return eps_quarter_df
-
-    def get_eps_annual_df(self, observe_date):
+    def get_annual_report_cutoff(self, observe_date):
+        """
+        latest annual report date known at the observe date
+        """
         year = observe_date.year
         if observe_date >= datetime.date(year, 3, 31):
-            latest_full_report_date = datetime.date(year - 1, 12, 31)
-            partly_report_date = None
-        else:
-            latest_full_report_date = datetime.date(year - 2, 12, 31)
-            partly_report_date = datetime.date(year - 1, 12, 31)
-
-        # note that we only use those annual data whose report date is 12/31
-        eps_annual_df = (
-            pl.scan_parquet(self.eps_annually_table)
-            .filter((pl.col("date").dt.month() == 12) & (pl.col("date").dt.day() == 31))
-            .filter(pl.col("eps").is_not_null())
-            .select(pl.col("sedol7"), pl.col("date"), pl.col("eps"))
+            return datetime.date(year - 1, 12, 31)
+        latest_full_report_date = datetime.date(year - 2, 12, 31)
+        partly_report_date = datetime.date(year - 1, 12, 31)
+        if self.is_report_announced(partly_report_date, observe_date):
+            return partly_report_date
+        return latest_full_report_date
+
+    def is_report_announced(self, report_date, observe_date):
+        """
+        the partly report is used once it is announced before the observe date
+        """
+        announcement_date = get_first_announcement_date(
+            self.report_announcement_table, report_date
         )
-        eps_annual_full_df = eps_annual_df.filter(
-            pl.col("date") <= latest_full_report_date
-        ).collect()
-
-        if partly_report_date is None:
-            return eps_annual_full_df
-        else:
-            eps_annual_part_df = (
-                eps_annual_df.filter(pl.col("date") == partly_report_date)
-                .with_columns(pl.lit(observe_date).alias("observe_date"))
-                .collect()
-                .sort(pl.col("observe_date"))
-            )
-
-            announcement_df = self.get_report_announcement_date(
-                partly_report_date
-            ).sort(pl.col("announcement_date"))
-
-            eps_annual_part_df = (
-                eps_annual_part_df.join_asof(
-                    announcement_df,
-                    left_on="observe_date",
-                    right_on="announcement_date",
-                    strategy="backward",
-                )
-                .filter(pl.col("announcement_date").is_not_null())
-                .select(pl.col("sedol7"), pl.col("date"), pl.col("eps"))
-            )
-
-            eps_annual_df = pl.concat(
-                [eps_annual_full_df, eps_annual_part_df], how="vertical"
-            )
-            return eps_annual_df
+        return announcement_date is not None and announcement_date <= observe_date
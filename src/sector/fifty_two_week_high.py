@@ -1,27 +1,68 @@
 import datetime
+from pathlib import Path
 
 import polars as pl
 
+from src.perf.profiler import profiled
 from src.sector.base_sector import BaseSector
+from src.sector.max_price import (
+    SECURITY_MAX_PRICE_TABLE,
+    adjust_leap_day,
+    get_latest_date,
+    get_panel_dates,
+)
 
 
 class FiftyTwoWeekHighSector(BaseSector):
     def __init__(self) -> None:
+        super().__init__()
         self.price_table = "parquet/base/us_security_price_daily.parquet"
+        # precomputed 52 week high, see max_price.write_security_max_price
+        self.max_price_table = SECURITY_MAX_PRICE_TABLE
 
+    @profiled
     def impl_sector_signal(self, observe_date):
-        sector_df = self.get_sector_construction()
-        security_signal_df = self.impl_security_signal(observe_date)
-        sector_signal_df = self.agg_to_sector_signal(sector_df, security_signal_df)
+        sector_signal_df = self.get_sector_signal(observe_date)
         sector_signal_df = sector_signal_df.rename({"simple_avg_signal": "z-score"})
         sector_signal_df = sector_signal_df.with_columns(
             pl.col("z-score").cast(pl.Float64).alias("z-score")
         )
         return sector_signal_df
 
+    def impl_date_sector_signal(self, date):
+        sector_df = self.get_sector_construction()
+        security_signal_df = self.impl_security_signal(date)
+        return self.agg_to_sector_signal(sector_df, security_signal_df)
+
+    def get_source_tables(self):
+        return super().get_source_tables() + [self.price_table, self.max_price_table]
+
     def impl_security_signal(self, date):
-        if date.month == 2 and date.day == 29:
-            date = datetime.date(date.year, 2, 28)
+        date = adjust_leap_day(date)
+        if Path(self.max_price_table).exists():
+            latest_price_date = get_latest_date(
+                get_panel_dates(
+                    pl.scan_parquet(self.max_price_table), self.max_price_table
+                ),
+                [None],
+                date,
+            )
+            # the window of the panel ends at a price date,
+            # a date without price falls back to the scan of the price table
+            if latest_price_date == date:
+                return (
+                    pl.scan_parquet(self.max_price_table)
+                    .filter(pl.col("date") == date)
+                    .select(
+                        pl.col("sedol7"),
+                        pl.col("date"),
+                        (pl.col("price") / pl.col("max_price")).alias("signal"),
+                    )
+                    .collect()
+                )
+        return self.impl_security_signal_from_price(date)
+
+    def impl_security_signal_from_price(self, date):
         one_year_ago = datetime.date(
             date.year - 1, date.month, date.day
         ) - datetime.timedelta(days=7)
@@ -39,7 +80,7 @@ class FiftyTwoWeekHighSector(BaseSector):
                 .alias("week_diff")
             )
             .filter(pl.col("week_diff") <= 52)
-            .groupby(pl.col("sedol7"))
+            .group_by(pl.col("sedol7"))
             .agg(pl.col("price").max().alias("max_price"))
         )
         latest_price_date = (
@@ -1,35 +1,32 @@
 import datetime
+from pathlib import Path
 
 import polars as pl
 
+from src.parquet_dataset import scan_year_partitions
+from src.perf.profiler import profiled
+from src.price_store import (
+    TICKER_MAX_PRICE_DATASET,
+    scan_ticker_max_price,
+    scan_ticker_price,
+)
 from src.sector.base_sector import BaseSector
+from src.sector.max_price import adjust_leap_day, get_latest_date, get_panel_dates
 from src.security_symbol import SecurityTicker
 
 
 class FiftyTwoWeekHighEtfSector(BaseSector):
+    # the signal depends on the security universe, not worth to persist
+    use_signal_store = False
+
     def __init__(self, security_universe, date) -> None:
-        price_base_table = "parquet/ticker/"
-        if date.month == 2 and date.day == 29:
-            date = datetime.date(date.year, 2, 28)
-        one_year_ago = datetime.date(
-            date.year - 1, date.month, date.day
-        ) - datetime.timedelta(days=7)
+        super().__init__()
         # only support SecurityTicker
         assert type(security_universe[0]) == SecurityTicker
-        price_list = []
-        for security in security_universe:
-            price_df = (
-                pl.scan_parquet(price_base_table + security.ticker + ".parquet")
-                .filter(pl.col("date") >= one_year_ago)
-                .filter(pl.col("date") <= date)
-                .rename({"adj close": "price"})
-                .filter(pl.col("price").is_not_null())
-                .collect()
-                .with_columns(pl.lit(security.ticker).alias("ticker"))
-            )
-            price_list.append(price_df)
-        self.price_df = pl.concat(price_list, how="vertical")
+        # date is not needed, the price is read as of the date of each signal
+        self.tickers = [security.ticker for security in security_universe]
 
+    @profiled
     def impl_sector_signal(self, observe_date):
         sector_signal_df = self.impl_security_signal(observe_date)
         sector_signal_df = sector_signal_df.rename(
@@ -38,20 +35,63 @@ class FiftyTwoWeekHighEtfSector(BaseSector):
         return sector_signal_df
 
     def impl_security_signal(self, date):
+        if adjust_leap_day(date) == date and Path(TICKER_MAX_PRICE_DATASET).exists():
+            latest_price_date = get_latest_date(
+                get_panel_dates(
+                    scan_year_partitions(TICKER_MAX_PRICE_DATASET),
+                    TICKER_MAX_PRICE_DATASET,
+                    "ticker",
+                ),
+                self.tickers,
+                date,
+            )
+            # the window of the panel ends at a price date,
+            # a date without price falls back to the scan of the price store
+            if latest_price_date == date:
+                return (
+                    scan_ticker_max_price(self.tickers, date, date)
+                    .select(
+                        pl.col("ticker"),
+                        pl.col("date"),
+                        (pl.col("price") / pl.col("max_price")).alias("signal"),
+                    )
+                    .collect()
+                )
+        return self.impl_security_signal_from_price(date)
+
+    def get_price_df(self, date):
+        """
+        schema: "ticker", "date", "price", ...
+
+        adj close of the year before date
+        """
+        date = adjust_leap_day(date)
+        one_year_ago = datetime.date(
+            date.year - 1, date.month, date.day
+        ) - datetime.timedelta(days=7)
+        return (
+            scan_ticker_price(self.tickers, one_year_ago, date)
+            .rename({"adj close": "price"})
+            .filter(pl.col("price").is_not_null())
+            .collect()
+        )
+
+    def impl_security_signal_from_price(self, date):
+        price_df = self.get_price_df(date)
         max_price_df = (
-            self.price_df.with_columns(
+            price_df.with_columns(
                 ((date - pl.col("date")) / datetime.timedelta(days=7))
                 .cast(pl.Int8)
                 .alias("week_diff")
             )
             .filter(pl.col("week_diff") <= 52)
-            .groupby(pl.col("ticker"))
+            .group_by(pl.col("ticker"))
             .agg(pl.col("price").max().alias("max_price"))
         )
         latest_price_date = (
-            self.price_df.select(pl.col("date").max()).get_column("date").item(0)
+            price_df.select(pl.col("date").max()).get_column("date").item(0)
         )
-        lastest_price_df = self.price_df.filter(pl.col("date") == latest_price_date)
+        lastest_price_df = price_df.filter(pl.col("date") == latest_price_date)
 
         assert (
             lastest_price_df.group_by("ticker")
@@ -0,0 +1,107 @@
+import bisect
+import datetime
+import os
+from pathlib import Path
+
+import polars as pl
+
+# the 52 week high looks back over the dates whose week diff is at most 52,
+# i.e. at most 370 days before, the window is (date - 371 days, date]
+MAX_PRICE_PERIOD = "371d"
+# sedol7 x date panel of the 52 week high price, sorted by date
+SECURITY_MAX_PRICE_TABLE = "parquet/base/us_security_max_price_daily.parquet"
+# number of dates covered by one parquet row group of the panel
+DATES_PER_ROW_GROUP = 16
+
+# key is the panel table, value is the sorted dates of each id, see get_panel_dates,
+# built lazily and shared by all sector instances, never modify them in place
+_panel_dates = {}
+
+
+def get_max_price(price_df, id_column):
+    """
+    schema: id_column, "date", "price", "max_price"
+
+    price_df: id_column, "date", "price", one row per id and date
+
+    max_price is the max price over the MAX_PRICE_PERIOD window ending at the date,
+    null prices are skipped. sorted by date and id
+    """
+    return (
+        price_df.filter(pl.col("price").is_not_null())
+        .select(id_column, "date", "price")
+        .sort([id_column, "date"])
+        .rolling(index_column="date", period=MAX_PRICE_PERIOD, group_by=id_column)
+        .agg(
+            pl.col("price").last().alias("price"),
+            pl.col("price").max().alias("max_price"),
+        )
+        .sort(["date", id_column])
+    )
+
+
+def write_security_max_price(price_table, path=SECURITY_MAX_PRICE_TABLE):
+    """
+    panel of the 52 week high of every sedol, built from the daily price table
+    """
+    max_price_df = get_max_price(pl.read_parquet(price_table), "sedol7")
+    rows_per_date = len(max_price_df) // max(
+        max_price_df.get_column("date").n_unique(), 1
+    )
+    path = Path(path)
+    # write to a temporary file first, readers never see a partial panel
+    tmp_path = path.parent / f".{path.name}.{os.getpid()}.tmp"
+    max_price_df.write_parquet(
+        tmp_path,
+        statistics=True,
+        row_group_size=max(rows_per_date * DATES_PER_ROW_GROUP, 1024),
+    )
+    os.replace(tmp_path, path)
+    clear_panel_dates()
+
+
+def get_panel_dates(scan, key, id_column=None):
+    """
+    key is the id, value is the sorted dates of the id in the panel,
+    without id_column the only key is None, for the dates of all ids.
+    cached under the key argument
+    """
+    if key not in _panel_dates:
+        if id_column is None:
+            dates = scan.select(pl.col("date").unique().sort()).collect()
+            _panel_dates[key] = {None: dates.get_column("date").to_list()}
+        else:
+            date_df = (
+                scan.select(id_column, "date")
+                .collect()
+                .group_by(id_column)
+                .agg(pl.col("date").sort())
+            )
+            _panel_dates[key] = dict(date_df.iter_rows())
+    return _panel_dates[key]
+
+
+def clear_panel_dates():
+    _panel_dates.clear()
+
+
+def get_latest_date(panel_dates, ids, date):
+    """
+    latest date on or before date over the dates of ids, None if there is not any
+    """
+    latest_date = None
+    for id in ids:
+        dates = panel_dates.get(id, [])
+        index = bisect.bisect_right(dates, date)
+        if index > 0 and (latest_date is None or dates[index - 1] > latest_date):
+            latest_date = dates[index - 1]
+    return latest_date
+
+
+def adjust_leap_day(date):
+    """
+    the 52 week high is computed as of 2/28 on a leap day
+    """
+    if date.month == 2 and date.day == 29:
+        return datetime.date(date.year, 2, 28)
+    return date
@@ -0,0 +1,79 @@
+import datetime
+
+import polars as pl
+
+# key is the announcement table, built lazily and shared by all sector instances,
+# never modify them in place
+_announcement_index = {}
+_first_announcement = {}
+
+
+def build_announcement_index(table):
+    """
+    schema: "sedol7", "report_date", "announcement_date"
+
+    point-in-time announcement date of every report, sorted by (sedol7, report_date)
+    """
+    # we only care about those report date in 3/31, 6/30, 9/30, 12/31
+    # we only consider the diff between announcement_date and report_date in range (0, 3] months is reasonable
+    # for those missing data or gap larger than 3 months, we just fix it to be report_date + 3 months
+    announcement_df = (
+        pl.scan_parquet(table)
+        .filter(pl.col("announcement_date").is_not_null())
+        .filter(
+            pl.col("announcement_date") - pl.col("report_date")
+            > datetime.timedelta(days=0)
+        )
+        .filter(
+            pl.col("announcement_date") - pl.col("report_date")
+            <= datetime.timedelta(days=93)
+        )
+        .filter(
+            (
+                (pl.col("report_date").dt.month() == 3)
+                & (pl.col("report_date").dt.day() == 31)
+            )
+            | (
+                (pl.col("report_date").dt.month() == 6)
+                & (pl.col("report_date").dt.day() == 30)
+            )
+            | (
+                (pl.col("report_date").dt.month() == 9)
+                & (pl.col("report_date").dt.day() == 30)
+            )
+            | (
+                (pl.col("report_date").dt.month() == 12)
+                & (pl.col("report_date").dt.day() == 31)
+            )
+        )
+        .select(["sedol7", "report_date", "announcement_date"])
+        .sort(["sedol7", "report_date"])
+        .collect()
+    )
+    return announcement_df
+
+
+def get_announcement_index(table):
+    """
+    cached version of build_announcement_index
+    """
+    if table not in _announcement_index:
+        _announcement_index[table] = build_announcement_index(table)
+    return _announcement_index[table]
+
+
+def get_first_announcement_date(table, report_date):
+    """
+    the date the report is first announced by any security, None if never
+
+    CapeSector treats a report as known for all securities from this date on,
+    once any security announced it, the cutoff is not per security
+    """
+    if table not in _first_announcement:
+        _first_announcement[table] = dict(
+            get_announcement_index(table)
+            .group_by("report_date")
+            .agg(pl.col("announcement_date").min())
+            .iter_rows()
+        )
+    return _first_announcement[table].get(report_date)
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import polars as pl
+
+SECTOR_INFO_TABLE = "parquet/base/us_sector_info.parquet"
+SECTOR_WEIGHT_TABLE = "parquet/base/us_sector_weight.parquet"
+# optional precomputed result of build_sector_construction
+SECTOR_CONSTRUCTION_TABLE = "parquet/base/us_sector_construction.parquet"
+
+# built lazily and shared by all sector instances of the process,
+# never modify them in place
+_sector_construction = None
+_sector_index = None
+
+
+def build_sector_construction():
+    """
+    schema: "sedol7", "date", "sector", "weight"
+
+    weight is adjusted based on the date and sector
+    """
+    sector_info = pl.read_parquet(SECTOR_INFO_TABLE).select(
+        ["sedol7", "date", "sector"]
+    )
+
+    # originally, the weight is based on the all sectors
+    sector_weight = pl.read_parquet(SECTOR_WEIGHT_TABLE).select(
+        ["sedol7", "date", "weight"]
+    )
+
+    merge = sector_info.join(sector_weight, on=["sedol7", "date"], how="inner").select(
+        ["sedol7", "date", "sector", "weight"]
+    )
+
+    # calculate the total weight for any particualr sector
+    new_weight_base = merge.group_by(["date", "sector"]).agg(
+        pl.col("weight").sum().alias("total_weight")
+    )
+
+    # new weight is based on any particular sector
+    sector_weight_df = (
+        merge.join(new_weight_base, on=["date", "sector"], how="left")
+        .with_columns((pl.col("weight") / pl.col("total_weight")).alias("weight"))
+        .select(["sedol7", "date", "sector", "weight"])
+    )
+    return sector_weight_df
+
+
+def write_sector_construction():
+    """
+    precompute the sector construction, get_sector_construction reads it on startup
+    """
+    build_sector_construction().sort(["sedol7", "date"]).write_parquet(
+        SECTOR_CONSTRUCTION_TABLE
+    )
+
+
+def is_precomputed_table_valid():
+    table = Path(SECTOR_CONSTRUCTION_TABLE)
+    if not table.exists():
+        return False
+    mtime = table.stat().st_mtime_ns
+    return all(
+        Path(source).stat().st_mtime_ns <= mtime
+        for source in [SECTOR_INFO_TABLE, SECTOR_WEIGHT_TABLE]
+    )
+
+
+def get_sector_construction():
+    """
+    process-wide sector construction, same schema as build_sector_construction
+
+    read from the precomputed table if it is newer than its sources
+    """
+    global _sector_construction
+    if _sector_construction is None:
+        if is_precomputed_table_valid():
+            _sector_construction = pl.read_parquet(SECTOR_CONSTRUCTION_TABLE)
+        else:
+            _sector_construction = build_sector_construction()
+    return _sector_construction
+
+
+def get_sector_index():
+    """
+    schema: "sedol7", "date", "sector", "weight", "ym"
+
+    only valid sector and positive weight, sorted by (sedol7, ym),
+    ready to join with the security signal on (sedol7, ym)
+    """
+    global _sector_index
+    if _sector_index is None:
+        _sector_index = (
+            get_sector_construction()
+            .filter(pl.col("weight") > 0)
+            .filter(pl.col("sector") != pl.lit("--"))
+            .with_columns(pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym"))
+            .sort(["sedol7", "ym"])
+        )
+    return _sector_index
+
+
+def get_indexed_sector_df(sector_df):
+    """
+    valid rows of sector_df with a ym column, see get_sector_index
+
+    the shared sector construction is served from the prebuilt index
+    """
+    if sector_df is _sector_construction:
+        return get_sector_index()
+    return (
+        sector_df.filter(pl.col("weight") > 0)
+        .filter(pl.col("sector") != pl.lit("--"))
+        .with_columns(pl.col("date").cast(pl.String).str.slice(0, 7).alias("ym"))
+    )
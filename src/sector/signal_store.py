@@ -0,0 +1,93 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import polars as pl
+
+from src.parquet_dataset import get_dataset_vintage
+
+
+class SignalStore:
+    """
+    on-disk store of sector signals, shared by runs, notebooks and processes
+
+    layout: {root}/{factor}/{category}/{key}.parquet
+
+    the store is keyed on the vintage of its source tables, the manifest of a
+    dataset or the size and mtime of a file, and on the parameters of the
+    signal, e.g. the code version, see get_code_version.
+    it is cleared once any of them changes
+    """
+
+    def __init__(
+        self,
+        factor,
+        category,
+        source_tables,
+        parameters=None,
+        root="parquet/signal_store",
+    ):
+        self.path = Path(root) / factor / category
+        self.vintage = self.get_vintage(source_tables, parameters or {})
+        self.check_vintage()
+
+    def get_vintage(self, source_tables, parameters):
+        digest = hashlib.sha1()
+        for name in sorted(parameters):
+            digest.update(f"{name}={parameters[name]!r};".encode())
+        for table in sorted(source_tables):
+            path = Path(table)
+            dataset_vintage = get_dataset_vintage(path)
+            if dataset_vintage is not None:
+                # the manifest tracks every write of the dataset
+                digest.update(f"{table}:{dataset_vintage};".encode())
+                continue
+            if path.is_dir():
+                # partitioned dataset, every partition counts
+                files = sorted(path.rglob("*.parquet"))
+            elif path.exists():
+                files = [path]
+            else:
+                digest.update(f"{table}:missing;".encode())
+                continue
+            for file in files:
+                stat = file.stat()
+                digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        return digest.hexdigest()
+
+    def check_vintage(self):
+        vintage_file = self.path / "vintage"
+        if vintage_file.exists() and vintage_file.read_text() == self.vintage:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        for file in self.path.glob("*.parquet"):
+            file.unlink(missing_ok=True)
+        tmp_file = self.path / f".vintage.{os.getpid()}"
+        tmp_file.write_text(self.vintage)
+        os.replace(tmp_file, vintage_file)
+
+    def read(self, key):
+        file = self.path / f"{key}.parquet"
+        if not file.exists():
+            return None
+        return pl.read_parquet(file)
+
+    def write(self, key, df: pl.DataFrame):
+        # write to a temporary file first, other processes never see a partial file
+        tmp_file = self.path / f".{key}.{os.getpid()}.tmp"
+        df.write_parquet(tmp_file)
+        os.replace(tmp_file, self.path / f"{key}.parquet")
+
+
+def get_code_version(cls):
+    """
+    hash of the source files of the class and its base classes in src,
+    the signal store of the class is cleared once any of them is edited
+    """
+    digest = hashlib.sha1()
+    for module in sorted({klass.__module__ for klass in cls.__mro__}):
+        file = getattr(sys.modules.get(module), "__file__", None)
+        if module.startswith("src.") and file is not None:
+            digest.update(Path(file).read_bytes())
+    return digest.hexdigest()
@@ -2,26 +2,31 @@ import datetime
 
 import polars as pl
 
+from src.perf.profiler import profiled
 from src.sector.base_sector import BaseSector
 
 
 class VolumeSector(BaseSector):
     def __init__(self) -> None:
+        super().__init__()
         self.table = f"parquet/volume/us_security_volume_daily.parquet"
         self.sector_df = self.get_sector_construction()
 
+    @profiled
     def impl_sector_signal(self, observe_date):
         """
         1. construct sector
         2. generate sector signal
         """
-        signal_df = self.impl_security_signal(observe_date)
-        sector_signal_df = self.agg_to_sector_signal(self.sector_df, signal_df, True)
+        sector_signal_df = self.get_sector_signal(observe_date)
         sector_signal_df = sector_signal_df.filter(
             pl.col("weighted_signal").is_not_nan()
         ).rename({"weighted_signal": "z-score"})
         return sector_signal_df
 
+    def get_source_tables(self):
+        return super().get_source_tables() + [self.table]
+
     def impl_security_signal(self, date):
         """
         use the average volume of current month divided by
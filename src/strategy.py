@@ -2,6 +2,8 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
 
 class OrderType(Enum):
     BUY = "buy"
@@ -22,17 +24,44 @@ class Strategy(ABC):
         self.blacklist = blacklist
 
     @abstractmethod
-    def get_order(self, security, iter_index):
+    def get_order(self, security, iter_index, prev_rebalance_index):
         raise NotImplementedError()
 
+    def get_orders(self, iter_index, prev_rebalance_index):
+        """
+        orders of all holdings of the day, NOOP is left out
+
+        the default calls get_order lazily for every holding,
+        so each order sees the portfolio after the previous one is executed
+        """
+        for security in self.portfolio.hold_securities(iter_index):
+            order = self.get_order(security, iter_index, prev_rebalance_index)
+            if order.type != OrderType.NOOP:
+                yield order
+
+    def first_trigger_index(self, securities, value_path, prev_rebalance_index):
+        """
+        offset of the first day in value_path the strategy may trade,
+        None if it never trades in the segment, see Portfolio.get_value_path
+
+        by default the strategy may trade on any day
+        """
+        return 0
+
 
 class NoStrategy(Strategy):
     def __init__(self, portfolio, blacklist):
         super().__init__(portfolio, blacklist)
 
-    def get_order(self, security, iter_index):
+    def get_order(self, security, iter_index, prev_rebalance_index):
         return Order(OrderType.NOOP)
 
+    def get_orders(self, iter_index, prev_rebalance_index):
+        return []
+
+    def first_trigger_index(self, securities, value_path, prev_rebalance_index):
+        return None
+
 
 class StopGainAndLoss(Strategy):
     def __init__(self, portfolio, blacklist):
@@ -53,15 +82,58 @@ class StopGainAndLoss(Strategy):
         range_return = (cur_value - start_value) / start_value
 
         if range_return > self.gain_limit or range_return < self.loss_limit:
-            if range_return > 0:
-                print(
-                    f"{self.portfolio.date_df.item(iter_index, 0)}: stop gain {security}"
-                )
-            else:
-                print(
-                    f"{self.portfolio.date_df.item(iter_index, 0)}: stop loss {security}"
-                )
-            self.blacklist.append(security)
-            weight = self.portfolio.get_security_weight(security, iter_index)
-            return Order(OrderType.SELL, security, weight)
+            return self.stop(security, iter_index, range_return)
         return Order(OrderType.NOOP)
+
+    def get_orders(self, iter_index, prev_rebalance_index):
+        """
+        batched version of get_order over all holdings
+
+        a stop rebalances the portfolio and restarts the range of every holding,
+        thus only the first triggered holding of the day is sold
+        """
+        securities = self.portfolio.hold_securities(iter_index)
+        cur_value = self.portfolio.get_security_values(securities, iter_index)
+        triggered = self.get_triggered(
+            securities, cur_value[np.newaxis, :], prev_rebalance_index
+        )[0]
+        if not triggered.any():
+            return []
+        column = np.flatnonzero(triggered)[0]
+        start_value = self.portfolio.get_security_value(
+            securities[column], prev_rebalance_index
+        )
+        range_return = (cur_value[column].item() - start_value) / start_value
+        return [self.stop(securities[column], iter_index, range_return)]
+
+    def first_trigger_index(self, securities, value_path, prev_rebalance_index):
+        """
+        scan the range return of the whole segment at once
+        """
+        triggered = self.get_triggered(securities, value_path, prev_rebalance_index)
+        days = np.flatnonzero(triggered.any(axis=1))
+        if len(days) == 0:
+            return None
+        return days[0].item()
+
+    def get_triggered(self, securities, value_path, prev_rebalance_index):
+        """
+        whether the stop gain/loss fires, day x security
+        """
+        start_value = self.portfolio.get_security_values(
+            securities, prev_rebalance_index
+        )
+        range_return = (value_path - start_value) / start_value
+        return (value_path != 0) & (
+            (range_return > self.gain_limit) | (range_return < self.loss_limit)
+        )
+
+    def stop(self, security, iter_index, range_return):
+        self.blacklist.append(security)
+        weight = self.portfolio.get_security_weight(security, iter_index)
+        self.portfolio.event_log.record(
+            self.portfolio.date_df.item(iter_index, 0),
+            "stop gain" if range_return > 0 else "stop loss",
+            [(security, -weight)],
+        )
+        return Order(OrderType.SELL, security, weight)
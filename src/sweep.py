@@ -0,0 +1,335 @@
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import polars as pl
+
+from src import fund_universe
+from src.backtest import BackTest
+from src.benchmark import Benchmark
+from src.event_log import EventLog
+from src.factor.cape import CapeFactor
+from src.factor.dividend_yield import DividendYieldFactor
+from src.factor.fifty_two_week_high import FiftyTwoWeekHighFactor
+from src.factor.fifty_two_week_high_etf import FiftyTwoWeekHighEtfFactor
+from src.factor.roe import RoeFactor
+from src.factor.sales_growth import SalesGrowthFactor
+from src.factor.volume import VolumeFactor
+from src.factor_aggregator.lasso_aggregator import LassoAggregator
+from src.factor_aggregator.simple_average_aggregator import SimpleAverageAggregator
+from src.factor_aggregator.weighted_average_aggregator import WeightedAverageAggregator
+from src.market import Market
+from src.portfolio import Portfolio
+from src.rebalance import Rebalance
+from src.sector.sector_construction import (
+    is_precomputed_table_valid,
+    write_sector_construction,
+)
+from src.security_symbol import SecurityTicker
+from src.strategy import StopGainAndLoss
+
+FACTORS = {
+    factor.__name__: factor
+    for factor in [
+        CapeFactor,
+        DividendYieldFactor,
+        FiftyTwoWeekHighFactor,
+        FiftyTwoWeekHighEtfFactor,
+        RoeFactor,
+        SalesGrowthFactor,
+        VolumeFactor,
+        LassoAggregator,
+        SimpleAverageAggregator,
+        WeightedAverageAggregator,
+    ]
+}
+
+UNIVERSES = {
+    "INVESCO_SECTOR_ETF_TICKER": fund_universe.INVESCO_SECTOR_ETF_TICKER,
+    "ISHARE_SECTOR_ETF_TICKER": fund_universe.ISHARE_SECTOR_ETF_TICKER,
+    "INVESCO_SECTOR_ETF_LIPPER": fund_universe.INVESCO_SECTOR_ETF_LIPPER,
+}
+
+# columns of a result row computed by a backtest
+METRICS = [
+    "final_value",
+    "annual_return",
+    "annual_volatility",
+    "max_drawdown",
+    "turnover",
+    "benchmark_annual_return",
+]
+
+# key is (universe, start_date, end_date), loaded lazily by every worker
+# from the local parquet, never modify them in place
+_markets = {}
+_benchmarks = {}
+
+
+def is_supported(factor, universe):
+    """
+    the factor supports the symbol type of every security of the universe
+    """
+    return all(
+        isinstance(security, FACTORS[factor].security_types)
+        for security in UNIVERSES[universe]
+    )
+
+
+def build_grid(
+    factors,
+    universes,
+    rebalance_periods=(1,),
+    rebalance_intervals=("1mo",),
+    limits=((1, 1),),
+    nums=(3,),
+    factor_types=("long",),
+):
+    """
+    cartesian product of the sweep parameters, one dict per backtest
+
+    factors and universes are given by name, see FACTORS and UNIVERSES,
+    limits is a list of (gain_limit, loss_limit) for StopGainAndLoss.set_limit,
+    the pairs of a factor and a universe it does not support are skipped
+    """
+    unsupported = [
+        (factor, universe)
+        for factor, universe in itertools.product(factors, universes)
+        if not is_supported(factor, universe)
+    ]
+    if len(unsupported) == len(factors) * len(universes):
+        raise ValueError(f"no factor supports the universes {list(universes)}")
+    for factor, universe in unsupported:
+        warnings.warn(f"skip {factor} on {universe}, the universe is not supported")
+    grid = []
+    for (
+        factor,
+        universe,
+        period,
+        interval,
+        limit,
+        num,
+        factor_type,
+    ) in itertools.product(
+        factors,
+        universes,
+        rebalance_periods,
+        rebalance_intervals,
+        limits,
+        nums,
+        factor_types,
+    ):
+        if (factor, universe) in unsupported:
+            continue
+        grid.append(
+            {
+                "factor": factor,
+                "universe": universe,
+                "rebalance_period": period,
+                "rebalance_interval": interval,
+                "gain_limit": limit[0],
+                "loss_limit": limit[1],
+                "num": num,
+                "factor_type": factor_type,
+            }
+        )
+    return grid
+
+
+def get_index_ticker(universe):
+    return "^SPXEW" if universe == "INVESCO_SECTOR_ETF_TICKER" else "^SPX"
+
+
+def get_market(universe, start_date, end_date):
+    key = (universe, start_date, end_date)
+    if key not in _markets:
+        _markets[key] = Market(
+            UNIVERSES[universe], start_date, end_date, return_cube=True
+        )
+    return _markets[key]
+
+
+def get_benchmark_performance(universe, start_date, end_date):
+    key = (get_index_ticker(universe), start_date, end_date)
+    if key not in _benchmarks:
+        benchmark = Benchmark(
+            SecurityTicker(get_index_ticker(universe), "index"), start_date, end_date
+        )
+        _benchmarks[key] = benchmark.get_performance()
+    return _benchmarks[key]
+
+
+def prepare_shared_data():
+    """
+    precompute the sector construction before starting workers,
+    thus every worker reads it from parquet instead of building it again
+    """
+    if not is_precomputed_table_valid():
+        write_sector_construction()
+
+
+def get_annual_return(value_df, annualized_factor):
+    values = value_df.get_column("value")
+    return (values.item(-1) / values.item(0)) ** (1 / annualized_factor) - 1
+
+
+def run_backtest(config, start_date, end_date):
+    """
+    run a single backtest of the sweep, return a row of the result table
+
+    a failed backtest never aborts the sweep, its row has the error and no metric
+    """
+    try:
+        return {**get_backtest_metrics(config, start_date, end_date), "error": None}
+    except Exception as error:
+        return {
+            **config,
+            **{metric: None for metric in METRICS},
+            "error": f"{type(error).__name__}: {error}",
+        }
+
+
+def get_backtest_metrics(config, start_date, end_date):
+    security_universe = UNIVERSES[config["universe"]]
+    market = get_market(config["universe"], start_date, end_date)
+
+    factor = FACTORS[config["factor"]](security_universe, config["factor_type"])
+    factor.num = config["num"]
+    # the trading log of the workers is kept in memory only
+    portfolio = Portfolio(
+        100.0, start_date, end_date, event_log=EventLog(verbose=False)
+    )
+    factor.set_portfolio_at_start(portfolio)
+
+    blacklist = []
+    strategy = StopGainAndLoss(portfolio, blacklist)
+    strategy.set_limit(config["gain_limit"], config["loss_limit"])
+    rebalance = Rebalance(
+        config["rebalance_period"],
+        portfolio,
+        factor,
+        blacklist,
+        config["rebalance_interval"],
+    )
+    backtest = BackTest(portfolio, strategy, market, rebalance)
+    backtest.run()
+
+    value_df = portfolio.value_book
+    annualized_factor = (
+        value_df.get_column("date").item(-1) - value_df.get_column("date").item(0)
+    ) / datetime.timedelta(days=365)
+    values = value_df.get_column("value").to_numpy()
+    daily_return = values[1:] / values[:-1] - 1
+    drawdown = values / np.maximum.accumulate(values) - 1
+
+    benchmark_df = get_benchmark_performance(config["universe"], start_date, end_date)
+    return {
+        **config,
+        "final_value": values[-1],
+        "annual_return": get_annual_return(value_df, annualized_factor),
+        "annual_volatility": daily_return.std() * np.sqrt(252),
+        "max_drawdown": drawdown.min(),
+        "turnover": value_df.get_column("turnover").sum(),
+        "benchmark_annual_return": get_annual_return(benchmark_df, annualized_factor),
+    }
+
+
+def run_sweep(grid, start_date, end_date, max_workers=None):
+    """
+    run every backtest of the grid over a process pool, one row per backtest
+
+    every worker loads the markets, benchmarks and sector construction from
+    the local parquet on first use and keeps them for its later backtests,
+    nothing is pickled from the parent. workers are spawned rather than forked,
+    polars' thread pool is not safe to use after a fork.
+    sector signals are shared through the on-disk signal store.
+    """
+    prepare_shared_data()
+    with ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        rows = list(
+            executor.map(
+                run_backtest,
+                grid,
+                itertools.repeat(start_date),
+                itertools.repeat(end_date),
+            )
+        )
+    # the metrics of a failed backtest are null, keep the schema in any case
+    result_df = (
+        pl.DataFrame(rows, infer_schema_length=None)
+        .with_columns(pl.col(METRICS).cast(pl.Float64), pl.col("error").cast(pl.String))
+        .with_columns(
+            (pl.col("annual_return") - pl.col("benchmark_annual_return")).alias(
+                "excess_return"
+            )
+        )
+    )
+    return result_df
+
+
+def parse_limit(limit):
+    gain_limit, loss_limit = limit.split(",")
+    return float(gain_limit), float(loss_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run a grid of backtests in parallel")
+    parser.add_argument("--factor", nargs="+", required=True, choices=FACTORS)
+    parser.add_argument(
+        "--universe",
+        nargs="+",
+        default=["INVESCO_SECTOR_ETF_TICKER"],
+        choices=UNIVERSES,
+    )
+    parser.add_argument("--rebalance-period", nargs="+", type=int, default=[1])
+    parser.add_argument("--rebalance-interval", nargs="+", default=["1mo"])
+    parser.add_argument(
+        "--limit",
+        nargs="+",
+        type=parse_limit,
+        default=[(1, 1)],
+        help="gain_limit,loss_limit of the stop gain and loss strategy",
+    )
+    parser.add_argument("--num", nargs="+", type=int, default=[3])
+    parser.add_argument(
+        "--factor-type", nargs="+", default=["long"], choices=["long", "short", "mid"]
+    )
+    parser.add_argument(
+        "--start-date",
+        type=datetime.date.fromisoformat,
+        default=datetime.date(2013, 1, 31),
+    )
+    parser.add_argument(
+        "--end-date",
+        type=datetime.date.fromisoformat,
+        default=datetime.date(2023, 10, 31),
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="sweep_result.parquet")
+    args = parser.parse_args()
+
+    grid = build_grid(
+        args.factor,
+        args.universe,
+        args.rebalance_period,
+        args.rebalance_interval,
+        args.limit,
+        args.num,
+        args.factor_type,
+    )
+    result_df = run_sweep(grid, args.start_date, args.end_date, args.workers)
+    result_df.write_parquet(args.output)
+    print(result_df.sort("excess_return", descending=True, nulls_last=True))
+    error_count = result_df.get_column("error").is_not_null().sum()
+    if error_count > 0:
+        print(f"{error_count} backtest(s) failed, see the error column")
+
+
+if __name__ == "__main__":
+    main()
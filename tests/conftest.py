@@ -0,0 +1,22 @@
+import pytest
+
+from src.perf.synthetic_data import write_synthetic_data
+
+
+@pytest.fixture(scope="session")
+def synthetic_data(tmp_path_factory):
+    """
+    (root, start_date, end_date) of a small synthetic data set, see src/perf
+    """
+    root = tmp_path_factory.mktemp("synthetic")
+    start_date, end_date = write_synthetic_data(root, 11, 2)
+    return root, start_date, end_date
+
+
+@pytest.fixture
+def in_synthetic_data(synthetic_data, monkeypatch):
+    """
+    all tables are read relative to the synthetic data set
+    """
+    monkeypatch.chdir(synthetic_data[0])
+    return synthetic_data
@@ -0,0 +1,108 @@
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.backtest import BackTest, MultiLegBackTest
+from src.event_log import EventLog
+from src.factor.roe import RoeFactor
+from src.market import Market
+from src.perf.bench import get_universe
+from src.portfolio import Portfolio
+from src.rebalance import Rebalance
+from src.strategy import StopGainAndLoss
+
+
+def get_backtests(market, universe, start_date, end_date, event_driven):
+    """
+    long, short and mid legs of one factor, as in src/run.py
+    """
+    factor = RoeFactor(universe, "long")
+    backtests = []
+    for factor_type in ["long", "short", "mid"]:
+        leg = factor.get_leg(factor_type)
+        portfolio = Portfolio(
+            100.0, start_date, end_date, event_log=EventLog(verbose=False)
+        )
+        leg.set_portfolio_at_start(portfolio)
+        blacklist = []
+        strategy = StopGainAndLoss(portfolio, blacklist)
+        # tight limits, thus stops happen between rebalances
+        strategy.set_limit(0.05, 0.05)
+        rebalance = Rebalance(1, portfolio, leg, blacklist, "1mo")
+        backtests.append(BackTest(portfolio, strategy, market, rebalance, event_driven))
+    return backtests
+
+
+def assert_book_equal(portfolio, expected):
+    assert_frame_equal(portfolio.value_book, expected.value_book, check_exact=True)
+    assert portfolio.security_book.keys() == expected.security_book.keys()
+    for security, security_df in expected.security_book.items():
+        assert_frame_equal(
+            portfolio.security_book[security], security_df, check_exact=True
+        )
+    assert_frame_equal(portfolio.event_book, expected.event_book)
+
+
+@pytest.fixture
+def market(in_synthetic_data):
+    _, start_date, end_date = in_synthetic_data
+    return Market(get_universe(11), start_date, end_date, return_cube=True)
+
+
+def test_event_driven_backtest_matches_daily(in_synthetic_data, market):
+    _, start_date, end_date = in_synthetic_data
+    universe = get_universe(11)
+    daily = get_backtests(market, universe, start_date, end_date, False)[0]
+    daily.run()
+    event_driven = get_backtests(market, universe, start_date, end_date, True)[0]
+    event_driven.run()
+    assert_book_equal(event_driven.portfolio, daily.portfolio)
+
+
+def test_event_driven_multi_leg_backtest_matches_daily(in_synthetic_data, market):
+    _, start_date, end_date = in_synthetic_data
+    universe = get_universe(11)
+    daily = MultiLegBackTest(
+        get_backtests(market, universe, start_date, end_date, False)
+    )
+    assert not daily.event_driven
+    daily.run()
+    event_driven = MultiLegBackTest(
+        get_backtests(market, universe, start_date, end_date, True)
+    )
+    assert event_driven.event_driven
+    event_driven.run()
+
+    stop_count = 0
+    for backtest, expected in zip(event_driven.backtests, daily.backtests):
+        assert_book_equal(backtest.portfolio, expected.portfolio)
+        stop_count += len(
+            backtest.portfolio.event_book.filter(
+                pl.col("event").str.starts_with("stop")
+            )
+        )
+    # the segments are cut by the stops of every leg, not only by rebalances
+    assert stop_count > 0
+
+
+def test_multi_leg_fast_forward_skips_days(in_synthetic_data, market):
+    _, start_date, end_date = in_synthetic_data
+    backtest = MultiLegBackTest(
+        get_backtests(market, get_universe(11), start_date, end_date, True)
+    )
+    iterate = backtest.iterate
+    days = []
+    backtest.iterate = lambda: days.append(backtest.iter_index) or iterate()
+    backtest.run()
+    assert 0 < len(days) < len(backtest.date_df) // 2
+
+
+def test_backtest_without_return_cube_runs_day_by_day(in_synthetic_data):
+    _, start_date, end_date = in_synthetic_data
+    universe = get_universe(11)
+    market = Market(universe, start_date, end_date)
+    with pytest.warns(UserWarning, match="no return cube"):
+        backtests = get_backtests(market, universe, start_date, end_date, True)
+    assert not any(backtest.event_driven for backtest in backtests)
+    assert not MultiLegBackTest(backtests).event_driven
@@ -0,0 +1,146 @@
+import datetime
+
+import numpy as np
+import polars as pl
+import pytest
+
+from src.perf.synthetic_data import get_sedols, write_synthetic_data
+from src.sector import cape
+from src.sector.cape import CapeSector
+
+# every branch of the report cutoffs, before and after the partly reports are announced
+OBSERVE_DATES = [
+    datetime.date(2022, 1, 3),
+    datetime.date(2022, 1, 31),
+    datetime.date(2022, 3, 30),
+    datetime.date(2022, 3, 31),
+    datetime.date(2022, 5, 16),
+    datetime.date(2022, 7, 1),
+    datetime.date(2022, 8, 31),
+    datetime.date(2022, 11, 30),
+    datetime.date(2022, 12, 30),
+    datetime.date(2023, 2, 28),
+    datetime.date(2023, 10, 31),
+]
+
+
+def is_quarter_end(date):
+    return (date.month, date.day) in [(3, 31), (6, 30), (9, 30), (12, 31)]
+
+
+def get_reports(table, is_report_date, cutoff):
+    """
+    key is (sedol7, report_date), max eps of the non null rows known at the cutoff
+    """
+    reports = {}
+    for sedol7, date, eps in (
+        pl.read_parquet(table).select("sedol7", "date", "eps").iter_rows()
+    ):
+        if eps is None or not is_report_date(date) or date > cutoff:
+            continue
+        reports[sedol7, date] = max(eps, reports.get((sedol7, date), eps))
+    return reports
+
+
+def get_reference_cape_eps(sector, date):
+    """
+    key is sedol7, value is the agg_eps rebuilt month by month from the raw tables,
+    the same rules as the per-date construction the eps panel replaced
+    """
+    quarter_cutoff = sector.get_quarter_report_cutoff(date)
+    annual_cutoff = sector.get_annual_report_cutoff(date)
+    eleven_years_ago = date.year - 11
+
+    # key is (sedol7, year, month), quarterly eps is preferred
+    monthly_eps = {}
+    for (sedol7, report_date), eps in get_reports(
+        sector.eps_quarterly_table, is_quarter_end, quarter_cutoff
+    ).items():
+        for diff in range(3):
+            monthly_eps[sedol7, report_date.year, report_date.month - diff] = eps / 4
+    for (sedol7, report_date), eps in get_reports(
+        sector.eps_annually_table,
+        lambda date: (date.month, date.day) == (12, 31),
+        annual_cutoff,
+    ).items():
+        for month in range(1, 13):
+            monthly_eps.setdefault((sedol7, report_date.year, month), eps / 12)
+
+    cpi = {
+        (cpi_date.year, cpi_date.month): cpi_index
+        for cpi_date, cpi_index in pl.read_parquet(sector.cpi_table)
+        .select("date", "us_cpi_all")
+        .iter_rows()
+        if eleven_years_ago <= cpi_date.year <= date.year
+    }
+    latest_cpi_index = max(cpi.values())
+
+    months = {}
+    for (sedol7, year, month), eps in monthly_eps.items():
+        if (year, month) in cpi:
+            months.setdefault(sedol7, []).append(
+                ((year, month), eps * latest_cpi_index / cpi[year, month])
+            )
+
+    # the latest 120 months, only those securities that have all of them
+    agg_eps = {}
+    for sedol7, security_months in months.items():
+        security_months.sort(reverse=True)
+        if len(security_months) >= 120:
+            agg_eps[sedol7] = sum(eps for _, eps in security_months[:120])
+    return agg_eps
+
+
+@pytest.mark.parametrize("date", OBSERVE_DATES)
+def test_cape_eps_matches_per_date_construction(in_synthetic_data, date):
+    sector = CapeSector()
+    expected = get_reference_cape_eps(sector, date)
+
+    eps_df = sector.get_cape_eps(date).sort("sedol7")
+    assert eps_df.get_column("sedol7").to_list() == sorted(expected)
+    np.testing.assert_allclose(
+        eps_df.get_column("agg_eps").to_numpy(),
+        [expected[sedol7] for sedol7 in sorted(expected)],
+        rtol=1e-6,
+    )
+    np.testing.assert_allclose(
+        eps_df.get_column("avg_eps").to_numpy(),
+        eps_df.get_column("agg_eps").to_numpy() / 10,
+    )
+
+
+def test_cape_eps_skips_annual_months_not_known_yet(tmp_path, monkeypatch):
+    """
+    a missing quarterly report leaves months covered by an annual report
+    that is not announced yet, they are skipped rather than used
+    """
+    write_synthetic_data(tmp_path, 11, 2)
+    monkeypatch.chdir(tmp_path)
+    # the eps panel of the shared data set is cached, build it from this one
+    monkeypatch.setattr(cape, "_eps_panel", None)
+    sector = CapeSector()
+    sedol7 = get_sedols(11)[0]
+    eps_df = pl.read_parquet(sector.eps_quarterly_table).with_columns(
+        pl.when(
+            (pl.col("sedol7") == sedol7)
+            & (pl.col("date") == datetime.date(2021, 3, 31))
+        )
+        .then(None)
+        .otherwise(pl.col("eps"))
+        .alias("eps")
+    )
+    eps_df.write_parquet(sector.eps_quarterly_table)
+
+    # the 2021 quarters up to 9/30 are known, the 2021 annual report is not
+    date = datetime.date(2022, 1, 3)
+    assert sector.get_quarter_report_cutoff(date) == datetime.date(2021, 9, 30)
+    assert sector.get_annual_report_cutoff(date) == datetime.date(2020, 12, 31)
+    expected = get_reference_cape_eps(sector, date)
+
+    eps_df = sector.get_cape_eps(date).sort("sedol7")
+    assert eps_df.get_column("sedol7").to_list() == sorted(expected)
+    np.testing.assert_allclose(
+        eps_df.get_column("agg_eps").to_numpy(),
+        [expected[sedol7] for sedol7 in sorted(expected)],
+        rtol=1e-6,
+    )
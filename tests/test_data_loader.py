@@ -0,0 +1,190 @@
+import datetime
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+from polars.testing import assert_frame_equal, assert_series_equal
+
+from src.data_loader import (
+    get_sedol_return,
+    write_cape_us_sedol_return_data,
+    write_security_max_price_data,
+)
+from src.market import Market
+from src.perf.bench import get_universe
+from src.perf.synthetic_data import write_synthetic_data
+from src.sector.cape import CapeSector
+from src.sector.fifty_two_week_high import FiftyTwoWeekHighSector
+from src.sector.max_price import SECURITY_MAX_PRICE_TABLE
+
+# open days of two weeks of 2020, 2020-01-20 is martin luther king day
+OPEN_DATES = [
+    datetime.date(2020, 1, day) for day in [2, 3, 6, 7, 8, 9, 10, 13, 14, 15, 16, 17]
+] + [datetime.date(2020, 1, 21)]
+
+
+def get_open_date_df():
+    return pl.DataFrame({"date": OPEN_DATES})
+
+
+def get_price_df(rows):
+    return pl.DataFrame(
+        rows,
+        schema={"sedol7": pl.String, "date": pl.Date, "price": pl.Float32},
+        orient="row",
+    )
+
+
+def test_sedol_return_monday_gap_and_holiday():
+    price_df = get_price_df(
+        [
+            # not sorted, the sort is not skipped
+            ("B", datetime.date(2020, 1, 3), 50.0),
+            ("B", datetime.date(2020, 1, 2), 40.0),
+            ("A", datetime.date(2020, 1, 2), 10.0),
+            # friday, monday
+            ("A", datetime.date(2020, 1, 3), 11.0),
+            ("A", datetime.date(2020, 1, 6), 12.1),
+            # a gap: no price on 1/7 and 1/9, a null price on 1/8
+            ("A", datetime.date(2020, 1, 8), None),
+            ("A", datetime.date(2020, 1, 10), 13.31),
+            # saturday is not an open day
+            ("A", datetime.date(2020, 1, 11), 99.0),
+            # holiday monday is skipped, tuesday is against friday
+            ("A", datetime.date(2020, 1, 17), 10.0),
+            ("A", datetime.date(2020, 1, 20), 99.0),
+            ("A", datetime.date(2020, 1, 21), 12.0),
+        ]
+    )
+    result = get_sedol_return(price_df, get_open_date_df())
+    expected = pl.DataFrame(
+        {
+            "sedol7": ["A", "A", "A", "A", "A", "B"],
+            "date": [
+                datetime.date(2020, 1, 3),
+                datetime.date(2020, 1, 6),
+                datetime.date(2020, 1, 10),
+                datetime.date(2020, 1, 17),
+                datetime.date(2020, 1, 21),
+                datetime.date(2020, 1, 3),
+            ],
+            "return": [0.1, 0.1, 0.1, 10.0 / 13.31 - 1, 0.2, 0.25],
+        },
+        schema_overrides={"return": pl.Float32},
+    )
+    assert_frame_equal(
+        result.select("sedol7", "date", "return"), expected, check_exact=False
+    )
+    # the running sum of return per sedol
+    cum_return = np.cumsum(expected.get_column("return").to_numpy()[:5])
+    np.testing.assert_allclose(
+        result.filter(pl.col("sedol7") == "A").get_column("cum_return"),
+        cum_return,
+        rtol=1e-6,
+    )
+
+
+def test_sedol_return_agrees_with_the_next_day_join():
+    """
+    the previous calendar day join only has the returns of consecutive days,
+    which are the same as the ones against the previous open day
+    """
+    rng = np.random.default_rng(0)
+    dates = pl.date_range(
+        datetime.date(2020, 1, 1), datetime.date(2020, 12, 31), eager=True
+    )
+    open_date_df = pl.DataFrame({"date": dates}).filter(
+        pl.col("date").dt.weekday() <= 5
+    )
+    price_df = (
+        open_date_df.join(pl.DataFrame({"sedol7": ["A", "B", "C"]}), how="cross")
+        .with_columns(
+            pl.Series("price", rng.lognormal(3, 0.1, len(open_date_df) * 3)).cast(
+                pl.Float32
+            )
+        )
+        .sample(fraction=0.9, seed=0)
+    )
+    prev_df = price_df.select(
+        (pl.col("date") + datetime.timedelta(days=1)).alias("date"),
+        pl.col("sedol7"),
+        pl.col("price").alias("prev_price"),
+    )
+    join_df = price_df.join(prev_df, on=["sedol7", "date"], how="inner").select(
+        "sedol7",
+        "date",
+        ((pl.col("price") - pl.col("prev_price")) / pl.col("prev_price")).alias(
+            "join_return"
+        ),
+    )
+    result = get_sedol_return(price_df, open_date_df).join(
+        join_df, on=["sedol7", "date"], how="inner"
+    )
+    assert len(result) == len(join_df)
+    np.testing.assert_allclose(
+        result.get_column("return"), result.get_column("join_return"), rtol=1e-5
+    )
+    # mondays are only found against the previous open day
+    mondays = get_sedol_return(price_df, open_date_df).filter(
+        pl.col("date").dt.weekday() == 1
+    )
+    assert len(mondays) > 0
+
+
+def test_cum_return_is_the_range_prefix(in_synthetic_data):
+    _, start_date, end_date = in_synthetic_data
+    universe = get_universe(11)
+    market = Market(universe, start_date, end_date)
+    assert "cum_return" in market.data.columns
+
+    # cum_return - return is the cum_return of the previous row of the sedol
+    prefix_df = market.data.sort("sedol7", "date").with_columns(
+        (pl.col("cum_return") - pl.col("return").cast(pl.Float64)).alias(
+            "prefix_before"
+        ),
+        pl.col("cum_return").shift(1).over("sedol7").alias("prev_cum_return"),
+    )
+    np.testing.assert_allclose(
+        prefix_df.drop_nulls("prev_cum_return").get_column("prefix_before"),
+        prefix_df.drop_nulls("prev_cum_return").get_column("prev_cum_return"),
+        atol=1e-9,
+    )
+
+    # the same range returns as the prefix recomputed from the daily return
+    recomputed = Market(universe, start_date, end_date)
+    recomputed.data = recomputed.data.drop("cum_return")
+    rng = np.random.default_rng(0)
+    dates = market.data.get_column("date").unique().sort().to_list()
+    securities = [universe[i] for i in rng.integers(0, len(universe), 200)]
+    start_dates = [dates[i] for i in rng.integers(0, len(dates) // 2, 200)]
+    end_dates = [dates[i] for i in rng.integers(len(dates) // 2, len(dates), 200)]
+    np.testing.assert_allclose(
+        market.query_range_returns(securities, start_dates, end_dates),
+        recomputed.query_range_returns(securities, start_dates, end_dates),
+        atol=1e-9,
+    )
+    assert market.range_prefix_before[0] != recomputed.range_prefix_before[0]
+
+
+def test_second_stage_reads_the_price_table_of_the_sectors(tmp_path, monkeypatch):
+    """
+    the second ingestion stage is derived from the price table read by
+    CapeSector and FiftyTwoWeekHighSector, see INGESTION_STAGES
+    """
+    write_synthetic_data(tmp_path, 11, 2)
+    monkeypatch.chdir(tmp_path)
+    return_table = Path("parquet/fund_return/us_security_sedol_return_daily.parquet")
+    max_price_table = Path(SECURITY_MAX_PRICE_TABLE)
+    return_table.unlink()
+    max_price_table.unlink()
+
+    write_cape_us_sedol_return_data()
+    write_security_max_price_data()
+
+    price_table = CapeSector().price_table
+    assert FiftyTwoWeekHighSector().price_table == price_table
+    sedols = pl.read_parquet(price_table).get_column("sedol7").unique().sort()
+    for table in [return_table, max_price_table]:
+        assert_series_equal(
+            pl.read_parquet(table).get_column("sedol7").unique().sort(), sedols
+        )
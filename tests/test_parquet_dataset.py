@@ -0,0 +1,123 @@
+import datetime
+
+import polars as pl
+from polars.testing import assert_frame_equal
+
+from src.parquet_dataset import (
+    append_monthly_table,
+    get_dataset_vintage,
+    get_max_date,
+    get_partition_years,
+    read_manifest,
+    scan_monthly_table,
+    scan_year_partitions,
+    write_monthly_table,
+    write_year_partitions,
+)
+
+
+def get_daily_df(years):
+    return pl.DataFrame(
+        {
+            "id": ["a", "b"] * len(years),
+            "date": [datetime.date(year, 6, 30) for year in years for _ in range(2)],
+            "value": [float(i) for i in range(2 * len(years))],
+        }
+    )
+
+
+def get_monthly_df(years):
+    return pl.DataFrame(
+        {
+            "sedol7": ["a"] * 12 * len(years),
+            "date": [
+                datetime.date(year, month, 28)
+                for year in years
+                for month in range(1, 13)
+            ],
+            "roe": [float(i) for i in range(12 * len(years))],
+        }
+    )
+
+
+def test_full_write_removes_stale_partitions(tmp_path):
+    root = tmp_path / "price"
+    write_year_partitions(get_daily_df([2019, 2020, 2021]), root, "id", "date")
+    data = get_daily_df([2020, 2021])
+    write_year_partitions(data, root, "id", "date")
+    assert get_partition_years(root) == [2020, 2021]
+    assert not (root / "year=2019").exists()
+    assert_frame_equal(
+        scan_year_partitions(root).collect().sort("id", "date"), data.sort("id", "date")
+    )
+
+
+def test_merge_keeps_other_partitions(tmp_path):
+    root = tmp_path / "price"
+    write_year_partitions(get_daily_df([2019, 2020]), root, "id", "date")
+    write_year_partitions(get_daily_df([2021]), root, "id", "date", merge=True)
+    assert get_partition_years(root) == [2019, 2020, 2021]
+
+
+def test_full_monthly_write_removes_stale_partitions(tmp_path):
+    root = tmp_path / "roe"
+    write_monthly_table(get_monthly_df([2018, 2019, 2020]), root)
+    data = get_monthly_df([2019, 2020])
+    write_monthly_table(data, root)
+    assert get_partition_years(root) == [2019, 2020]
+    result = scan_monthly_table(root, datetime.date(2018, 1, 1)).collect()
+    assert_frame_equal(result.drop("month"), data)
+
+
+def test_vintage_only_changes_with_the_data(tmp_path):
+    root = tmp_path / "roe"
+    write_monthly_table(get_monthly_df([2019, 2020]), root)
+    vintage = get_dataset_vintage(root)
+    assert vintage.startswith("00001-")
+
+    # the same data rewritten keeps the vintage and the manifest
+    manifest = (root / "_manifest.json").read_text()
+    write_monthly_table(get_monthly_df([2019, 2020]), root)
+    assert (root / "_manifest.json").read_text() == manifest
+
+    write_monthly_table(
+        get_monthly_df([2019, 2020]).with_columns(pl.col("roe") + 1), root
+    )
+    assert get_dataset_vintage(root).startswith("00002-")
+    assert get_dataset_vintage(root) != vintage
+
+
+def test_append_adds_a_vintage(tmp_path):
+    root = tmp_path / "roe"
+    write_monthly_table(get_monthly_df([2019]), root)
+    append_monthly_table(get_monthly_df([2020]), root)
+    manifest = read_manifest(root)
+    assert [vintage["sequence"] for vintage in manifest] == [1, 2]
+    assert manifest[-1]["files"] == ["year=2020/part-00002.parquet"]
+    assert get_max_date(root) == datetime.date(2020, 12, 28)
+
+
+def test_full_write_resets_the_max_date(tmp_path):
+    root = tmp_path / "roe"
+    write_monthly_table(get_monthly_df([2019, 2020]), root)
+    write_monthly_table(get_monthly_df([2019]), root)
+    start_date = get_max_date(root)
+    assert start_date == datetime.date(2019, 12, 28)
+
+    # an incremental refresh appends the months after the max date
+    data = get_monthly_df([2019, 2020]).filter(pl.col("date") > start_date)
+    append_monthly_table(data, root)
+    assert get_max_date(root) == datetime.date(2020, 12, 28)
+    assert_frame_equal(
+        scan_monthly_table(root).collect().drop("month").sort("date"),
+        get_monthly_df([2019, 2020]),
+    )
+
+
+def test_full_year_partition_write_resets_the_max_date(tmp_path):
+    root = tmp_path / "price"
+    write_year_partitions(get_daily_df([2019, 2020]), root, "id", "date")
+    write_year_partitions(get_daily_df([2021]), root, "id", "date", merge=True)
+    assert get_max_date(root) == datetime.date(2021, 6, 30)
+    write_year_partitions(get_daily_df([2019]), root, "id", "date")
+    assert get_max_date(root) == datetime.date(2019, 6, 30)
@@ -0,0 +1,96 @@
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.perf.bench import get_universe
+from src.portfolio import Portfolio
+
+
+def get_portfolio(in_synthetic_data, securities):
+    _, start_date, end_date = in_synthetic_data
+    portfolio = Portfolio(100.0, start_date, end_date)
+    for security in securities:
+        portfolio.add_security_weight(security, 0.9 / len(securities), 0)
+    return portfolio
+
+
+def get_returns(num_days, num_securities):
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0005, 0.02, (num_days, num_securities))
+    # the last security is wiped out in the middle
+    returns[num_days // 2, -1] = -1.0
+    return returns
+
+
+def test_mark_to_market_matches_per_security_update(in_synthetic_data):
+    securities = get_universe(5)
+    batched = get_portfolio(in_synthetic_data, securities)
+    single = get_portfolio(in_synthetic_data, securities)
+    num_days = len(batched.date_df)
+    returns = get_returns(num_days, len(securities))
+
+    for iter_index in range(1, num_days):
+        hold = batched.hold_securities(iter_index - 1)
+        assert hold == single.hold_securities(iter_index - 1)
+        columns = [securities.index(security) for security in hold]
+        batched.mark_to_market(iter_index, hold, returns[iter_index, columns])
+        for security, column in zip(hold, columns):
+            single.update_security_value(
+                security, iter_index, returns[iter_index, column]
+            )
+        single.update_portfolio(iter_index)
+
+    assert len(batched.hold_securities(num_days - 1)) == len(securities) - 1
+    batched.finish()
+    single.finish()
+    # the total value sums the holdings in another order, the same up to rounding
+    assert_frame_equal(
+        batched.value_book.drop("value"),
+        single.value_book.drop("value"),
+        check_exact=True,
+    )
+    np.testing.assert_allclose(
+        batched.value_book.get_column("value"),
+        single.value_book.get_column("value"),
+        rtol=1e-12,
+    )
+    for security in securities:
+        assert_frame_equal(
+            batched.security_book[security].drop("weight"),
+            single.security_book[security].drop("weight"),
+            check_exact=True,
+        )
+        np.testing.assert_allclose(
+            batched.security_book[security].get_column("weight"),
+            single.security_book[security].get_column("weight"),
+            rtol=1e-12,
+        )
+
+
+def test_finish_exports_the_books(in_synthetic_data):
+    securities = get_universe(3)
+    portfolio = get_portfolio(in_synthetic_data, securities)
+    portfolio.finish()
+    assert portfolio.value_book.columns == [
+        "index",
+        "date",
+        "cash",
+        "value",
+        "turnover",
+        "sector",
+    ]
+    assert portfolio.value_book.get_column("value").item(0) == 100.0
+    assert portfolio.value_book.get_column("cash").item(0) == pytest.approx(10.0)
+    for security in securities:
+        security_df = portfolio.security_book[security]
+        assert security_df.columns == ["index", "date", "weight", "value"]
+        assert security_df.get_column("weight").item(0) == 0.9 / 3
+    assert len(portfolio.event_book) == 0
+    assert dict(portfolio.event_book.schema) == {
+        "date": pl.Date,
+        "event": pl.String,
+        "security": pl.String,
+        "sector": pl.String,
+        "weight_change": pl.Float64,
+    }
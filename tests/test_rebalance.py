@@ -0,0 +1,113 @@
+import datetime
+import types
+
+import polars as pl
+import pytest
+
+from src.rebalance import Rebalance
+
+# market open days across two year boundaries, without new year's day
+DATES = [
+    date
+    for date in pl.date_range(
+        datetime.date(2019, 11, 1), datetime.date(2021, 2, 26), eager=True
+    ).to_list()
+    if date.weekday() < 5 and (date.month, date.day) != (1, 1)
+]
+
+
+def get_rebalance(period, interval):
+    portfolio = types.SimpleNamespace(date_df=pl.DataFrame({"date": DATES}))
+    return Rebalance(period, portfolio, None, [], interval)
+
+
+def get_period_ends(period_key, period):
+    """
+    indices of the last market open day of every period-th period after the
+    period of the first day, the last day excluded
+    """
+    keys = [period_key(date) for date in DATES]
+    numbers = [0]
+    for index in range(1, len(DATES)):
+        numbers.append(numbers[-1] + (keys[index] != keys[index - 1]))
+    return [
+        index
+        for index in range(len(DATES) - 1)
+        if keys[index] != keys[index + 1]
+        and numbers[index] > 0
+        and numbers[index] % period == 0
+    ]
+
+
+def run_schedule(rebalance):
+    """
+    rebalance days found by stepping day by day, no stop gain/loss
+    """
+    schedule = []
+    prev_rebalance_index = 0
+    for iter_index in range(1, len(DATES)):
+        if rebalance.is_rebalance_day(iter_index, prev_rebalance_index):
+            schedule.append(iter_index)
+            prev_rebalance_index = iter_index
+    return schedule
+
+
+@pytest.mark.parametrize("period", [1, 2, 5])
+def test_daily_schedule(period):
+    rebalance = get_rebalance(period, "1d")
+    expected = [index for index in range(1, len(DATES) - 1) if index % period == 0]
+    assert rebalance.get_schedule() == expected
+    assert run_schedule(rebalance) == expected
+
+
+@pytest.mark.parametrize(
+    "interval, period_key",
+    [
+        ("1w", lambda date: date.isocalendar()[:2]),
+        ("1mo", lambda date: (date.year, date.month)),
+        ("1q", lambda date: (date.year, (date.month - 1) // 3)),
+    ],
+)
+@pytest.mark.parametrize("period", [1, 2, 3])
+def test_period_end_schedule(interval, period_key, period):
+    rebalance = get_rebalance(period, interval)
+    expected = get_period_ends(period_key, period)
+    assert len(expected) > 0
+    assert rebalance.get_schedule() == expected
+    assert run_schedule(rebalance) == expected
+
+
+def get_schedule_dates(interval):
+    return [DATES[index] for index in get_rebalance(1, interval).get_schedule()]
+
+
+def test_schedule_across_year_boundary():
+    assert datetime.date(2019, 12, 31) in get_schedule_dates("1mo")
+    assert datetime.date(2020, 1, 31) in get_schedule_dates("1mo")
+    assert datetime.date(2020, 12, 31) in get_schedule_dates("1q")
+    assert datetime.date(2021, 1, 29) not in get_schedule_dates("1q")
+    # the week of 2020-12-28 ends on 2020-12-31, 2021-01-01 is not open
+    assert datetime.date(2020, 12, 31) in get_schedule_dates("1w")
+    assert datetime.date(2021, 1, 8) in get_schedule_dates("1w")
+
+
+def test_month_diff_counts_every_year():
+    """
+    the period diff of two days is the number of months between them,
+    also when they are more than one year boundary apart
+    """
+    rebalance = get_rebalance(13, "1mo")
+    prev_rebalance_index = DATES.index(datetime.date(2019, 12, 31))
+    assert rebalance.is_rebalance_day(
+        DATES.index(datetime.date(2021, 1, 29)), prev_rebalance_index
+    )
+    # month diff of 1 if only the month and one year boundary were counted
+    assert not get_rebalance(1, "1mo").is_rebalance_day(
+        DATES.index(datetime.date(2021, 1, 29)), prev_rebalance_index
+    )
+
+
+def test_last_day_never_rebalances():
+    for interval in ["1d", "1w", "1mo", "1q"]:
+        rebalance = get_rebalance(1, interval)
+        assert not rebalance.is_rebalance_day(len(DATES) - 1, len(DATES) - 2)
@@ -0,0 +1,40 @@
+import datetime
+
+import pytest
+
+from src import sweep
+
+START_DATE = datetime.date(2020, 1, 31)
+END_DATE = datetime.date(2020, 12, 31)
+
+
+def test_build_grid_skips_unsupported_universes():
+    with pytest.warns(UserWarning, match="FiftyTwoWeekHighEtfFactor"):
+        grid = sweep.build_grid(
+            ["RoeFactor", "FiftyTwoWeekHighEtfFactor"],
+            ["INVESCO_SECTOR_ETF_TICKER", "INVESCO_SECTOR_ETF_LIPPER"],
+        )
+    assert [(config["factor"], config["universe"]) for config in grid] == [
+        ("RoeFactor", "INVESCO_SECTOR_ETF_TICKER"),
+        ("RoeFactor", "INVESCO_SECTOR_ETF_LIPPER"),
+        ("FiftyTwoWeekHighEtfFactor", "INVESCO_SECTOR_ETF_TICKER"),
+    ]
+
+
+def test_build_grid_without_supported_pairs():
+    with pytest.raises(ValueError):
+        sweep.build_grid(["FiftyTwoWeekHighEtfFactor"], ["INVESCO_SECTOR_ETF_LIPPER"])
+
+
+def test_failed_backtest_is_a_result_row(monkeypatch):
+    def get_market(universe, start_date, end_date):
+        raise FileNotFoundError("no return data")
+
+    monkeypatch.setattr(sweep, "get_market", get_market)
+    config = sweep.build_grid(["RoeFactor"], ["INVESCO_SECTOR_ETF_TICKER"])[0]
+    row = sweep.run_backtest(config, START_DATE, END_DATE)
+    assert row == {
+        **config,
+        **{metric: None for metric in sweep.METRICS},
+        "error": "FileNotFoundError: no return data",
+    }